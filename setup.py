@@ -7,5 +7,9 @@ setup(
     author='Donald Dole',
     author_email='donald.dole@nist.gov',
     description='Utilities for interfacing with thermometers and thermocouples',
-    install_requires=['numpy', 'pyvisa']
+    install_requires=['numpy', 'pyvisa'],
+    entry_points={
+        'console_scripts': ['tc-tools = tc_tools.cli:main',
+                            'tc-tools-benchmark = tc_tools.benchmark:main']
+    }
 )
\ No newline at end of file
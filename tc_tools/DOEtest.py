@@ -3,127 +3,330 @@ import logging
 import os
 import sys
 import time
-from multiprocessing import Process
-
-import tc_tools.instruments as i
-import tc_tools.procedures as p
-import tc_tools.utils as u
+from threading import Thread
+from typing import List
 
 data_headers = ['Elapsed', 'Draw Status', 'Inst. Tank Avg', 'Tank 1',
                 'Tank 2', 'Tank 3', 'Tank 4', 'Tank 5', 'Tank 6',
                 'Inlet', 'Outlet', 'Ambient', 'RH', 'Power',
-                'Energy']
+                'Energy', 'Volts', 'Amps']
 
 draw_headers = ['Elapsed', 'Inlet Temperature', 'Outlet Temperature',
                 'Scale Weight']
 
-parser = argparse.ArgumentParser()
-parser.add_argument('-daq', '--daq_address', type=str, dest='daq',
-                    default='GPIB0::9::INSTR', help='VISA address of the DAQ')
-parser.add_argument('-pmr', '--power_meter_address', type=str, dest='pmr',
-                    default='ASRL1::INSTR', help='VISA address of the PRT')
-parser.add_argument('-o', '--output_file', type=str, dest='o',
-                    help='Output file name or path', default='data.csv')
-parser.add_argument('-dr', '--draw_file', type=str, dest='dr',
-                    help='Draw file name or path', default='draws.csv')
-parser.add_argument('-sh', '--schedule_file', type=str, dest='sh',
-                    help='Output file name or path', default='schedule.csv')
-parser.add_argument('-tc', '--tank_channels', nargs='+', dest='tc',
-                    help='Channels')
-parser.add_argument('-ic', '--inlet_channel', type=int, dest='ic',
-                    help='Tank inlet thermocouple channel')
-parser.add_argument('-oc', '--outlet_channel', type=int, dest='oc',
-                    help='Tank outlet thermocouple channel')
-parser.add_argument('-sc', '--scale_channel', type=int, dest='sc',
-                    help='Channel of the scale connected to the DAQ')
-parser.add_argument('-ds', '--draw_solenoid', type=int, dest='ds',
-                    help='Channel of the draw solenoid')
-parser.add_argument('-ws', '--tank_channel', type=int, dest='ws',
-                    help='Channel of the weigh tank solenoid')
-parser.add_argument('-vc', '--valve_channel', type=int, dest='vc',
-                    help='Channel of the Belimo flow valve')
-parser.add_argument('-rhc', '--rh_channel', type=int, dest='rhc',
-                    help='Channel of the RH sensor')
-parser.add_argument('-dhd', '--draw_headers', nargs='+', dest='dhd',
-                    help='Headers for the output file in the same order as the'
-                         ' channel inputs', default=draw_headers)
-parser.add_argument('-ohd', '--out_headers', nargs='+', dest='ohd',
-                    help='Headers for the output file in the same order as the'
-                         ' channel inputs', default=data_headers)
-in_args = parser.parse_args()
-name, _ = os.path.splitext(in_args.o)
-
-logging.basicConfig(level=logging.INFO,
-                    format='%(asctime)s %(name)-12s %(levelname)-8s %('
-                           'message)s',
-                    datefmt='%m-%d %H:%M',
-                    filename=name + '.log',
-                    filemode='w')
-console = logging.StreamHandler()
-console.setLevel(logging.INFO)
-formatter = logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s')
-console.setFormatter(formatter)
-logging.getLogger('').addHandler(console)
-
-try:
-    schedule_file = os.path.abspath(in_args.sc)
-    output_file = os.path.abspath(in_args.o)
-    draw_file = os.path.abspath(in_args.dr)
-    logging.info('Files initialized')
-except Exception as e:
-    print(str(e))
-    sys.exit('Invalid file name or path')
-
-try:
-    daq = i.DAQ(in_args.daq)
-    pmr = i.PowerMeter(in_args.pmr)
-except Exception as e:
-    print(str(e))
-    sys.exit('Error initializing instruments')
-
-try:
-    draw_solenoid = i.Solenoid(daq, in_args.ds)
-    weigh_solenoid = i.Solenoid(daq, in_args.ws)
-    flow_valve = i.BelimoValve(daq, in_args.vc)
-    scale = i.MTScale(daq, in_args.sc)
-    rh_sensor = i.HumiditySensor(daq, in_args.rhc)
-except Exception as e:
-    print(str(e))
-    sys.exit('Error initializing channel instruments')
-
-try:
-    draw_writer = u.DrawWriter(in_args.dhd, output_file, in_args.ic, in_args.oc,
-                               daq, scale)
-    min_writer = u.SimulatedUseWriter(in_args.ohd, draw_file, daq, rh_sensor,
-                                      pmr)
-except Exception as e:
-    print(str(e))
-    sys.exit('Error initializing writers')
 
-if __name__ == '__main__':
-    schedule = p.parse_schedule(schedule_file)
-    start_time = time.time()
-    elapsed = 0.0
-    draw_num = 1
-    draws_finished = False
-    draw_process = Process()
+def add_arguments(parser: argparse.ArgumentParser):
+    """Adds the simulated use test's arguments to a parser"""
+    parser.add_argument('-daq', '--daq_address', type=str, dest='daq',
+                        default='GPIB0::9::INSTR',
+                        help='VISA address of the DAQ')
+    parser.add_argument('-pmr', '--power_meter_address', type=str, dest='pmr',
+                        default='ASRL1::INSTR', help='VISA address of the PRT')
+    parser.add_argument('-o', '--output_file', type=str, dest='o',
+                        help='Output file name or path', default='data.csv')
+    parser.add_argument('-dr', '--draw_file', type=str, dest='dr',
+                        help='Draw file name or path', default='draws.csv')
+    parser.add_argument('-sh', '--schedule_file', type=str, dest='sh',
+                        help='Output file name or path',
+                        default='schedule.csv')
+    parser.add_argument('-tc', '--tank_channels', nargs='+', dest='tc',
+                        help='Channels')
+    parser.add_argument('-ic', '--inlet_channel', type=int, dest='ic',
+                        help='Tank inlet thermocouple channel')
+    parser.add_argument('-oc', '--outlet_channel', type=int, dest='oc',
+                        help='Tank outlet thermocouple channel')
+    parser.add_argument('-ac', '--ambient_channel', type=int, dest='ac',
+                        help='Ambient air thermocouple channel')
+    parser.add_argument('-sc', '--scale_channel', type=int, dest='sc',
+                        help='Channel of the scale connected to the DAQ')
+    parser.add_argument('-ds', '--draw_solenoid', type=int, dest='ds',
+                        help='Channel of the draw solenoid')
+    parser.add_argument('-ws', '--tank_channel', type=int, dest='ws',
+                        help='Channel of the weigh tank solenoid')
+    parser.add_argument('-vc', '--valve_channel', type=int, dest='vc',
+                        help='Channel of the Belimo flow valve')
+    parser.add_argument('-rhc', '--rh_channel', type=int, dest='rhc',
+                        help='Channel of the RH sensor')
+    parser.add_argument('-dhd', '--draw_headers', nargs='+', dest='dhd',
+                        help='Headers for the output file in the same order '
+                             'as the channel inputs', default=draw_headers)
+    parser.add_argument('-ohd', '--out_headers', nargs='+', dest='ohd',
+                        help='Headers for the output file in the same order '
+                             'as the channel inputs', default=data_headers)
+    parser.add_argument('-mp', '--metrics_port', type=int, dest='mp',
+                        help='Serve live metrics on this local HTTP port')
+    parser.add_argument('-mf', '--metrics_file', type=str, dest='mf',
+                        help='Periodically rewrite live metrics to this file')
+    parser.add_argument('-tv', '--tank_volume', type=float, dest='tv',
+                        help='Measured tank volume in gallons; enables live '
+                             'rating updates')
+    parser.add_argument('-pi', '--power_interval', type=float, dest='pi',
+                        default=5.0, help='Seconds between power samples for '
+                                          'host-side energy integration')
+    parser.add_argument('-fb', '--frame_bus', type=str, dest='fb',
+                        help='Name the shared memory every sampled frame '
+                             'is published to, so live consumers in other '
+                             'processes can attach')
+    parser.add_argument('-r', '--resume', action='store_true', dest='resume',
+                        help='Resume an interrupted test from its journal')
+    parser.add_argument('-jl', '--json_log', action='store_true', dest='jl',
+                        help='Write the log file as JSON lines')
+    parser.add_argument('-dry', '--dry_run', action='store_true',
+                        dest='dry_run', help='Check the arguments and '
+                        'schedule without connecting to instruments')
+
+
+def check(in_args: argparse.Namespace) -> List[str]:
+    """
+    Checks the arguments without touching instruments
+
+    :param in_args: parsed arguments
+    :return: a description of each problem found
+    """
+    from tc_tools.utils import parse_schedule
+    problems = []
+    channels = {'-tc': in_args.tc, '-ic': in_args.ic, '-oc': in_args.oc,
+                '-ac': in_args.ac, '-sc': in_args.sc, '-ds': in_args.ds,
+                '-ws': in_args.ws, '-vc': in_args.vc, '-rhc': in_args.rhc}
+    for flag, channel in channels.items():
+        if channel is None:
+            problems.append('Missing channel {}'.format(flag))
+    if in_args.tc is not None:
+        # Elapsed, draw status, tank average, the tank, inlet, outlet and
+        # ambient channels, RH, and power, energy, volts and amps
+        columns = len(in_args.tc) + 11
+        if len(in_args.ohd) != columns:
+            problems.append('{} output headers given for {} columns'.format(
+                len(in_args.ohd), columns))
+    try:
+        schedule = parse_schedule(os.path.abspath(in_args.sh))
+        if not schedule.time:
+            problems.append('Schedule {} has no draws'.format(in_args.sh))
+    except (OSError, ValueError, IndexError) as e:
+        problems.append('Cannot read schedule {}: {}'.format(in_args.sh, e))
+    for path in (in_args.o, in_args.dr):
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            problems.append('No directory for {}'.format(path))
+    name, _ = os.path.splitext(in_args.o)
+    if in_args.resume and not os.path.isfile(name + '.journal'):
+        problems.append('No journal to resume: {}'.format(name + '.journal'))
+    return problems
+
+
+def run(in_args: argparse.Namespace):
+    """Runs the simulated use test"""
+    if in_args.dry_run:
+        problems = check(in_args)
+        for problem in problems:
+            print(problem)
+        sys.exit(1 if problems else 0)
+
+    # Imported here so --help and --dry_run don't load pyvisa and NumPy
+    import tc_tools.analysis as a
+    import tc_tools.framebus as f
+    import tc_tools.instruments as i
+    import tc_tools.journal as j
+    import tc_tools.metrics as m
+    import tc_tools.power as pw
+    import tc_tools.procedures as p
+    import tc_tools.sampling as s
+    import tc_tools.tank as t
+    import tc_tools.utils as u
+    from tc_tools.log import setup_logging
+
+    name, _ = os.path.splitext(in_args.o)
+
+    setup_logging(name + '.log', structured=in_args.jl, append=in_args.resume)
+
+    try:
+        schedule_file = os.path.abspath(in_args.sh)
+        output_file = os.path.abspath(in_args.o)
+        draw_file = os.path.abspath(in_args.dr)
+        logging.info('Files initialized')
+    except Exception as e:
+        print(str(e))
+        sys.exit('Invalid file name or path')
+
+    try:
+        daq = i.DAQ(in_args.daq)
+        pmr = i.PowerMeter(in_args.pmr)
+        # Columns of the minutely file: tank, inlet, outlet, ambient
+        daq.set_channels(in_args.tc + [str(c) for c in
+                                       (in_args.ic, in_args.oc, in_args.ac)])
+    except Exception as e:
+        print(str(e))
+        sys.exit('Error initializing instruments')
+
+    try:
+        draw_solenoid = i.Solenoid(daq, in_args.ds)
+        weigh_solenoid = i.Solenoid(daq, in_args.ws)
+        flow_valve = i.BelimoValve(daq, in_args.vc)
+        scale = i.MTScale(daq, in_args.sc)
+        rh_sensor = i.HumiditySensor(daq, in_args.rhc)
+    except Exception as e:
+        print(str(e))
+        sys.exit('Error initializing channel instruments')
+
+    try:
+        draw_writer = u.DrawWriter(in_args.dhd, draw_file, in_args.ic,
+                                   in_args.oc, daq, scale)
+        tank_state = t.TankState(in_args.tc, in_args.tv,
+                                 inlet_channel=in_args.ic)
+        min_writer = u.SimulatedUseWriter(in_args.ohd, output_file, daq,
+                                          rh_sensor, pmr, tank_state)
+    except Exception as e:
+        print(str(e))
+        sys.exit('Error initializing writers')
+
+    if in_args.mp:
+        m.MetricsServer(port=in_args.mp).start()
+    if in_args.mf:
+        m.MetricsFile(os.path.abspath(in_args.mf)).start()
+
+    journal_file = name + '.journal'
+    if in_args.resume:
+        try:
+            state = j.replay(journal_file)
+        except (OSError, ValueError) as e:
+            sys.exit('Cannot resume: {}'.format(e))
+        if state.finished:
+            sys.exit('The journaled test already finished')
+        if state.interrupted_draw is not None:
+            logging.warning('Draw {} was interrupted and will not be '
+                            'repeated'.format(state.interrupted_draw))
+        logging.info('Resuming at {:.0f} s, draw {}'.format(state.elapsed,
+                                                             state.next_draw))
+    else:
+        state = None
+    journal = j.Journal(journal_file)
+
+    # Energy, volts and amps are read once a minute, for the minutely file
+    power_sampler = pw.PowerSampler(
+        pmr, in_args.pi, details_every=max(1, round(60 / in_args.pi)))
+    if state is None:
+        pmr.reset_integration()
+        pmr.start_integration()
+        power_sampler.reset()
+        journal.record('integration', meter_start=power_sampler.meter_start)
+    elif state.meter_start is None:
+        # Without the meter's starting reading there is nothing to
+        # reconcile the host integral against
+        logging.warning('No starting meter energy in the journal; the '
+                        'integrator cross-check is off')
+        power_sampler.reconcile_every = 0
+        power_sampler.energy = state.host_energy
+    else:
+        # The meter keeps integrating through a host restart; reconcile()
+        # flags it if it did not
+        power_sampler.meter_start = state.meter_start
+        power_sampler.energy = state.host_energy
+
+    schedule = u.parse_schedule(schedule_file)
+    if state is None:
+        start_time = time.time()
+        draw_num = 0
+        journal.record('start', start=start_time, schedule=schedule_file,
+                       output=output_file, draws=draw_file)
+    else:
+        # Shift the origin so the schedule continues where it stopped,
+        # costing only the downtime
+        start_time = time.time() - state.elapsed
+        draw_num = state.next_draw
+        journal.record('resume', origin=start_time, elapsed=state.elapsed,
+                       draw=draw_num)
+    min_writer.clock_reset(start_time)
+    elapsed = time.time() - start_time
+    draws_finished = draw_num >= len(schedule.time)
+    # A thread rather than a process so the draw shares instrument locks
+    # and metrics with the minutely loop
+    draw_process = Thread()
+
+    # Draw signals (inlet, outlet, scale) fast and only during draws, power
+    # at the medium rate and the tank, ambient and RH scan slowly, all from
+    # one sampling thread
+    sampler = s.MultiRateSampler([
+        s.SampleGroup('draw', 2, draw_writer.read_data, active=False),
+        s.SampleGroup('power', in_args.pi, power_sampler.read),
+        s.SampleGroup('minutely', 60, min_writer.read_data)])
+
+    def latest_power() -> dict:
+        # The power group is read first at start, so this falls back to the
+        # meter only if its first read failed
+        if not all(q in sampler.latest for q in u.POWER_QUANTITIES):
+            return power_sampler.read()
+        return {q: sampler.latest[q] for q in u.POWER_QUANTITIES}
+
+    min_writer.power = latest_power
+    frame_bus = live_ratings = None
+    # The draw controller, live plots and analytics read frames from the
+    # bus instead of the instruments or the files; it is shared with other
+    # processes only when named
+    signals = [str(c) for c in in_args.tc + [in_args.ic, in_args.oc,
+                                             in_args.ac]]
+    signals += ['tank average', 'tank energy', 'stratification', 'rh',
+                'inlet', 'outlet', 'weight', 'elapsed', 'drawing'] + \
+        u.POWER_QUANTITIES
+    try:
+        frame_bus = f.FrameBus(signals, list(sampler.groups), name=in_args.fb)
+        sampler.subscribe(frame_bus.publish)
+    except OSError as e:
+        logging.error('No frame bus, draws read the sampler: {}'.format(e))
+    if in_args.tv and frame_bus is not None:
+        live_ratings = a.LiveRatings(f.FrameReader(frame_bus), in_args.tv,
+                                     in_args.tc, in_args.ac)
+        if state is not None:
+            # The ratings cover the whole test, not just this run
+            live_ratings.load(output_file, draw_file)
+        live_ratings.start()
+    sampler.start()
+
+    def journaled_draw(n: int):
+        frames = None if frame_bus is None else f.FrameReader(frame_bus)
+        p.draw(schedule.rate[n], schedule.volume[n], draw_solenoid,
+               weigh_solenoid, scale, flow_valve, draw_writer, sampler,
+               frames=frames)
+        journal.record('draw_end', draw=n)
 
     while elapsed < (schedule.time[-1] + 60):
         min_writer.set_drawing(draw_process.is_alive())
-        min_writer.read_data()
         elapsed = time.time() - start_time
-        if (elapsed >= schedule.time[draw_num]) and not draws_finished:
+        min_writer.flush(sync=True)
+        draw_writer.flush(sync=True)
+        journal.record('heartbeat', elapsed=elapsed,
+                       energy=power_sampler.energy)
+        if not draws_finished and elapsed >= schedule.time[draw_num] and \
+                not draw_process.is_alive():
+            journal.record('draw_start', draw=draw_num, elapsed=elapsed)
+            draw_writer.set_draw_num(draw_num)
             # separate thread for the draw process to maintain timing
-            draw_process = Process(target=p.draw,
-                                   args=(schedule.rate[draw_num],
-                                         schedule.volume[draw_num],
-                                         draw_solenoid,
-                                         weigh_solenoid, scale, flow_valve,
-                                         draw_writer))
+            draw_process = Thread(target=journaled_draw, args=(draw_num,))
             draw_process.start()
-        if draw_num == (len(schedule.time) - 1):
-            draws_finished = True
-        else:
-            draw_num += 1
+            if draw_num == (len(schedule.time) - 1):
+                draws_finished = True
+            else:
+                draw_num += 1
         # execute every 60 seconds regardless of how long the above code takes
-        time.sleep(60.0 - ((time.time() - start_time) % 60.0))
+        target = time.time() + 60.0 - ((time.time() - start_time) % 60.0)
+        time.sleep(max(target - time.time(), 0))
+        m.registry.observe_jitter(time.time() - target)
+
+    if draw_process.is_alive():
+        draw_process.join()
+    sampler.stop()
+    if live_ratings is not None:
+        live_ratings.stop()
+    if frame_bus is not None:
+        frame_bus.close()
+    journal.record('finish', elapsed=time.time() - start_time)
+    journal.close()
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    run(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,568 @@
+import csv
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from tc_tools.metrics import registry
+
+if TYPE_CHECKING:
+    from tc_tools.framebus import FrameReader
+
+# Water properties and DOE uniform energy factor test conditions
+CP_WATER = 4184.0  # J/(kg K)
+LB_TO_KG = 0.45359237
+LB_PER_GAL = 8.217  # matches the draw weight target in procedures.draw
+T_DELIVERY_STD = 51.7  # C
+T_INLET_STD = 14.4  # C
+T_AMBIENT_STD = 19.7  # C
+
+DATA_COLUMNS = {'time': 'Time', 'elapsed': 'Elapsed',
+                'drawing': 'Draw Status', 'ambient': 'Ambient',
+                'power': 'Power', 'energy': 'Energy',
+                'tank': ['Tank 1', 'Tank 2', 'Tank 3', 'Tank 4', 'Tank 5',
+                         'Tank 6']}
+DRAW_COLUMNS = {'time': 'Time', 'elapsed': 'Elapsed',
+                'inlet': 'Inlet Temperature', 'outlet': 'Outlet Temperature',
+                'weight': 'Scale Weight'}
+# Frame bus signals for the same quantities; LiveRatings adds the tank and
+# ambient channels
+FRAME_DATA_COLUMNS = {'time': 'time', 'elapsed': 'elapsed',
+                      'drawing': 'drawing', 'power': 'watts',
+                      'energy': 'energy'}
+FRAME_DRAW_COLUMNS = {'time': 'time', 'elapsed': 'elapsed', 'inlet': 'inlet',
+                      'outlet': 'outlet', 'weight': 'weight'}
+
+RatingResults = namedtuple('RatingResults', [
+    'uef', 'first_hour_rating', 'recovery_efficiency', 'standby_ua',
+    'standby_loss', 'energy_consumed', 'energy_integrated',
+    'delivered_energy', 'delivered_volume', 'draws', 'duration'])
+RatingResults.__doc__ = """Simulated use test ratings
+
+uef: uniform energy factor
+first_hour_rating: gallons delivered by draws starting in the first hour
+recovery_efficiency: fraction, from the first draw's recovery
+standby_ua: W/K, from the standby period after the last draw
+standby_loss: W, average standby loss rate
+energy_consumed: kWh, from the power meter integrator if recorded,
+    otherwise from integrated power
+energy_integrated: kWh, host-side integration of sampled power
+delivered_energy: kWh delivered in draws
+delivered_volume: gallons delivered in draws
+draws: number of draws
+duration: hours of minutely data"""
+
+logger = logging.getLogger('Analysis')
+
+
+def _to_float(value: str) -> float:
+    value = value.strip('[] ')
+    if value == 'True':
+        return 1.0
+    if value == 'False':
+        return 0.0
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S').timestamp()
+    except ValueError:
+        return np.nan
+
+
+def _column(values: list) -> np.ndarray:
+    try:
+        return np.array(values, dtype=float)
+    except ValueError:
+        return np.array([_to_float(v) for v in values])
+
+
+def _rows_to_chunk(headers: List[str], rows: List[list]) -> \
+        Dict[str, np.ndarray]:
+    chunk = {}
+    for n, header in enumerate(headers):
+        chunk[header] = _column([row[n] if n < len(row) else ''
+                                 for row in rows])
+    return chunk
+
+
+def read_chunks(path: os.path.abspath, chunk_rows: int = 10000,
+                headers: List[str] = None) -> \
+        Iterator[Dict[str, np.ndarray]]:
+    """
+    Reads a writer output file a block of rows at a time
+
+    :param path: a CSV written by a DataWriter, or a 2D .npy array
+    :param chunk_rows: rows per block
+    :param headers: column names of a .npy file; CSV files use their own
+    :return: iterator of {column name: values} dicts
+    """
+    if path.endswith('.npy'):
+        data = np.load(path, mmap_mode='r')
+        for start in range(0, data.shape[0], chunk_rows):
+            block = np.asarray(data[start:start + chunk_rows], dtype=float)
+            yield {header: block[:, n] for n, header in enumerate(headers)}
+        return
+    with open(path, newline='') as f:
+        reader = csv.reader(f, dialect='excel')
+        headers = next(reader)
+        rows = []
+        for row in reader:
+            rows.append(row)
+            if len(rows) == chunk_rows:
+                yield _rows_to_chunk(headers, rows)
+                rows = []
+        if rows:
+            yield _rows_to_chunk(headers, rows)
+
+
+class CSVTail:
+    """Reads the rows appended to a CSV since the last read"""
+
+    def __init__(self, path: os.path.abspath):
+        """
+        :param path: CSV written by a DataWriter
+        """
+        self.path = path
+        self.headers = None
+        self._partial = ''
+        self._position = 0
+
+    def read(self) -> Optional[Dict[str, np.ndarray]]:
+        """
+        Reads new complete rows
+
+        :return: {column name: values}, or None if there are no new rows
+        """
+        if not os.path.isfile(self.path):
+            return None
+        with open(self.path, newline='') as f:
+            f.seek(self._position)
+            text = self._partial + f.read()
+            self._position = f.tell()
+        lines = text.split('\n')
+        self._partial = lines.pop()
+        rows = [row for row in csv.reader(lines) if row]
+        if self.headers is None and rows:
+            self.headers = rows.pop(0)
+        return _rows_to_chunk(self.headers, rows) if rows else None
+
+
+def follow(path: os.path.abspath, poll: float = 60,
+           stop: Callable[[], bool] = lambda: False) -> \
+        Iterator[Dict[str, np.ndarray]]:
+    """
+    Reads a CSV that is still being written, yielding new complete rows
+
+    :param path: CSV written by a DataWriter
+    :param poll: seconds between checks for new rows
+    :param stop: called between checks; following ends when it returns True
+    :return: iterator of {column name: values} dicts
+    """
+    tail = CSVTail(path)
+    while True:
+        chunk = tail.read()
+        if chunk is not None:
+            yield chunk
+        if stop():
+            return
+        time.sleep(poll)
+
+
+class DrawAnalyzer:
+    """Accumulates per-draw delivered mass and energy from DrawWriter data"""
+
+    def __init__(self, columns: dict = None):
+        """
+        :param columns: column names, defaults to DRAW_COLUMNS
+        """
+        self.columns = dict(DRAW_COLUMNS, **(columns or {}))
+        self.start_times = []
+        self.mass = np.zeros(0)
+        self.energy = np.zeros(0)
+        self.inlet_sum = np.zeros(0)
+        self.outlet_sum = np.zeros(0)
+        self._last = None
+
+    def _grow(self, draws: int):
+        extra = draws - self.mass.size
+        if extra > 0:
+            self.mass = np.append(self.mass, np.zeros(extra))
+            self.energy = np.append(self.energy, np.zeros(extra))
+            self.inlet_sum = np.append(self.inlet_sum, np.zeros(extra))
+            self.outlet_sum = np.append(self.outlet_sum, np.zeros(extra))
+
+    def update(self, chunk: Dict[str, np.ndarray]):
+        """
+        Adds a block of rows
+
+        :param chunk: {column name: values}, as from read_chunks
+        """
+        c = self.columns
+        elapsed = chunk[c['elapsed']]
+        inlet = chunk[c['inlet']]
+        outlet = chunk[c['outlet']]
+        weight = chunk[c['weight']] * LB_TO_KG
+        stamps = chunk.get(c['time'], np.full(elapsed.shape, np.nan))
+        if self._last is not None:
+            # Carry the previous block's last row so no interval is lost
+            elapsed = np.append(self._last[0], elapsed)
+            inlet = np.append(self._last[1], inlet)
+            outlet = np.append(self._last[2], outlet)
+            weight = np.append(self._last[3], weight)
+            stamps = np.append(self._last[4], stamps)
+            carried = 1
+        else:
+            carried = 0
+
+        # Each draw begins with an initial row at elapsed 0
+        starts = elapsed == 0
+        starts[:carried] = False
+        self.start_times += list(stamps[starts])
+        draw_index = np.cumsum(starts) + len(self.start_times) - \
+            starts.sum() - 1
+        self._grow(len(self.start_times))
+
+        interval = ~starts[1:] & (draw_index[1:] >= 0)
+        index = draw_index[1:][interval]
+        d_mass = np.diff(weight)[interval]
+        d_energy = d_mass * CP_WATER * \
+            _midpoints(outlet - inlet)[interval]
+        np.add.at(self.mass, index, d_mass)
+        np.add.at(self.energy, index, d_energy)
+        np.add.at(self.inlet_sum, index,
+                  d_mass * _midpoints(inlet)[interval])
+        np.add.at(self.outlet_sum, index,
+                  d_mass * _midpoints(outlet)[interval])
+        if elapsed.size:
+            self._last = (elapsed[-1], inlet[-1], outlet[-1], weight[-1],
+                          stamps[-1])
+
+    def delivery_temps(self) -> np.ndarray:
+        """Mass-weighted mean (inlet, outlet) temperature of each draw"""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.column_stack([self.inlet_sum / self.mass,
+                                    self.outlet_sum / self.mass])
+
+    def first_hour_rating(self) -> float:
+        """Gallons delivered by draws starting within an hour of the first"""
+        starts = np.array(self.start_times, dtype=float)
+        if not starts.size or np.isnan(starts[0]):
+            return np.nan
+        first_hour = (starts - starts[0]) < 3600
+        return self.mass[first_hour].sum() / LB_TO_KG / LB_PER_GAL
+
+
+class SimulatedUseAnalyzer:
+    """Accumulates energy, recovery and standby from SimulatedUseWriter data"""
+
+    def __init__(self, columns: dict = None, heater_threshold: float = 100):
+        """
+        :param columns: column names, defaults to DATA_COLUMNS
+        :param heater_threshold: watts above which the heater is on; the
+            same threshold procedures.predraw uses
+        """
+        self.columns = dict(DATA_COLUMNS, **(columns or {}))
+        self.threshold = heater_threshold
+        self.first = None
+        self.last = None
+        # Running integrals: energy (J), time (s), ambient and
+        # tank-minus-ambient temperature (K s)
+        self.integrals = np.zeros(4)
+        self.draws_seen = False
+        self.recovery_start = None
+        self.recovery_end = None
+        self.standby_start = None
+        # (elapsed, tank average, meter energy) and the running integrals
+        # at the latest row
+        self.last_point = None
+
+    def update(self, chunk: Dict[str, np.ndarray]):
+        """
+        Adds a block of rows
+
+        :param chunk: {column name: values}, as from read_chunks
+        """
+        c = self.columns
+        elapsed = chunk[c['elapsed']]
+        if not elapsed.size:
+            return
+        drawing = chunk[c['drawing']] > 0
+        power = chunk[c['power']]
+        meter = chunk.get(c['energy'], np.full(elapsed.shape, np.nan)) * 3600
+        ambient = chunk[c['ambient']]
+        tank = np.mean([chunk[name] for name in c['tank']], axis=0)
+
+        if self.last is None:
+            self.first = (elapsed[0], tank[0], meter[0])
+            prev = (elapsed[0], power[0], ambient[0], tank[0])
+        else:
+            prev = self.last
+        all_elapsed = np.append(prev[0], elapsed)
+        all_power = np.append(prev[1], power)
+        all_ambient = np.append(prev[2], ambient)
+        all_tank = np.append(prev[3], tank)
+
+        # Trapezoidal integrals over each interval, then running totals
+        dt = np.diff(all_elapsed)
+        steps = np.column_stack([_midpoints(all_power) * dt, dt,
+                                 _midpoints(all_ambient) * dt,
+                                 _midpoints(all_tank - all_ambient) * dt])
+        cumulative = self.integrals + np.cumsum(steps, axis=0)
+        self.integrals = cumulative[-1]
+
+        def point(n: int) -> tuple:
+            return (elapsed[n], tank[n], meter[n]) + tuple(cumulative[n])
+
+        idle = ~drawing & (power < self.threshold)
+        if self.recovery_start is None and drawing.any():
+            n = np.flatnonzero(drawing)[0]
+            if n == 0 and self.last_point is not None:
+                self.recovery_start = self.last_point
+            else:
+                self.recovery_start = point(max(n - 1, 0))
+        if self.recovery_start is not None and self.recovery_end is None:
+            after = idle.copy()
+            if self.recovery_start[0] >= elapsed[0]:
+                after[:np.searchsorted(elapsed, self.recovery_start[0]) + 1] \
+                    = False
+            if after.any():
+                self.recovery_end = point(np.flatnonzero(after)[0])
+        if drawing.any():
+            self.draws_seen = True
+            self.standby_start = None
+            after = idle.copy()
+            after[:np.flatnonzero(drawing)[-1] + 1] = False
+        else:
+            after = idle
+        if self.draws_seen and self.standby_start is None and after.any():
+            self.standby_start = point(np.flatnonzero(after)[0])
+
+        self.last = (elapsed[-1], power[-1], ambient[-1], tank[-1])
+        self.last_point = point(elapsed.size - 1)
+
+
+def _midpoints(x: np.ndarray) -> np.ndarray:
+    return 0.5 * (x[1:] + x[:-1])
+
+
+def _energy_between(start: tuple, end: tuple) -> float:
+    # Power meter integrator if it recorded both ends, otherwise the host
+    # integration of sampled power
+    meter = end[2] - start[2]
+    return meter if np.isfinite(meter) else end[3] - start[3]
+
+
+class RatingAnalyzer:
+    """Streams simulated use and draw data into DOE test ratings"""
+
+    def __init__(self, tank_volume: float, data_columns: dict = None,
+                 draw_columns: dict = None, heater_threshold: float = 100):
+        """
+        :param tank_volume: measured tank volume in gallons
+        :param data_columns: minutely data column names
+        :param draw_columns: draw data column names
+        :param heater_threshold: watts above which the heater is on
+        """
+        self.tank_volume = tank_volume
+        self.data = SimulatedUseAnalyzer(data_columns, heater_threshold)
+        self.draws = DrawAnalyzer(draw_columns)
+
+    def update_data(self, chunk: Dict[str, np.ndarray]):
+        """Adds a block of minutely rows"""
+        self.data.update(chunk)
+
+    def update_draws(self, chunk: Dict[str, np.ndarray]):
+        """Adds a block of draw rows"""
+        self.draws.update(chunk)
+
+    def results(self) -> RatingResults:
+        """Computes the ratings from everything added so far"""
+        d = self.data
+        if d.last is None:
+            raise ValueError('No simulated use data added')
+        # J/K of the stored water
+        tank_capacity = self.tank_volume * LB_PER_GAL * LB_TO_KG * CP_WATER
+        end = d.last_point
+        duration = end[0] - d.first[0]
+        integrated = end[3]
+        consumed = _energy_between((d.first[0], d.first[1], d.first[2], 0,
+                                    0, 0, 0), end)
+
+        draws = self.draws
+        delivered = draws.energy.sum()
+
+        recovery = np.nan
+        if d.recovery_start is not None and d.recovery_end is not None \
+                and draws.mass.size:
+            stored = tank_capacity * (d.recovery_end[1] - d.recovery_start[1])
+            recovery = (draws.energy[0] + stored) / \
+                _energy_between(d.recovery_start, d.recovery_end)
+
+        ua = standby_loss = np.nan
+        if d.standby_start is not None and end[0] > d.standby_start[0]:
+            s = d.standby_start
+            tau = end[0] - s[0]
+            loss = _energy_between(s, end) - tank_capacity * (end[1] - s[1])
+            standby_loss = loss / tau
+            ua = loss / (end[6] - s[6])
+
+        uef = np.nan
+        if np.isfinite(recovery) and np.isfinite(ua):
+            # Daily energy corrected for the change in stored energy, the
+            # ambient temperature and the delivered water temperatures
+            q_d = consumed - tank_capacity * (end[1] - d.first[1]) / recovery
+            ambient = end[5] / end[4] if end[4] else T_AMBIENT_STD
+            q_da = q_d - (T_AMBIENT_STD - ambient) * ua * duration
+            standard = draws.mass.sum() * CP_WATER * \
+                (T_DELIVERY_STD - T_INLET_STD)
+            q_dm = q_da + (standard - delivered) / recovery
+            uef = standard / q_dm
+
+        kwh = 3.6e6
+        return RatingResults(
+            uef=uef, first_hour_rating=draws.first_hour_rating(),
+            recovery_efficiency=recovery, standby_ua=ua,
+            standby_loss=standby_loss, energy_consumed=consumed / kwh,
+            energy_integrated=integrated / kwh,
+            delivered_energy=delivered / kwh,
+            delivered_volume=draws.mass.sum() / LB_TO_KG / LB_PER_GAL,
+            draws=len(draws.start_times),
+            duration=duration / 3600)
+
+
+def analyze(data_file: os.path.abspath, draw_file: os.path.abspath,
+            tank_volume: float, chunk_rows: int = 10000,
+            data_columns: dict = None, draw_columns: dict = None) -> \
+        RatingResults:
+    """
+    Computes DOE test ratings from finished output files in bounded memory
+
+    :param data_file: SimulatedUseWriter output
+    :param draw_file: DrawWriter output
+    :param tank_volume: measured tank volume in gallons
+    :param chunk_rows: rows read at a time
+    :param data_columns: minutely data column names
+    :param draw_columns: draw data column names
+    :return: the computed ratings
+    """
+    analyzer = RatingAnalyzer(tank_volume, data_columns, draw_columns)
+    data_headers = draw_headers = None
+    if data_file.endswith('.npy'):
+        data_headers = _npy_headers(analyzer.data.columns)
+    if draw_file.endswith('.npy'):
+        draw_headers = _npy_headers(analyzer.draws.columns)
+    for chunk in read_chunks(draw_file, chunk_rows, draw_headers):
+        analyzer.update_draws(chunk)
+    for chunk in read_chunks(data_file, chunk_rows, data_headers):
+        analyzer.update_data(chunk)
+    results = analyzer.results()
+    logger.info('Ratings: {}'.format(results))
+    return results
+
+
+def _npy_headers(columns: dict) -> List[str]:
+    # Binary files hold the named columns in DATA/DRAW_COLUMNS order
+    headers = []
+    for value in columns.values():
+        headers += value if isinstance(value, list) else [value]
+    return headers
+
+
+def _rename(chunk: Dict[str, np.ndarray], source: dict,
+            target: dict) -> Dict[str, np.ndarray]:
+    # Moves columns named as in one column map to the names of another
+    renamed = {}
+    for key, names in source.items():
+        if key not in target:
+            continue
+        pairs = zip(names, target[key]) if isinstance(names, list) else \
+            [(names, target[key])]
+        for old, new in pairs:
+            if old in chunk:
+                renamed[new] = chunk[old]
+    return renamed
+
+
+class LiveRatings:
+    """Updates the ratings in the background while a test is running, from
+    the frames the sampler publishes to a frame bus"""
+
+    def __init__(self, reader: 'FrameReader', tank_volume: float,
+                 tank_channels: List[str], ambient_channel: str,
+                 poll: float = 60):
+        """
+        Creates the updater; call start() to begin
+
+        :param reader: reader of the test's frame bus, with 'minutely' and
+            'draw' frames carrying what SimulatedUseWriter and DrawWriter
+            write
+        :param tank_volume: measured tank volume in gallons
+        :param tank_channels: channels of the tank thermocouples
+        :param ambient_channel: channel of the ambient thermocouple
+        :param poll: seconds between updates
+        """
+        self.reader = reader
+        self.poll = poll
+        self.data_columns = dict(FRAME_DATA_COLUMNS, ambient=str(
+            ambient_channel), tank=[str(c) for c in tank_channels])
+        self.analyzer = RatingAnalyzer(tank_volume, self.data_columns,
+                                       FRAME_DRAW_COLUMNS)
+        self.results = None
+        self._stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='live-ratings',
+                                       daemon=True)
+
+    def load(self, data_file: os.path.abspath, draw_file: os.path.abspath,
+             chunk_rows: int = 10000):
+        """
+        Adds the rows already written, e.g. by a test being resumed; call
+        before the sampler starts publishing
+
+        :param data_file: SimulatedUseWriter output
+        :param draw_file: DrawWriter output
+        :param chunk_rows: rows read at a time
+        """
+        if os.path.isfile(draw_file):
+            for chunk in read_chunks(draw_file, chunk_rows):
+                self.analyzer.update_draws(_rename(chunk, DRAW_COLUMNS,
+                                                   FRAME_DRAW_COLUMNS))
+        if os.path.isfile(data_file):
+            for chunk in read_chunks(data_file, chunk_rows):
+                self.analyzer.update_data(_rename(chunk, DATA_COLUMNS,
+                                                  self.data_columns))
+
+    def update(self):
+        """Adds the frames published since the last update"""
+        blocks = self.reader.columns()
+        if 'draw' in blocks:
+            self.analyzer.update_draws(blocks['draw'])
+        if 'minutely' in blocks:
+            self.analyzer.update_data(blocks['minutely'])
+        try:
+            self.results = self.analyzer.results()
+        except ValueError:
+            return
+        for name, value in self.results._asdict().items():
+            registry.set('rating', value, quantity=name)
+
+    def _run(self):
+        while not self._stopped.wait(self.poll):
+            self.update()
+
+    def start(self):
+        """Starts updating in a background thread"""
+        self.thread.start()
+
+    def stop(self) -> RatingResults:
+        """Stops updating, takes the last frames and returns the results"""
+        self._stopped.set()
+        self.thread.join()
+        self.update()
+        return self.results
@@ -0,0 +1,369 @@
+"""Benchmarks of the acquisition and processing hot paths against the
+simulated instruments. Run with tc-tools-benchmark once the package is
+installed (pip install -e .), or with python -m tc_tools.benchmark from
+the repository root."""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+from tc_tools.metrics import registry
+from tc_tools.sim import (SimClock, SimDAQResource, SimResourceManager,
+                          calibration_stand, simulated_use_stand,
+                          write_schedule)
+
+# Timings may vary this much from the baseline before counting as a
+# regression, and must also be slower by more than the noise floor; bus
+# transaction counts must not grow at all
+TOLERANCE = 0.5
+NOISE_FLOOR = 2e-6  # seconds
+# Each timing is the median of RUNS runs, each repeating the call for at
+# least MIN_RUN_SECONDS
+RUNS = 7
+MIN_RUN_SECONDS = 0.05
+# A benchmark with slower timings is run up to this many more times, and
+# only timings that stay slower in all of them count as regressions; a
+# shared or throttled host can slow a whole run down for a few seconds
+CONFIRM_RUNS = 3
+
+
+def _daq_channels(count: int) -> list:
+    # 20 channels to a slot, as on the 34970A
+    return ['{}{:02d}'.format(1 + n // 20, 1 + n % 20) for n in range(count)]
+
+
+def _time(function: Callable[[], None]) -> Tuple[float, int]:
+    """
+    Times a function over repeated runs
+
+    :return: median seconds per call, and the number of calls made,
+        including those made to size the runs
+    """
+    # Enough calls per run that timer resolution and scheduling don't
+    # dominate short calls
+    loops = 1
+    calls = 0
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            function()
+        seconds = time.perf_counter() - start
+        calls += loops
+        if seconds >= MIN_RUN_SECONDS:
+            break
+        loops *= max(2, min(10, int(MIN_RUN_SECONDS / max(seconds, 1e-9))))
+    per_call = [seconds / loops]
+    for _ in range(RUNS - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            function()
+        per_call.append((time.perf_counter() - start) / loops)
+        calls += loops
+    return float(np.median(per_call)), calls
+
+
+def _transactions(address: str) -> float:
+    return registry.get('bus_transactions', bus=address)
+
+
+def bench_calibrated_temp(counts=(4, 20, 60)) -> dict:
+    """DAQ.get_calibrated_temp at several channel counts"""
+    from tc_tools.instruments import DAQ
+    results = {}
+    for count in counts:
+        channels = _daq_channels(count)
+        temps = {c: (lambda n=n: 20.0 + 0.01 * n)
+                 for n, c in enumerate(channels)}
+        address = 'SIM::DAQ{}'.format(count)
+        manager = SimResourceManager({address: SimDAQResource(temps)})
+        daq = DAQ(address, manager)
+        daq.set_channels(channels)
+        for n, channel in enumerate(channels):
+            daq.set_calibration(channel, 1.0 + 1e-4 * n, -0.01)
+        before = _transactions(address)
+        seconds, calls = _time(daq.get_calibrated_temp)
+        results['channels_{}'.format(count)] = {
+            'seconds': seconds,
+            'bus_transactions': (_transactions(address) - before) / calls}
+    return results
+
+
+def bench_writers() -> dict:
+    """DataWriter._write throughput of each writer, in rows per second"""
+    from tc_tools.utils import (CalibrationWriter, DrawWriter, PRTLogWriter,
+                                SimulatedUseWriter)
+    stand = simulated_use_stand()
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        writers = {
+            'CalibrationWriter': (CalibrationWriter(
+                os.path.join(directory, 'cal.csv'), ['PRT'] + ['TC'] * 8),
+                [25.0] * 9),
+            'PRTLogWriter': (PRTLogWriter(os.path.join(directory,
+                                                       'prt.csv')), [25.0]),
+            'SimulatedUseWriter': (SimulatedUseWriter(
+                ['Column'] * 17, os.path.join(directory, 'data.csv'),
+                stand.daq, stand.rh_sensor, stand.power_meter),
+                ['51.7'] * 17),
+            'DrawWriter': (DrawWriter(
+                ['Column'] * 4, os.path.join(directory, 'draws.csv'), 107,
+                108, stand.daq, stand.scale), [1.0, 14.4, 51.7, 20.0])}
+        for name, (writer, row) in writers.items():
+            seconds, _ = _time(lambda: writer._write(row))
+            writer.flush()
+            writer.output_file.close()
+            results[name] = {'seconds': seconds, 'rows_per_second':
+                             1 / seconds}
+    return results
+
+
+def bench_steady_state() -> dict:
+    """steady_state_monitor cost per PRT sample, at a steady bath"""
+    from tc_tools.utils import steady_state_monitor
+    stand = calibration_stand(['101'])
+    stand.model.noise = 0.0
+    stand.model.running = True
+    # Counts the samples the monitor takes before it finds the bath steady
+    readings = []
+    counter = SimpleNamespace(log=readings.append)
+    with stand.clock:
+        before = _transactions(stand.prt.address)
+        # The monitor echoes each reading to the console
+        with contextlib.redirect_stdout(io.StringIO()):
+            seconds, calls = _time(lambda: steady_state_monitor(
+                stand.prt, prt_log=counter))
+        reads = _transactions(stand.prt.address) - before
+    samples = max(len(readings), 1)
+    return {'per_sample': {'seconds': seconds * calls / samples,
+                           'bus_transactions': reads / samples}}
+
+
+def bench_parse_schedule(sizes=(1000, 100000)) -> dict:
+    """parse_schedule on schedules of several lengths"""
+    from tc_tools.utils import parse_schedule
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            path = os.path.join(directory, 'schedule_{}.csv'.format(size))
+            write_schedule(path, [(n % 1440, 10.7, 3.0)
+                                  for n in range(size)])
+            seconds, _ = _time(lambda: parse_schedule(path))
+            results['rows_{}'.format(size)] = {'seconds': seconds}
+    return results
+
+
+def bench_read_cycle() -> dict:
+    """
+    One SimulatedUseWriter.read_data cycle against the simulated stand, with
+    power taken from the power group as in DOEtest.py, and the power
+    group's reads averaged over a minute of them
+    """
+    from tc_tools.power import PowerSampler
+    from tc_tools.tank import TankState
+    from tc_tools.utils import SimulatedUseWriter
+    stand = simulated_use_stand()
+    channels = stand.channels
+    with tempfile.TemporaryDirectory() as directory, stand.clock:
+        stand.daq.set_channels(channels['tank'] + [
+            channels['inlet'], channels['outlet'], channels['ambient']])
+        # Reconciling against the meter adds a read every reconcile_every
+        # samples, which would make the count depend on how many were timed
+        power_sampler = PowerSampler(stand.power_meter, reconcile_every=0)
+        power = power_sampler.read()
+        writer = SimulatedUseWriter(
+            ['Column'] * 17, os.path.join(directory, 'data.csv'), stand.daq,
+            stand.rh_sensor, stand.power_meter,
+            TankState(channels['tank'], inlet_channel=channels['inlet']),
+            power=lambda: power)
+        # The first cycle configures the sensor channels
+        writer.read_data()
+        address = stand.daq.address
+        meter = stand.power_meter.address
+        before = _transactions(address) + _transactions(meter)
+        seconds, calls = _time(writer.read_data)
+        transactions = (_transactions(address) + _transactions(meter) -
+                        before) / calls
+        writer.output_file.close()
+        # Whole minutes of power reads, so the detail reads average out
+        reads = power_sampler.details_every
+        power_sampler.count = 0
+        # A first minute leaves the meter on the item each minute starts on
+        for _ in range(reads):
+            power_sampler.read()
+        before = _transactions(meter)
+        power_seconds, calls = _time(
+            lambda: [power_sampler.read() for _ in range(reads)])
+        power_seconds /= reads
+        power_transactions = (_transactions(meter) - before) / (calls * reads)
+    return {'cycle': {'seconds': seconds, 'bus_transactions': transactions},
+            'power_read': {'seconds': power_seconds,
+                           'bus_transactions': power_transactions}}
+
+
+def bench_frame_bus(signals: int = 20, frames: int = 10000) -> dict:
+    """FrameBus.publish and FrameReader.poll cost per frame"""
+    from tc_tools.framebus import FrameBus, FrameReader
+    from tc_tools.sampling import Frame
+    names = _daq_channels(signals)
+    frame = Frame(0.0, 'minutely', {c: 20.0 for c in names})
+    with FrameBus(names, ['minutely'], slots=frames) as bus:
+        publish, _ = _time(lambda: bus.publish(frame))
+
+        def poll_ring():
+            reader = FrameReader(bus, since=bus.head - frames + 1)
+            reader.poll()
+            reader.intact()
+        # The ring is full after the publishes, so each poll is of
+        # frames - 1 frames; the slot after the head is skipped
+        poll, _ = _time(poll_ring)
+        poll /= frames - 1
+    return {'publish': {'seconds': publish}, 'poll': {'seconds': poll}}
+
+
+BENCHMARKS = {'calibrated_temp': bench_calibrated_temp,
+              'writers': bench_writers,
+              'steady_state': bench_steady_state,
+              'parse_schedule': bench_parse_schedule,
+              'read_cycle': bench_read_cycle,
+              'frame_bus': bench_frame_bus}
+
+
+def run(names=None) -> dict:
+    """
+    Runs benchmarks against the simulated backend. Sleeps inside the
+    instrument code take no time, so timings are host-side cost only; bus
+    transaction counts stand for the time spent on the bus.
+
+    :param names: benchmarks to run; all of BENCHMARKS if not given
+    :return: {benchmark: {case: {measure: value}}} plus run details
+    """
+    results = {}
+    with SimClock():
+        for name in names or BENCHMARKS:
+            results[name] = BENCHMARKS[name]()
+    return {'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'results': results}
+
+
+def compare(results: dict, baseline: dict, tolerance: float = TOLERANCE,
+            noise_floor: float = NOISE_FLOOR) -> list:
+    """
+    Finds measures that got worse than the baseline. Timings must be
+    slower both relatively and absolutely; bus transaction counts are
+    compared exactly.
+
+    :param results: output of run()
+    :param baseline: earlier output of run()
+    :param tolerance: relative slowdown allowed in timings
+    :param noise_floor: seconds of slowdown allowed in timings, however
+        short the call
+    :return: (benchmark/case/measure, baseline, current) of each regression
+    """
+    regressions = []
+    old = baseline.get('results', {})
+    for name, cases in results['results'].items():
+        for case, measures in cases.items():
+            for measure, value in measures.items():
+                try:
+                    reference = old[name][case][measure]
+                except KeyError:
+                    continue
+                key = '/'.join([name, case, measure])
+                if measure == 'bus_transactions':
+                    worse = value > reference
+                elif measure == 'seconds':
+                    worse = value > reference * (1 + tolerance) and \
+                        value - reference > noise_floor
+                else:
+                    # Derived from the timing, which is compared already
+                    worse = False
+                if worse:
+                    regressions.append((key, reference, value))
+    return regressions
+
+
+def _keep_fastest(results: dict, again: dict):
+    # Bus transaction counts don't vary from run to run
+    for name, cases in again['results'].items():
+        for case, measures in cases.items():
+            kept = results['results'][name][case]
+            if measures['seconds'] < kept['seconds']:
+                kept.update(measures)
+
+
+def _report(results: dict, baseline: Dict = None):
+    old = (baseline or {}).get('results', {})
+    for name, cases in results['results'].items():
+        for case, measures in cases.items():
+            for measure, value in measures.items():
+                line = '{:<45} {:>12.4g}'.format(
+                    '/'.join([name, case, measure]), value)
+                reference = old.get(name, {}).get(case, {}).get(measure)
+                if reference:
+                    line += '  ({:+.0%} vs baseline)'.format(
+                        value / reference - 1)
+                print(line)
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(
+        description='Benchmarks acquisition and processing against the '
+                    'simulated instruments')
+    parser.add_argument('-o', '--output_file', type=str, dest='o',
+                        default='benchmark.json',
+                        help='JSON file to save the results to')
+    parser.add_argument('-b', '--baseline', type=str, dest='b',
+                        help='Earlier results to compare against')
+    parser.add_argument('-t', '--tolerance', type=float, dest='t',
+                        default=TOLERANCE,
+                        help='Relative slowdown allowed before failing')
+    parser.add_argument('-nf', '--noise_floor', type=float, dest='nf',
+                        default=NOISE_FLOOR,
+                        help='Seconds of slowdown allowed before failing, '
+                             'for calls too short to time precisely')
+    parser.add_argument('-n', '--names', nargs='+', dest='n',
+                        choices=list(BENCHMARKS),
+                        help='Benchmarks to run; all if not given')
+    in_args = parser.parse_args(argv)
+
+    logging.disable(logging.INFO)
+    results = run(in_args.n)
+    baseline = None
+    if in_args.b:
+        with open(in_args.b) as f:
+            baseline = json.load(f)
+    if baseline is not None:
+        for _ in range(CONFIRM_RUNS):
+            slower = {key.split('/')[0] for key, _, _ in compare(
+                results, baseline, in_args.t, in_args.nf)
+                      if key.endswith('/seconds')}
+            if not slower:
+                break
+            _keep_fastest(results, run(sorted(slower)))
+    _report(results, baseline)
+    with open(in_args.o, 'w') as f:
+        json.dump(results, f, indent=2)
+    if baseline is not None:
+        regressions = compare(results, baseline, in_args.t, in_args.nf)
+        for key, reference, value in regressions:
+            print('Regression in {}: {:.4g} -> {:.4g}'.format(key, reference,
+                                                              value))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
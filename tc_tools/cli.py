@@ -0,0 +1,133 @@
+"""tc-tools command line. Subcommands import what they need when they run,
+so --help and dry runs start without loading pyvisa or NumPy."""
+import argparse
+import configparser
+import sys
+from typing import List
+
+
+def calibrate(argv: List[str]):
+    """Runs a single or multi-bath calibration, depending on the config"""
+    from tc_tools import multi_bath_calibration, tc_calibration
+    parser = argparse.ArgumentParser(prog='tc-tools calibrate')
+    tc_calibration.add_arguments(parser)
+    in_args = parser.parse_args(argv)
+    cfg = configparser.ConfigParser()
+    cfg.read(in_args.cfg)
+    if any(section.startswith('Bath') for section in cfg.sections()):
+        multi_bath_calibration.run(in_args)
+    else:
+        tc_calibration.run(in_args)
+
+
+def doe_test(argv: List[str]):
+    """Runs a simulated use test"""
+    from tc_tools import DOEtest
+    parser = argparse.ArgumentParser(prog='tc-tools doe-test')
+    DOEtest.add_arguments(parser)
+    DOEtest.run(parser.parse_args(argv))
+
+
+def discover(in_args: argparse.Namespace):
+    """Lists the connected instruments"""
+    from tc_tools.utils import address_query
+    address_query()
+
+
+def analyze(in_args: argparse.Namespace):
+    """Prints the ratings from a finished or running test's files"""
+    from tc_tools.analysis import analyze as analyze_files
+    results = analyze_files(in_args.data_file, in_args.draw_file, in_args.tv,
+                            in_args.chunk_rows)
+    for field, value in results._asdict().items():
+        print('{:<20} {:.4g}'.format(field, value))
+
+
+def fit(in_args: argparse.Namespace):
+    """Fits a bath model to a PRT log and optionally plans set points"""
+    from tc_tools.planner import (fit_bath_model, plan_order, read_prt_log,
+                                  total_time)
+    model = fit_bath_model(*read_prt_log(in_args.prt_log))
+    print(model)
+    if in_args.sp:
+        order = plan_order(in_args.sp, in_args.st, model)
+        print('Order: {} ({:.0f} min, {:.0f} min as given)'.format(
+            ' '.join('{:g}'.format(p) for p in order),
+            total_time(order, in_args.st, model) / 60,
+            total_time(in_args.sp, in_args.st, model) / 60))
+
+
+def watch(in_args: argparse.Namespace):
+    """Prints the frames a running test publishes to its frame bus"""
+    from tc_tools.framebus import watch as watch_bus
+    counts = watch_bus(in_args.name, in_args.group, in_args.signals)
+    print('{frames} frames, {dropped} missed'.format(**counts))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog='tc-tools', description='Thermocouple calibration and water '
+                                     'heater test tools')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    # These pass their arguments on, so their modules load only when run
+    command = commands.add_parser(
+        'calibrate', add_help=False,
+        help='Calibrate thermocouples in one bath, or in several when the '
+             'config has [Bath ...] sections')
+    command.set_defaults(run=calibrate, passes_arguments=True)
+
+    command = commands.add_parser('doe-test', add_help=False,
+                                  help='Run a simulated use test')
+    command.set_defaults(run=doe_test, passes_arguments=True)
+
+    command = commands.add_parser('discover',
+                                  help='List the connected instruments')
+    command.set_defaults(run=discover)
+
+    command = commands.add_parser(
+        'analyze', help='Compute ratings from simulated use test files')
+    command.add_argument('data_file', help='Minutely data file')
+    command.add_argument('draw_file', help='Draw data file')
+    command.add_argument('-tv', '--tank_volume', type=float, dest='tv',
+                         required=True,
+                         help='Measured tank volume in gallons')
+    command.add_argument('-cr', '--chunk_rows', type=int, dest='chunk_rows',
+                         default=10000, help='Rows to process at a time')
+    command.set_defaults(run=analyze)
+
+    command = commands.add_parser(
+        'fit', help='Fit bath heating, cooling and settle times to a PRT '
+                    'log')
+    command.add_argument('prt_log', help='PRT log from a calibration run')
+    command.add_argument('-sp', '--set_points', nargs='+', type=float,
+                         dest='sp', help='Set points to plan an order for')
+    command.add_argument('-st', '--start_temp', type=float, dest='st',
+                         default=20.0, help='Bath temperature to plan from')
+    command.set_defaults(run=fit)
+
+    command = commands.add_parser(
+        'watch', help="Print a running test's frames from its frame bus")
+    command.add_argument('name', help='Frame bus name given to doe-test -fb')
+    command.add_argument('-g', '--group', type=str, dest='group',
+                         help='Only frames of this group, e.g. draw')
+    command.add_argument('-s', '--signals', nargs='+', dest='signals',
+                         help='Only these signals')
+    command.set_defaults(run=watch)
+    return parser
+
+
+def main(argv: List[str] = None):
+    parser = build_parser()
+    in_args, rest = parser.parse_known_args(argv)
+    if getattr(in_args, 'passes_arguments', False):
+        in_args.run(rest)
+    elif rest:
+        parser.error('unrecognized arguments: {}'.format(' '.join(rest)))
+    else:
+        in_args.run(in_args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
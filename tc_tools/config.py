@@ -1,6 +1,8 @@
 import configparser
 import os
-from typing import Union
+from typing import List, Union
+
+TC_TYPES = ['T', 'K', 'J', 'E']
 
 
 def tc_calibration_config(file: Union[os.path.abspath, str]
@@ -10,15 +12,52 @@ def tc_calibration_config(file: Union[os.path.abspath, str]
     if not os.path.isfile(file):
         print("Creating new calibration config file")
         config_file = open(file, 'w')
-        cfg['Files'] = {'output file': 'cal_data.csv', 'headers': 'channels'}
+        cfg['Files'] = {'output file': 'cal_data.csv', 'headers': 'channels',
+                        'prt log': 'prt_log.csv'}
         cfg["Instruments"] = {'PRT address': 'ASRL1:INSTR',
                               'DAQ address': 'GPIB0::9::INSTR',
                               'bath address': 'COM4'}
         cfg['Procedure'] = {'set points': '5 15 25 35 45 55 65 75',
-                            'channels': '101 102 103'}
+                            'channels': '101 102 103',
+                            'tc types': '', 'reference channel': '',
+                            'plan order': 'no', 'boost': '0',
+                            'valid range': '0 100', 'max rate': '',
+                            'quarantine after': '3'}
         cfg.write(config_file)
         config_file.close()
-    return cfg.read(file)
+    cfg.read(file)
+    return cfg
+
+def multi_bath_config(file: Union[os.path.abspath, str]
+                      = 'multi_bath_config.ini') -> \
+        configparser.ConfigParser:
+    cfg = configparser.ConfigParser()
+    if not os.path.isfile(file):
+        print('Creating new multi-bath calibration config file')
+        config_file = open(file, 'w')
+        cfg['Files'] = {'merged file': 'cal_data.csv'}
+        cfg['Instruments'] = {'DAQ address': 'GPIB0::9::INSTR'}
+        cfg['Procedure'] = {'set points': '5 15 25 35 45 55 65 75',
+                            'tc types': '', 'reference channel': '',
+                            'plan order': 'no', 'boost': '0',
+                            'scan window': '1', 'valid range': '0 100',
+                            'max rate': '', 'quarantine after': '3'}
+        # One section per bath; set points here override [Procedure]
+        cfg['Bath 1'] = {'PRT address': 'ASRL1::INSTR',
+                         'bath address': 'COM4',
+                         'channels': '101 102 103', 'headers': 'channels',
+                         'output file': 'cal_data_1.csv',
+                         'prt log': 'prt_log_1.csv'}
+        cfg['Bath 2'] = {'PRT address': 'ASRL2::INSTR',
+                         'bath address': 'COM5',
+                         'channels': '104 105 106', 'headers': 'channels',
+                         'output file': 'cal_data_2.csv',
+                         'prt log': 'prt_log_2.csv'}
+        cfg.write(config_file)
+        config_file.close()
+    cfg.read(file)
+    return cfg
+
 
 def valve_calibration_config(file: Union[os.path.abspath, str]
                              = 'valve_calibration_config.ini') -> \
@@ -35,7 +74,8 @@ def valve_calibration_config(file: Union[os.path.abspath, str]
         cfg['Procedure'] = {'set points': '1 2 3 4 5 6 7 8 9 10'}
         cfg.write(config_file)
         config_file.close()
-    return cfg.read(file)
+    cfg.read(file)
+    return cfg
 
 
 def doe_test_config(file: Union[
@@ -54,4 +94,141 @@ def doe_test_config(file: Union[
                            'flow valve': '', 'rh sensor': ''}
         cfg.write(config_file)
         config_file.close()
-    return cfg.read(file)
\ No newline at end of file
+    cfg.read(file)
+    return cfg
+
+
+def _is_float(value: str) -> bool:
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+def _check_procedure(procedure: configparser.SectionProxy) -> List[str]:
+    problems = []
+    tc_types = procedure.get('tc types', '').split()
+    bad_types = [t for t in tc_types if t.upper() not in TC_TYPES]
+    if bad_types:
+        problems.append('Unknown thermocouple types: {}'.format(
+            ' '.join(bad_types)))
+    for option in ('plan order',):
+        try:
+            procedure.getboolean(option, fallback=False)
+        except ValueError:
+            problems.append('[Procedure] {} must be yes or no'.format(
+                option))
+    for option in ('boost', 'scan window', 'max rate'):
+        if not _is_float(procedure.get(option, '') or '0'):
+            problems.append('[Procedure] {} must be a number'.format(option))
+    valid_range = procedure.get('valid range', '0 100').split()
+    if len(valid_range) != 2 or not all(map(_is_float, valid_range)):
+        problems.append('[Procedure] valid range must be two numbers')
+    if not procedure.get('quarantine after', '3').isdigit():
+        problems.append('[Procedure] quarantine after must be a whole '
+                        'number')
+    return problems
+
+
+def validity_settings(procedure: configparser.SectionProxy) -> dict:
+    """
+    Reads the reading checks of a calibration config
+
+    :param procedure: the config's [Procedure] section
+    :return: keyword arguments for DAQ.set_validity
+    """
+    low, high = procedure.get('valid range', '0 100').split()
+    max_rate = procedure.get('max rate', '')
+    return {'low': float(low), 'high': float(high),
+            'max_rate': float(max_rate) if max_rate else None,
+            'quarantine_after': procedure.getint('quarantine after',
+                                                 fallback=3)}
+
+
+def _check_channels(name: str, channels: str, headers: str,
+                    set_points: str) -> List[str]:
+    problems = []
+    channels = channels.split()
+    if not channels:
+        problems.append('[{}] has no channels'.format(name))
+    bad_channels = [c for c in channels if not c.isdigit()]
+    if bad_channels:
+        problems.append('[{}] channels must be numbers: {}'.format(
+            name, ' '.join(bad_channels)))
+    if headers != 'channels' and len(headers.split()) != len(channels):
+        problems.append('[{}] must have the same number of channels and '
+                        'headers'.format(name))
+    points = set_points.split()
+    if not points:
+        problems.append('[{}] has no set points'.format(name))
+    bad_points = [p for p in points if not _is_float(p)]
+    if bad_points:
+        problems.append('[{}] set points must be numbers: {}'.format(
+            name, ' '.join(bad_points)))
+    return problems
+
+
+def check_tc_calibration(cfg: configparser.ConfigParser) -> List[str]:
+    """
+    Checks a calibration config without touching instruments
+
+    :param cfg: config from tc_calibration_config
+    :return: a description of each problem found
+    """
+    problems = []
+    for section, options in (('Files', ['output file']),
+                             ('Instruments', ['PRT address', 'DAQ address',
+                                              'bath address']),
+                             ('Procedure', ['set points', 'channels'])):
+        if section not in cfg:
+            problems.append('Missing section [{}]'.format(section))
+            continue
+        problems += ['Missing [{}] {}'.format(section, option)
+                     for option in options if not cfg[section].get(option)]
+    if problems:
+        return problems
+    procedure = cfg['Procedure']
+    problems += _check_channels('Procedure', procedure['channels'],
+                                cfg['Files'].get('headers', 'channels'),
+                                procedure['set points'])
+    return problems + _check_procedure(procedure)
+
+
+def check_multi_bath(cfg: configparser.ConfigParser) -> List[str]:
+    """
+    Checks a multi-bath calibration config without touching instruments
+
+    :param cfg: config from multi_bath_config
+    :return: a description of each problem found
+    """
+    problems = []
+    if not cfg.get('Files', 'merged file', fallback=''):
+        problems.append('Missing [Files] merged file')
+    if not cfg.get('Instruments', 'DAQ address', fallback=''):
+        problems.append('Missing [Instruments] DAQ address')
+    if 'Procedure' not in cfg:
+        return problems + ['Missing section [Procedure]']
+    procedure = cfg['Procedure']
+    baths = [s for s in cfg.sections() if s.startswith('Bath')]
+    if not baths:
+        problems.append('No [Bath ...] sections')
+    channels = []
+    outputs = []
+    for name in baths:
+        bath = cfg[name]
+        problems += ['Missing [{}] {}'.format(name, option) for option in
+                     ('PRT address', 'bath address', 'output file')
+                     if not bath.get(option)]
+        problems += _check_channels(
+            name, bath.get('channels', ''), bath.get('headers', 'channels'),
+            bath.get('set points', procedure.get('set points', '')))
+        channels += bath.get('channels', '').split()
+        outputs.append(bath.get('output file'))
+    shared = sorted({c for c in channels if channels.count(c) > 1})
+    if shared:
+        problems.append('Channels in more than one bath: {}'.format(
+            ' '.join(shared)))
+    if len(set(outputs)) != len(outputs):
+        problems.append('Baths must have different output files')
+    return problems + _check_procedure(procedure)
@@ -0,0 +1,305 @@
+import json
+import logging
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from tc_tools.metrics import registry
+from tc_tools.sampling import Frame
+
+# Bytes before the ring: the head sequence number, slot count and layout
+# length as int64, then the layout as JSON from LAYOUT_OFFSET
+HEADER_SIZE = 4096
+LAYOUT_OFFSET = 64
+
+
+def record_dtype(signals: int) -> np.dtype:
+    """Layout of one frame record with room for a number of signals"""
+    return np.dtype([('seq', '<i8'), ('time', '<f8'), ('group', '<i8'),
+                     ('values', '<f8', (signals,))])
+
+
+class FrameBus:
+    """Ring of fixed-layout frame records in shared memory. One writer
+    publishes each frame once; any number of readers, in this or other
+    processes, read them in place by sequence number."""
+
+    logger = logging.getLogger('Frame Bus')
+
+    def __init__(self, signals: List[str], groups: List[str],
+                 slots: int = 1024, name: str = None):
+        """
+        Creates the shared memory for a bus; readers attach with
+        FrameBus.attach(bus.name)
+
+        :param signals: every signal a frame may carry; others are dropped
+        :param groups: every group frames may come from
+        :param slots: frames kept for readers that fall behind
+        :param name: shared memory name; chosen by the system if not given
+        """
+        layout = json.dumps({'signals': list(signals),
+                             'groups': list(groups)}).encode()
+        if LAYOUT_OFFSET + len(layout) > HEADER_SIZE:
+            raise ValueError('Too many signals for the frame bus header')
+        size = HEADER_SIZE + slots * record_dtype(len(signals)).itemsize
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        shm.buf[LAYOUT_OFFSET:LAYOUT_OFFSET + len(layout)] = layout
+        header = np.ndarray(3, dtype='<i8', buffer=shm.buf)
+        header[:] = (-1, slots, len(layout))
+        self._map(shm, owner=True)
+        self.logger.info('Frame bus {} with {} slots of {} signals'.format(
+            self.name, slots, len(self.signals)))
+
+    @classmethod
+    def attach(cls, name: str) -> 'FrameBus':
+        """
+        Opens a bus created by another process, for reading
+
+        :param name: the bus's shared memory name
+        """
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Before Python 3.13 every process tracks the memory and
+            # unlinks it on exit, pulling it from under the writer
+            shm = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        bus = cls.__new__(cls)
+        bus._map(shm, owner=False)
+        return bus
+
+    def _map(self, shm: shared_memory.SharedMemory, owner: bool):
+        self._shm = shm
+        self.owner = owner
+        self.name = shm.name
+        self._header = np.ndarray(3, dtype='<i8', buffer=shm.buf)
+        slots, length = int(self._header[1]), int(self._header[2])
+        layout = json.loads(bytes(
+            shm.buf[LAYOUT_OFFSET:LAYOUT_OFFSET + length]).decode())
+        self.signals = layout['signals']
+        self.groups = layout['groups']
+        self.slots = slots
+        self._signal_index = {s: n for n, s in enumerate(self.signals)}
+        self._group_index = {g: n for n, g in enumerate(self.groups)}
+        self.ring = np.ndarray(slots, dtype=record_dtype(len(self.signals)),
+                               buffer=shm.buf, offset=HEADER_SIZE)
+
+    @property
+    def head(self) -> int:
+        """Sequence number of the newest frame; -1 before the first"""
+        return int(self._header[0])
+
+    def publish(self, frame: Frame) -> int:
+        """
+        Writes a frame to the next slot; subscribe it to a
+        MultiRateSampler to publish every frame
+
+        :param frame: frame to publish
+        :return: the frame's sequence number
+        """
+        seq = self.head + 1
+        record = self.ring[seq % self.slots]
+        # Readers treat a slot being rewritten as gone
+        record['seq'] = -1
+        record['time'] = frame.time
+        record['group'] = self._group_index.get(frame.group, -1)
+        values = record['values']
+        values[:] = np.nan
+        for signal, value in frame.values.items():
+            n = self._signal_index.get(signal)
+            if n is not None:
+                try:
+                    values[n] = value
+                except (TypeError, ValueError):
+                    pass
+        record['seq'] = seq
+        self._header[0] = seq
+        registry.set('frame_bus_sequence', seq, bus=self.name)
+        return seq
+
+    def to_frame(self, record: np.void) -> Frame:
+        """Copies a record out as a Frame of the signals it carries"""
+        group = int(record['group'])
+        values = record['values']
+        return Frame(float(record['time']),
+                     self.groups[group] if group >= 0 else None,
+                     {self.signals[n]: float(values[n])
+                      for n in np.flatnonzero(~np.isnan(values))})
+
+    def close(self):
+        """Unmaps the bus, and removes it if this process created it"""
+        self._header = self.ring = None
+        self._shm.close()
+        if self.owner:
+            self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class FrameReader:
+    """One consumer's position in a frame bus"""
+
+    def __init__(self, bus: FrameBus, since: int = None):
+        """
+        Creates a reader
+
+        :param bus: bus to read
+        :param since: sequence number already seen; new frames only if not
+            given
+        """
+        self.bus = bus
+        self.position = bus.head if since is None else since
+        self.dropped = 0
+        self._expected = np.empty(0, dtype='<i8')
+
+    def poll(self) -> np.ndarray:
+        """
+        Takes the frames published since the last poll, oldest first. The
+        records are a view into the ring unless they wrap around its end;
+        either way, intact() tells which of them were overwritten while
+        they were being used.
+
+        :return: record array with fields seq, time, group and values
+        """
+        bus = self.bus
+        head = bus.head
+        # The slot after the head may be half written
+        oldest = max(self.position + 1, head - bus.slots + 2)
+        if oldest > self.position + 1:
+            lost = oldest - self.position - 1
+            self.dropped += lost
+            registry.increment('frames_dropped', lost, bus=bus.name)
+        self.position = max(head, self.position)
+        self._expected = np.arange(oldest, head + 1)
+        if oldest > head:
+            return bus.ring[:0]
+        start, stop = oldest % bus.slots, head % bus.slots + 1
+        if start < stop:
+            return bus.ring[start:stop]
+        return np.concatenate([bus.ring[start:], bus.ring[:stop]])
+
+    def intact(self) -> np.ndarray:
+        """
+        Checks which records of the last poll the writer has not reused
+        since
+
+        :return: whether each record is still the frame polled
+        """
+        seqs = self.bus.ring['seq'][self._expected % self.bus.slots]
+        return seqs == self._expected
+
+    def frames(self, group: str = None) -> List[Frame]:
+        """
+        Copies out the frames published since the last poll
+
+        :param group: only frames of this group if given
+        :return: frames, oldest first
+        """
+        records = self.poll()
+        if group is None:
+            wanted = np.ones(len(records), dtype=bool)
+        else:
+            wanted = records['group'] == self.bus._group_index.get(group, -2)
+        frames = [self.bus.to_frame(r) for r in records[wanted]]
+        torn = self._torn()[wanted]
+        return [f for f, t in zip(frames, torn) if not t]
+
+    def columns(self) -> Dict[str, Dict[str, np.ndarray]]:
+        """
+        Copies out the frames published since the last poll as columns,
+        one block per group, in the form read_chunks gives a file
+
+        :return: {group: {'time' or signal name: values}}, NaN where a
+            frame did not carry a signal
+        """
+        records = self.poll()
+        times = records['time'].copy()
+        groups = records['group'].copy()
+        values = records['values'].copy()
+        kept = ~self._torn()
+        blocks = {}
+        for n, group in enumerate(self.bus.groups):
+            rows = kept & (groups == n)
+            if rows.any():
+                blocks[group] = dict(zip(self.bus.signals, values[rows].T),
+                                     time=times[rows])
+        return blocks
+
+    def _torn(self) -> np.ndarray:
+        # Records of the last poll reused while they were being copied
+        torn = ~self.intact()
+        if torn.any():
+            lost = int(np.count_nonzero(torn))
+            self.dropped += lost
+            registry.increment('frames_dropped', lost, bus=self.bus.name)
+        return torn
+
+    def latest(self, group: str = None) -> Optional[Frame]:
+        """
+        Copies out the newest frame without moving the reader
+
+        :param group: newest frame of this group if given
+        :return: the frame, or None if there is none in the ring
+        """
+        bus = self.bus
+        head = bus.head
+        wanted = None if group is None else bus._group_index.get(group, -2)
+        for seq in range(head, max(head - bus.slots + 1, -1), -1):
+            record = bus.ring[seq % bus.slots]
+            if record['seq'] != seq:
+                continue
+            if wanted is None or record['group'] == wanted:
+                frame = bus.to_frame(record)
+                if record['seq'] == seq:
+                    return frame
+        return None
+
+    def wait(self, timeout: float = None, interval: float = 0.05) -> bool:
+        """
+        Blocks until a frame newer than the reader's position arrives
+
+        :param timeout: seconds to wait at most
+        :param interval: seconds between checks of the bus
+        :return: whether a new frame arrived
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while self.bus.head <= self.position:
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(interval)
+        return True
+
+
+def watch(name: str, group: str = None, signals: List[str] = None) -> Dict:
+    """
+    Prints a bus's frames as they arrive until interrupted
+
+    :param name: the bus's shared memory name
+    :param group: only frames of this group if given
+    :param signals: only these signals if given
+    :return: {'frames': frames printed, 'dropped': frames missed}
+    """
+    bus = FrameBus.attach(name)
+    reader = FrameReader(bus)
+    printed = 0
+    try:
+        while True:
+            reader.wait()
+            for frame in reader.frames(group):
+                values = frame.values if signals is None else \
+                    {s: frame.values[s] for s in signals
+                     if s in frame.values}
+                print('{:.1f} {} {}'.format(frame.time, frame.group, ' '.join(
+                    '{}={:.4g}'.format(k, v) for k, v in values.items())))
+                printed += 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bus.close()
+    return {'frames': printed, 'dropped': reader.dropped}
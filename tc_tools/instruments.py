@@ -1,8 +1,22 @@
 import logging
+import threading
 import time
-from typing import Union
+from typing import TYPE_CHECKING, List, Tuple, Union
 
-import visa
+from tc_tools.metrics import registry
+
+if TYPE_CHECKING:
+    from tc_tools.validity import Scan
+
+
+def default_resource_manager():
+    """
+    Opens pyvisa's default resource manager. pyvisa is imported here rather
+    than with this module, so code that never talks to hardware doesn't
+    pay for it.
+    """
+    import pyvisa
+    return pyvisa.ResourceManager()
 
 
 class VISAInstrument:
@@ -10,25 +24,41 @@ class VISAInstrument:
 
     logger = logging.getLogger('VISA')
 
-    def __init__(self, address: str):
+    def __init__(self, address: str, resource_manager=None):
         """
         Gets a VISA instrument from a resource manager
 
         :param address: VISA address of the instrument
+        :param resource_manager: opens the instrument; pyvisa's default if
+            not given, or e.g. a tc_tools.sim.SimResourceManager
         """
-        resource_manager = visa.ResourceManager()
+        if resource_manager is None:
+            resource_manager = default_resource_manager()
         self.visa_ref = resource_manager.open_resource(address)
+        self.address = address
+        # Held for each bus transaction; compound operations such as
+        # reconfigure-then-read hold it across both steps
+        self.lock = threading.RLock()
         self.logger.info(
             'Instrument at {} connected successfully'.format(address))
 
-    def command(self, command: str):
+    def command(self, command: str) -> float:
         """
         Sends a VISA command
         :param command: the SCPI command to send
+        :return: seconds the transaction took
         """
-        self.visa_ref.clear()
-        time.sleep(0.1)
-        self.visa_ref.write(command)
+        with self.lock:
+            registry.increment('bus_transactions', bus=self.address)
+            start = time.perf_counter()
+            try:
+                self.visa_ref.clear()
+                time.sleep(0.1)
+                self.visa_ref.write(command)
+            except Exception:
+                registry.increment('bus_errors', bus=self.address)
+                raise
+            return self._log_transaction(command, start)
 
     def read(self, query: str = 'READ?', parse: bool = True):
         """
@@ -38,12 +68,41 @@ class VISAInstrument:
         :param parse: whether to attempt to read the output as numbers
         :return: the readout from the instrument
         """
-        self.visa_ref.clear()
-        time.sleep(0.1)
-        if parse:
-            return self.visa_ref.query_ascii_values(query)
-        else:
-            return self.visa_ref.query(query)
+        with self.lock:
+            registry.increment('bus_transactions', bus=self.address)
+            start = time.perf_counter()
+            try:
+                self.visa_ref.clear()
+                time.sleep(0.1)
+                if parse:
+                    result = self.visa_ref.query_ascii_values(query)
+                else:
+                    result = self.visa_ref.query(query)
+            except Exception:
+                registry.increment('bus_errors', bus=self.address)
+                raise
+            self._log_transaction(query, start)
+            return result
+
+    def log_fields(self, command: str, latency: float, **fields) -> dict:
+        """
+        Structured log fields for a transaction, for extra= of a log call
+
+        :param command: the SCPI command sent
+        :param latency: seconds the transaction took
+        :param fields: further fields, e.g. channel
+        :return: the fields, including this instrument's address
+        """
+        return dict(fields, instrument=self.address, command=command,
+                    latency=latency)
+
+    def _log_transaction(self, command: str, start: float) -> float:
+        latency = time.perf_counter() - start
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('{} ({:.1f} ms)'.format(command, latency * 1e3),
+                              extra=self.log_fields(command, latency,
+                                                    key=command))
+        return latency
 
 
 class PRT(VISAInstrument):
@@ -51,13 +110,14 @@ class PRT(VISAInstrument):
 
     logger = logging.getLogger('PRT')
 
-    def __init__(self, address: str) -> None:
+    def __init__(self, address: str, resource_manager=None) -> None:
         """
         Calls the super constructor and sets the units to C
 
         :param address: VISA address of the instrument
+        :param resource_manager: as for VISAInstrument
         """
-        super(PRT, self).__init__(address)
+        super(PRT, self).__init__(address, resource_manager)
         self.set_units('C')
 
     def get_temp(self) -> float:
@@ -90,18 +150,45 @@ class DAQ(VISAInstrument):
 
     logger = logging.getLogger('DAQ')
 
-    def __init__(self, address: str):
+    def __init__(self, address: str, resource_manager=None):
         """
         Calls the super constructor and initializes a field
 
         :param address: VISA address of the instrument
+        :param resource_manager: as for VISAInstrument
         """
-        super(DAQ, self).__init__(address)
+        super(DAQ, self).__init__(address, resource_manager)
         self.channels_set = False
         self.channels = []
         self.calibrated = False
         self.cal_functions = {}
         self._configured_channels = {}
+        self.raw_voltage = False
+        self.tc_types = []
+        self.reference_channel = None
+        self.reference_temp = 0.0
+        # Channels the instrument currently scans on READ?
+        self.scan_list = []
+        from tc_tools.validity import ChannelValidator
+        self.validator = ChannelValidator()
+
+    def set_validity(self, low: float = 0.0, high: float = 100.0,
+                     max_rate: float = None, quarantine_after: int = 3,
+                     probe_interval: float = 600):
+        """
+        Sets the checks applied to each thermocouple reading; see
+        validity.ChannelValidator
+
+        :param low: lowest valid reading
+        :param high: highest valid reading
+        :param max_rate: largest valid change per second
+        :param quarantine_after: consecutive failures after which a channel
+            is dropped from the scan; 0 to never drop channels
+        :param probe_interval: seconds between reads of a dropped channel
+        """
+        from tc_tools.validity import ChannelValidator
+        self.validator = ChannelValidator(low, high, max_rate,
+                                          quarantine_after, probe_interval)
 
     def set_channels(self, channels: list, units: str = 'C'):
         """
@@ -134,26 +221,189 @@ class DAQ(VISAInstrument):
             self.logger.warning('Invalid units entered. Using system default.')
 
         self.logger.info('Channels set to: {}'.format(channels))
+        self.validator.release(channels)
+        self.raw_voltage = False
+        self.scan_list = list(channels)
+        self.channels_set = True
+
+    def set_raw_channels(self, channels: list,
+                         tc_types: Union[str, List[str]] = 'T',
+                         reference_channel: str = None,
+                         reference_probe: str = 'FRTD,85',
+                         reference_temp: float = 0.0, nplc: float = 1):
+        """
+        Sets the channels to read as raw thermocouple voltages, converted to
+        temperature on the host
+
+        :param channels: channels to read as a list
+        :param tc_types: thermocouple type for all channels, or one per
+            channel
+        :param reference_channel: channel measuring the cold junction;
+            reference_temp is used if not given
+        :param reference_probe: CONF:TEMP probe settings of the reference
+            channel
+        :param reference_temp: fixed cold junction temperature in C
+        :param nplc: integration time in power line cycles; lower is faster
+        """
+        if isinstance(tc_types, str):
+            tc_types = [tc_types] * len(channels)
+        if len(tc_types) != len(channels):
+            raise ValueError('Need one thermocouple type per channel')
+        self.channels = channels
+        self.tc_types = [t.upper() for t in tc_types]
+        self.reference_channel = reference_channel
+        self.reference_temp = reference_temp
+        for channel in channels:
+            self.cal_functions.update({channel: lambda x: x})
+            self._configured_channels.update({channel: False})
+
+        str_channels = ','.join(channels)
+        configs = ['CONF:VOLT:DC 0.1,(@{})'.format(str_channels),
+                   'SENS:VOLT:DC:NPLC {},(@{})'.format(nplc, str_channels)]
+        scan = list(channels)
+        if reference_channel is not None:
+            configs.append('CONF:TEMP {},(@{})'.format(reference_probe,
+                                                        reference_channel))
+            scan.append(reference_channel)
+        # CONF replaces the scan list, so set the combined list last
+        configs.append('ROUT:SCAN (@{})'.format(','.join(scan)))
+        for config in configs:
+            self.command(config)
+            self.logger.info('Config written: {}'.format(config))
+
+        self.logger.info('Raw voltage channels set to: {} ({})'.format(
+            channels, ','.join(self.tc_types)))
+        self.validator.release(channels)
+        self.raw_voltage = True
+        self.scan_list = scan
         self.channels_set = True
 
-    def get_temp_uncalibrated(self, as_dict = False) -> Union[list, dict]:
+    def configure(self, config: str, channel: str):
         """
-        Reads the set channels without calibration
+        Sends a CONF command for one channel, e.g. for a sensor read through
+        the DAQ. The channel's function is kept when other channels are
+        scanned.
 
+        :param config: CONF command without the channel list
+        :param channel: channel to configure
+        """
+        with self.lock:
+            self.command('{} (@{})'.format(config, channel))
+            # CONF replaces the scan list with just this channel
+            self.scan_list = [str(channel)]
+
+    def _scan_uncalibrated(self, channels: List[str]) -> dict:
+        scan = [str(c) for c in channels]
+        thermocouples = [c for c in scan if c in self.channels]
+        if self.raw_voltage and thermocouples and \
+                self.reference_channel is not None and \
+                self.reference_channel not in scan:
+            scan.append(self.reference_channel)
+        with self.lock:
+            if scan != self.scan_list:
+                self.command('ROUT:SCAN (@{})'.format(','.join(scan)))
+                self.scan_list = scan
+            data = self.read()
+        # The instrument returns readings in ascending channel order
+        by_channel = dict(zip(sorted(scan, key=int), data))
+        if self.raw_voltage and thermocouples:
+            if self.reference_channel is not None:
+                cold_junction = by_channel[self.reference_channel]
+            else:
+                cold_junction = self.reference_temp
+            from tc_tools.thermocouple import volts_to_temp
+            types = dict(zip(self.channels, self.tc_types))
+            temps = volts_to_temp([by_channel[c] for c in thermocouples],
+                                  [types[c] for c in thermocouples],
+                                  cold_junction)
+            by_channel.update(zip(thermocouples, temps))
+        return by_channel
+
+    def _read_checked(self, channels: List[str],
+                      thermocouples: List[str]) -> Tuple[dict, 'Scan']:
+        # Only the thermocouples are checked; other channels are always read
+        import numpy as np
+        from tc_tools.validity import Scan
+        now = time.time()
+        skipped = set(thermocouples).difference(
+            self.validator.to_read(thermocouples, now))
+        read = [c for c in channels if c not in skipped]
+        by_channel = self._scan_uncalibrated(read) if read else {}
+        values = np.array([by_channel.get(c, np.nan) for c in thermocouples],
+                          dtype=float)
+        valid = self.validator.check(thermocouples, values, now)
+        bad = np.isfinite(values) & ~valid
+        if bad.any():
+            self.logger.warning('Bad readings on channels: {}'.format(
+                ', '.join(c for c, b in zip(thermocouples, bad) if b)),
+                extra={'instrument': self.address, 'key': 'bad readings'})
+        return by_channel, Scan(thermocouples, values, valid, now)
+
+    def scan(self, channels: List[str], calibrated: bool = True) -> dict:
+        """
+        Reads a subset of the configured channels in one scan, changing the
+        scan list only if it differs from the last one. Thermocouple
+        channels are checked as in read_scan and calibrated; other channels
+        are returned as measured.
+
+        :param channels: channels to read
+        :param calibrated: whether to apply the channels' calibrations
+        :return: readings keyed by channel, NaN for thermocouples that
+            failed the checks or are quarantined
+        """
+        channels = [str(c) for c in channels]
+        set_channels = set(self.channels)
+        by_channel, checked = self._read_checked(
+            channels, [c for c in channels if c in set_channels])
+        invalid = {c for c, v in zip(checked.channels, checked.valid)
+                   if not v}
+        output = {}
+        for channel in channels:
+            value = float('nan') if channel in invalid else \
+                by_channel[channel]
+            if calibrated and channel in self.cal_functions:
+                value = self.cal_functions[channel](value)
+            output[channel] = value
+            registry.set('last_reading', value, channel=channel)
+        return output
+
+    def read_scan(self, channels: List[str] = None) -> 'Scan':
+        """
+        Reads thermocouple channels without calibration and checks each
+        reading. Quarantined channels are left out of the scan and read as
+        NaN.
+
+        :param channels: subset of the set channels to read; all if not
+            given
+        :return: the readings with their validity mask
+        """
+        channels = self.channels if channels is None else \
+            [str(c) for c in channels]
+        return self._read_checked(channels, channels)[1]
+
+    def get_temp_uncalibrated(self, as_dict = False,
+                              channels: List[str] = None) -> Union[list, dict]:
+        """
+        Reads the set channels without calibration. Channels failing the
+        validity checks read as NaN.
+
+        :param as_dict: whether to return as a dict
+        :param channels: subset of the set channels to read; all if not
+            given
         :return: temperature readings, ordered by channel
+        :raises IOError: if no channel has a valid reading
         """
         if self.channels_set:
-            data = self.read()
-            if not all(0 < n < 100 for n in data):
-                self.logger.warning('Bad readings')
-                raise IOError('DAQ read error')
-            self.logger.warning('Reading uncalibrated temperatures')
+            from tc_tools.validity import valid_readings
+            channels = self.channels if channels is None else channels
+            data = valid_readings(self.read_scan(channels))
+            self.logger.debug('Reading uncalibrated temperatures')
             if not as_dict:
                 return data
             else:
                 return_dict = {}
-                for n in range(len(self.channels)):
-                    return_dict.update({self.channels[n]: data[n]})
+                for n in range(len(channels)):
+                    return_dict.update({channels[n]: data[n]})
                 return return_dict
         else:
             raise UserWarning('Set DAQ channels before reading data')
@@ -180,6 +430,7 @@ class DAQ(VISAInstrument):
         output = {}
         for channel in self.channels:
             output.update({channel: self.cal_functions[channel](data[channel])})
+            registry.set('last_reading', output[channel], channel=channel)
         if as_dict:
             return output
         else:
@@ -196,18 +447,23 @@ class TCBath(VISAInstrument):
 
     def start(self):
         """Starts the bath"""
-        self.command('W GO 1')
-        self.logger.info('Bath started')
+        latency = self.command('W GO 1')
+        self.logger.info('Bath started',
+                         extra=self.log_fields('W GO 1', latency))
 
     def stop(self):
         """Stops the bath"""
-        self.command('W RR -1')
-        self.logger.info('Bath stopped')
+        latency = self.command('W RR -1')
+        self.logger.info('Bath stopped',
+                         extra=self.log_fields('W RR -1', latency))
 
     def set_temp(self, temp: float):
         """Sets the temperature setpoint"""
-        self.command('W SP {:.2f}'.format(temp))
-        self.logger.info('Bath set to {}C'.format(temp))
+        command = 'W SP {:.2f}'.format(temp)
+        latency = self.command(command)
+        self.logger.info('Bath set to {}C'.format(temp),
+                         extra=self.log_fields(command, latency,
+                                               key='set_temp'))
 
     def get_temp(self) -> float:
         """Reads the current temperature"""
@@ -228,26 +484,44 @@ class PowerMeter(VISAInstrument):
     measure_commands = ['MEAS:NORM:ITEM:PRES CLE', 'MEAS:NORM:ITEM:{}:ELEMENT1',
                         'ON']
 
+    def __init__(self, address: str, resource_manager=None):
+        """
+        Calls the super constructor and initializes a field
+
+        :param address: VISA address of the instrument
+        :param resource_manager: as for VISAInstrument
+        """
+        super(PowerMeter, self).__init__(address, resource_manager)
+        self.selected_item = None
+
     def reset_integration(self):
         """Resets the power integration"""
-        self.command('INTEG:RESET')
-        self.logger.info('Integration reset')
+        latency = self.command('INTEG:RESET')
+        self.logger.info('Integration reset',
+                         extra=self.log_fields('INTEG:RESET', latency))
 
     def start_integration(self):
         """Starts the power integration"""
-        self.command('INTEG:START')
-        self.logger.info('Integration started')
+        latency = self.command('INTEG:START')
+        self.logger.info('Integration started',
+                         extra=self.log_fields('INTEG:START', latency))
 
     def stop_integration(self):
         """Stops the power integration"""
-        self.command('INTEG:STOP')
-        self.logger.info('Integration stopped')
+        latency = self.command('INTEG:STOP')
+        self.logger.info('Integration stopped',
+                         extra=self.log_fields('INTEG:STOP', latency))
 
     def _read_sequence(self, value: str) -> float:
-        self.measure_commands[1] = self.measure_commands[1].format(value)
-        for command in self.measure_commands:
-            self.command(command)
-        return self.read(query='MEAS:NORM:VAL?')
+        with self.lock:
+            # Reselecting the output item costs three bus transactions, so
+            # repeated reads of the same quantity skip it
+            if self.selected_item != value:
+                self.command(self.measure_commands[0])
+                self.command(self.measure_commands[1].format(value))
+                self.command(self.measure_commands[2])
+                self.selected_item = value
+            return self.read(query='MEAS:NORM:VAL?')[0]
 
     def read_volts(self) -> float:
         """Reads instantaneous voltage"""
@@ -284,15 +558,19 @@ class Solenoid:
 
     def open(self):
         """Opens the solenoid"""
-        self.parent.command('ROUT:OPEN (@{})'.format(self.channel))
+        command = 'ROUT:OPEN (@{})'.format(self.channel)
+        latency = self.parent.command(command)
         self.is_open = True
-        self.logger.info('Opened')
+        self.logger.info('Opened', extra=self.parent.log_fields(
+            command, latency, channel=self.channel))
 
     def close(self):
         """Closes the solenoid"""
-        self.parent.command('ROUT:CLOS (@{})'.format(self.channel))
+        command = 'ROUT:CLOS (@{})'.format(self.channel)
+        latency = self.parent.command(command)
         self.is_open = False
-        self.logger.info('Closed')
+        self.logger.info('Closed', extra=self.parent.log_fields(
+            command, latency, channel=self.channel))
 
 
 class BelimoValve:
@@ -313,26 +591,31 @@ class BelimoValve:
         self.is_reset = False
         self.logger.info('Initialized')
 
-    def _write_volts(self, volts: float):
+    def _write_volts(self, volts: float) -> dict:
+        # Returns the transaction's log fields
         if not (0 <= volts <= 10):
             self.logger.critical('Invalid voltage ({:.2f} V)'.format(volts))
             raise IOError('Invalid voltage sent to Belimo valve')
-        self.parent.command(
-            'SOURCE:VOLT {:2.3}, (@{})'.format(volts, self.channel))
+        command = 'SOURCE:VOLT {:2.3}, (@{})'.format(float(volts),
+                                                     self.channel)
+        latency = self.parent.command(command)
+        return self.parent.log_fields(command, latency, channel=self.channel)
 
     def reset(self):
         """Resets to valve to zero"""
-        self._write_volts(0)
-        self.logger.info('Resetting to zero and waiting 60 s')
+        fields = self._write_volts(0)
+        self.logger.info('Resetting to zero and waiting 60 s', extra=fields)
         time.sleep(60)
+        self.is_reset = True
 
     def set_flow(self, flow_rate: float):
         if not self.is_reset:
             self.reset()
         v_send = flow_rate * self.volt_const
-        self._write_volts(v_send)
+        fields = self._write_volts(v_send)
         self.logger.info("Sending {:.2f} V ({} x {})".format(v_send, flow_rate,
-                                                             self.volt_const))
+                                                             self.volt_const),
+                         extra=dict(fields, key='set_flow'))
 
 
 class MTScale:
@@ -350,14 +633,33 @@ class MTScale:
         self.channel = channel
         self.gain = gain
         self.offset = offset
+        self.configured = False
         self.logger = logging.getLogger('Scale @{}'.format(channel))
         self.logger.info('Initialized')
 
+    def configure(self):
+        """Configures the DAQ channel for the scale's voltage output"""
+        self.parent.configure('CONF:VOLT:DC AUTO,MAX,', self.channel)
+        self.configured = True
+
+    def convert(self, raw_out: float) -> float:
+        """
+        Converts a voltage read from the scale's channel
+
+        :param raw_out: measured voltage
+        :return: weight in pounds
+        """
+        return raw_out * self.gain + self.offset
+
     def weigh(self) -> float:
         """Reads the current weight in pounds"""
-        self.parent.command('CONF:VOLT:DC AUTO,MAX, (@{})'.format(self.channel))
-        raw_out = self.parent.read()
-        return raw_out * self.gain + self.offset
+        with self.parent.lock:
+            if not self.configured:
+                self.configure()
+            raw_out = self.parent.scan([self.channel])[str(self.channel)]
+        weight = self.convert(raw_out)
+        registry.set('last_reading', weight, channel=self.channel)
+        return weight
 
 
 class HumiditySensor:
@@ -375,13 +677,32 @@ class HumiditySensor:
         self.channel = channel
         self.gain = gain
         self.offset = offset
+        self.configured = False
         self.logger = logging.getLogger('RH Sensor @{}'.format(channel))
 
+    def configure(self):
+        """Configures the DAQ channel for the sensor's current output"""
+        self.parent.configure('CONF:CURR:DC', self.channel)
+        self.configured = True
+
+    def convert(self, raw_out: float) -> float:
+        """
+        Converts a current read from the sensor's channel
+
+        :param raw_out: measured current
+        :return: relative humidity in percent
+        """
+        return raw_out * self.gain + self.offset
+
     def rh(self) -> float:
         """Reads the current RH"""
-        self.parent.command('CONF:CURR:DC (@{})'.format(self.channel))
-        raw_out = self.parent.read()
-        return raw_out * self.gain + self.offset
+        with self.parent.lock:
+            if not self.configured:
+                self.configure()
+            raw_out = self.parent.scan([self.channel])[str(self.channel)]
+        humidity = self.convert(raw_out)
+        registry.set('last_reading', humidity, channel=self.channel)
+        return humidity
 
 
 def is_number(s: str) -> bool:
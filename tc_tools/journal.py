@@ -0,0 +1,104 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+ResumeState = namedtuple('ResumeState', [
+    'start', 'elapsed', 'next_draw', 'interrupted_draw', 'meter_start',
+    'host_energy', 'finished'])
+ResumeState.__doc__ = """Test position rebuilt from a journal
+
+start: time.time() when the test first started
+elapsed: test seconds completed at the last heartbeat
+next_draw: schedule index of the next draw to run
+interrupted_draw: index of a draw that started but never finished, or None
+meter_start: power meter energy reading when integration started
+host_energy: host-integrated energy in J at the last heartbeat
+finished: whether the test ran to completion"""
+
+
+class Journal:
+    """Append-only record of test events, synced to disk on every event"""
+
+    logger = logging.getLogger('Journal')
+
+    def __init__(self, path: os.path.abspath):
+        """
+        Opens a journal for appending
+
+        :param path: journal file path
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a')
+        if self._file.tell() > 0:
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                partial = f.read(1) != b'\n'
+            if partial:
+                # Keep a line cut short by a crash from swallowing the next
+                self._file.write('\n')
+        self.logger.info('Journaling to: {}'.format(path))
+
+    def record(self, event: str, **fields):
+        """
+        Appends an event and waits for it to reach the disk
+
+        :param event: event name, e.g. 'draw_start'
+        :param fields: JSON-serializable values describing the event
+        """
+        entry = dict(event=event, time=time.time(), **fields)
+        line = json.dumps(entry) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        """Closes the journal"""
+        with self._lock:
+            self._file.close()
+
+
+def replay(path: os.path.abspath) -> ResumeState:
+    """
+    Rebuilds the test position from a journal
+
+    :param path: journal file path
+    :return: the state to resume from
+    """
+    start = None
+    elapsed = 0.0
+    next_draw = 0
+    running_draw = None
+    meter_start = None
+    host_energy = 0.0
+    finished = False
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A crash can leave the last line partly written
+                continue
+            event = entry['event']
+            if event == 'start' and start is None:
+                start = entry['start']
+            elif event == 'integration':
+                meter_start = entry['meter_start']
+            elif event == 'heartbeat':
+                elapsed = entry['elapsed']
+                host_energy = entry.get('energy', host_energy)
+            elif event == 'draw_start':
+                running_draw = entry['draw']
+                next_draw = entry['draw'] + 1
+            elif event == 'draw_end':
+                running_draw = None
+            elif event == 'finish':
+                finished = True
+    if start is None:
+        raise ValueError('No test start recorded in {}'.format(path))
+    return ResumeState(start, elapsed, next_draw, running_draw, meter_start,
+                       host_energy, finished)
@@ -0,0 +1,153 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from typing import Union
+
+# Attributes that callers may attach with extra={...} and that are written
+# out as their own fields by JsonFormatter
+STRUCTURED_FIELDS = ['instrument', 'command', 'latency', 'channel']
+
+
+class RateLimitFilter(logging.Filter):
+    """Drops repeats of the same message beyond a burst per time window.
+    One instance can be shared by several handlers; each record is counted
+    once and every handler gets the same decision."""
+
+    def __init__(self, burst: int = 5, period: float = 60.0):
+        """
+        Creates the filter
+
+        :param burst: messages allowed per logger, level and key in each
+            period
+        :param period: length of the window in seconds
+        """
+        super(RateLimitFilter, self).__init__()
+        self.burst = burst
+        self.period = period
+        self._lock = threading.Lock()
+        self._windows = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        decided = getattr(record, 'rate_limited', None)
+        if decided is not None:
+            return not decided
+        # Records can set extra={'key': ...} to group messages whose
+        # formatted values differ; otherwise the message is the key
+        key = (record.name, record.levelno, getattr(record, 'key',
+                                                    record.msg))
+        now = time.monotonic()
+        with self._lock:
+            start, count, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - start >= self.period:
+                start, count = now, 0
+                if suppressed:
+                    record.suppressed = suppressed
+                suppressed = 0
+            if count < self.burst:
+                self._windows[key] = (start, count + 1, suppressed)
+                record.rate_limited = False
+            else:
+                self._windows[key] = (start, count, suppressed + 1)
+                record.rate_limited = True
+        return not record.rate_limited
+
+
+class TextFormatter(logging.Formatter):
+    """Formats records as text, noting messages the rate limit dropped"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super(TextFormatter, self).format(record)
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            text += ' ({} similar messages suppressed)'.format(suppressed)
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as one JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {'time': self.formatTime(record, '%Y-%m-%d %H:%M:%S'),
+                 'level': record.levelname,
+                 'logger': record.name,
+                 'message': record.getMessage()}
+        for field in STRUCTURED_FIELDS + ['suppressed']:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _Listener(logging.handlers.QueueListener):
+    # Stopping twice, e.g. by the caller and again at exit, does nothing
+
+    running = False
+
+    def start(self):
+        super(_Listener, self).start()
+        self.running = True
+
+    def stop(self):
+        if self.running:
+            self.running = False
+            super(_Listener, self).stop()
+
+
+def setup_logging(log_file: Union[os.path.abspath, str],
+                  level: int = logging.INFO, background: bool = True,
+                  structured: bool = False, burst: int = 5,
+                  period: float = 60.0, append: bool = False) -> \
+        Union[logging.handlers.QueueListener, None]:
+    """
+    Configures the root logger to write to a file and the console
+
+    :param log_file: path of the log file
+    :param level: minimum level to record
+    :param background: move file and console I/O to a listener thread
+    :param structured: write the log file as JSON lines
+    :param burst: repeated messages allowed per logger and key each period;
+        0 disables rate limiting
+    :param period: rate limiting window in seconds
+    :param append: add to an existing log file instead of overwriting it
+    :return: the running listener if background is set; it is stopped
+        automatically at exit
+    """
+    file_handler = logging.FileHandler(log_file, mode='a' if append else 'w')
+    file_handler.setLevel(level)
+    if structured:
+        file_handler.setFormatter(JsonFormatter())
+    else:
+        file_handler.setFormatter(TextFormatter(
+            '%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
+            datefmt='%m-%d %H:%M'))
+    console = logging.StreamHandler()
+    console.setLevel(level)
+    console.setFormatter(
+        TextFormatter('%(name)-12s: %(levelname)-8s %(message)s'))
+
+    root = logging.getLogger('')
+    root.setLevel(level)
+    listener = None
+    if background:
+        queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+        listener = _Listener(queue_handler.queue, file_handler, console,
+                             respect_handler_level=True)
+        handlers = [queue_handler]
+        listener.start()
+        # Flushes queued records at exit unless the caller already stopped
+        # the listener
+        atexit.register(listener.stop)
+    else:
+        handlers = [file_handler, console]
+    rate_limit = RateLimitFilter(burst, period) if burst else None
+    for handler in handlers:
+        if rate_limit is not None:
+            handler.addFilter(rate_limit)
+        root.addHandler(handler)
+    return listener
@@ -0,0 +1,205 @@
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple, Union
+
+
+class Metrics:
+    """In-memory counters and gauges describing acquisition health"""
+
+    logger = logging.getLogger('Metrics')
+
+    def __init__(self, prefix: str = 'tc_tools'):
+        """
+        Creates an empty set of metrics
+
+        :param prefix: prepended to every metric name when rendered
+        """
+        self.prefix = prefix
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> Tuple[str, tuple]:
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def increment(self, name: str, amount: float = 1, **labels):
+        """
+        Adds to a counter
+
+        :param name: counter name
+        :param amount: amount to add
+        :param labels: labels distinguishing this counter, e.g. bus='GPIB0'
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set(self, name: str, value: Union[float, bool], **labels):
+        """
+        Sets a gauge to a value
+
+        :param name: gauge name
+        :param value: current value
+        :param labels: labels distinguishing this gauge, e.g. channel='101'
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = float(value)
+
+    def get(self, name: str, default: float = 0.0, **labels) -> float:
+        """
+        Returns the current value of a counter or gauge
+
+        :param name: metric name
+        :param default: returned if the metric has never been recorded
+        :param labels: labels of the metric
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            if key in self._counters:
+                return self._counters[key]
+            return self._gauges.get(key, default)
+
+    def observe_jitter(self, seconds: float):
+        """
+        Records how late the scheduler woke up relative to its target
+
+        :param seconds: wake time minus target time
+        """
+        with self._lock:
+            count = self._counters.get(('scheduler_wakeups', ()), 0) + 1
+            total = self._counters.get(('scheduler_jitter_seconds_sum', ()),
+                                       0) + abs(seconds)
+            worst = max(self._gauges.get(('scheduler_jitter_max_seconds', ()),
+                                         0), abs(seconds))
+            self._counters[('scheduler_wakeups', ())] = count
+            self._counters[('scheduler_jitter_seconds_sum', ())] = total
+            self._gauges[('scheduler_jitter_seconds', ())] = seconds
+            self._gauges[('scheduler_jitter_max_seconds', ())] = worst
+
+    def snapshot(self) -> Dict[Tuple[str, tuple], float]:
+        """Returns a copy of every counter and gauge"""
+        with self._lock:
+            values = dict(self._counters)
+            values.update(self._gauges)
+        values[('uptime_seconds', ())] = time.time() - self.started
+        return values
+
+    def render(self) -> str:
+        """Formats the metrics as text, one 'name{labels} value' per line"""
+        lines = []
+        for (name, labels), value in sorted(self.snapshot().items()):
+            label_str = ','.join('{}="{}"'.format(k, v) for k, v in labels)
+            if label_str:
+                label_str = '{' + label_str + '}'
+            lines.append('{}_{}{} {:.6g}'.format(self.prefix, name, label_str,
+                                                 value))
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        """Clears all metrics"""
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+        self.started = time.time()
+
+
+# Shared by the instruments, writers and procedures of this process
+registry = Metrics()
+
+
+class MetricsServer:
+    """Serves a Metrics object as plain text over local HTTP"""
+
+    logger = logging.getLogger('Metrics')
+
+    def __init__(self, metrics: Metrics = registry, port: int = 9108,
+                 host: str = '127.0.0.1'):
+        """
+        Creates the server; call start() to begin serving
+
+        :param metrics: metrics to serve
+        :param port: TCP port to listen on
+        :param host: interface to bind; local only by default
+        """
+        self.metrics = metrics
+        outer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = outer.metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       name='metrics-server', daemon=True)
+
+    def start(self):
+        """Starts serving in a background thread"""
+        self.thread.start()
+        host, port = self.server.server_address[:2]
+        self.logger.info('Serving metrics at http://{}:{}/'.format(host, port))
+
+    def stop(self):
+        """Stops serving"""
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MetricsFile:
+    """Periodically rewrites a file with the current metrics"""
+
+    logger = logging.getLogger('Metrics')
+
+    def __init__(self, path: os.path.abspath, metrics: Metrics = registry,
+                 interval: float = 10):
+        """
+        Creates the file writer; call start() to begin writing
+
+        :param path: file to rewrite
+        :param metrics: metrics to write
+        :param interval: seconds between rewrites
+        """
+        self.path = path
+        self.metrics = metrics
+        self.interval = interval
+        self._stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='metrics-file',
+                                       daemon=True)
+
+    def write(self):
+        """Writes the file atomically so readers never see a partial file"""
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(self.metrics.render())
+        os.replace(temp_path, self.path)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                self.logger.warning('Could not write metrics: {}'.format(e))
+
+    def start(self):
+        """Starts writing in a background thread"""
+        self.logger.info('Writing metrics to: {}'.format(self.path))
+        self.thread.start()
+
+    def stop(self):
+        """Stops writing after one final rewrite"""
+        self._stopped.set()
+        self.write()
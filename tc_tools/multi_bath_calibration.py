@@ -0,0 +1,120 @@
+import argparse
+import logging
+import os
+import sys
+from typing import List
+
+from tc_tools.config import (check_multi_bath, multi_bath_config,
+                             validity_settings)
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Adds the multi-bath calibration's arguments to a parser"""
+    parser.add_argument('-cfg', '--config_file', dest='cfg', type=str,
+                        default='multi_bath_config.ini',
+                        help='Name or path of configuration file.')
+    parser.add_argument('-dry', '--dry_run', action='store_true',
+                        dest='dry_run', help='Check the config without '
+                        'connecting to instruments')
+
+
+def run(in_args: argparse.Namespace):
+    """Runs the calibrations described by the config file"""
+    if in_args.dry_run and not os.path.isfile(in_args.cfg):
+        sys.exit('No config file: {}'.format(in_args.cfg))
+    cfg = multi_bath_config(in_args.cfg)
+    if in_args.dry_run:
+        problems = check_multi_bath(cfg)
+        for problem in problems:
+            print(problem)
+        sys.exit(1 if problems else 0)
+
+    # Imported here so --help and --dry_run don't load pyvisa and NumPy
+    from tc_tools.instruments import PRT, DAQ, TCBath
+    from tc_tools.procedures import CalibrationGroup, multi_bath_calibration
+    from tc_tools.log import setup_logging
+    from tc_tools.planner import BathRateModel, fit_bath_model, read_prt_log
+
+    name, _ = os.path.splitext(cfg['Files']['merged file'])
+    setup_logging(name + '.log')
+
+    try:
+        merged_path = os.path.abspath(cfg['Files']['merged file'])
+    except:
+        sys.exit('Invalid merged file name or path')
+
+    try:
+        daq = DAQ(cfg['Instruments']['DAQ address'])
+        daq.set_validity(**validity_settings(cfg['Procedure']))
+        logging.info('DAQ initialized')
+    except Exception as e:
+        logging.critical('DAQ initialization error: ' + str(e))
+        sys.exit('Error initializing DAQ')
+
+    procedure = cfg['Procedure']
+    tc_types = procedure.get('tc types', '').split()
+    reference_channel = procedure.get('reference channel', '') or None
+    plan = procedure.getboolean('plan order', fallback=False)
+    boost = procedure.getfloat('boost', fallback=0)
+    window = procedure.getfloat('scan window', fallback=1.0)
+
+    groups = []
+    for section in cfg.sections():
+        if not section.startswith('Bath'):
+            continue
+        bath_cfg = cfg[section]
+        try:
+            prt = PRT(bath_cfg['PRT address'])
+            bath = TCBath(bath_cfg['bath address'])
+            logging.info('{} initialized'.format(section))
+        except Exception as e:
+            logging.critical('{} initialization error: {}'.format(section,
+                                                                   e))
+            continue
+        channels = bath_cfg['channels'].split()
+        if bath_cfg.get('headers', 'channels') == 'channels':
+            headers = channels
+        else:
+            headers = bath_cfg['headers'].split()
+        if len(channels) != len(headers):
+            sys.exit('{}: must have the same number of channels and headers. '
+                     'No spaces in names of headers'.format(section))
+        set_points = bath_cfg.get('set points',
+                                  procedure['set points']).split()
+        prt_log = bath_cfg.get('prt log', '')
+        prt_log = os.path.abspath(prt_log) if prt_log else None
+        bath_model = None
+        if plan:
+            # Each bath's rates are learned from its own PRT log
+            if prt_log and os.path.isfile(prt_log):
+                bath_model = fit_bath_model(*read_prt_log(prt_log))
+            else:
+                bath_model = BathRateModel()
+        groups.append(CalibrationGroup(
+            section, prt, bath, channels, headers, set_points,
+            os.path.abspath(bath_cfg['output file']), prt_log, bath_model))
+
+    if not groups:
+        sys.exit('No baths initialized')
+
+    try:
+        failed = multi_bath_calibration(daq, groups, merged_path, tc_types,
+                                        reference_channel, boost, window)
+        if failed:
+            logging.critical('Calibration failed in: {}'.format(
+                ', '.join(failed)))
+        else:
+            logging.info('Calibration successful')
+    except Exception as e:
+        logging.critical('Exception during execution: {}'.format(
+            type(e).__name__))
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    run(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+import csv
+import logging
+import os
+import time
+from datetime import datetime
+from itertools import combinations
+from typing import List, Tuple
+
+import numpy as np
+
+from tc_tools.instruments import TCBath
+
+logger = logging.getLogger('Planner')
+
+
+class BathRateModel:
+    """Transition time model of a bath: linear ramps plus a settle time"""
+
+    def __init__(self, heat_rate: float = 1.0 / 60,
+                 cool_rate: float = 0.5 / 60, settle: float = 600):
+        """
+        :param heat_rate: heating rate in C/s
+        :param cool_rate: cooling rate in C/s, as a positive number
+        :param settle: seconds from reaching a set point until steady
+        """
+        self.heat_rate = heat_rate
+        self.cool_rate = cool_rate
+        self.settle = settle
+
+    def ramp_time(self, start: float, end: float) -> float:
+        """Seconds to ramp between two temperatures, without settling"""
+        if end >= start:
+            return (end - start) / self.heat_rate
+        return (start - end) / self.cool_rate
+
+    def transition_time(self, start: float, end: float) -> float:
+        """Seconds from changing set point until steady at the new one"""
+        return self.ramp_time(start, end) + self.settle
+
+    def __repr__(self):
+        return 'BathRateModel(heat_rate={:.4g}, cool_rate={:.4g}, ' \
+               'settle={:.0f})'.format(self.heat_rate, self.cool_rate,
+                                       self.settle)
+
+
+def read_prt_log(log_file: os.path.abspath) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reads a PRT log written during a calibration run
+
+    :param log_file: CSV with the time in the first column and the PRT
+        temperature in the second
+    :return: (seconds, temperatures)
+    """
+    times = []
+    temps = []
+    with open(log_file, newline='') as f:
+        reader = csv.reader(f, dialect='excel')
+        next(reader)
+        for row in reader:
+            try:
+                times.append(datetime.strptime(
+                    row[0], '%Y-%m-%d %H:%M:%S').timestamp())
+                temps.append(float(row[1]))
+            except (ValueError, IndexError):
+                continue
+    return np.array(times), np.array(temps)
+
+
+def fit_bath_model(times: np.ndarray, temps: np.ndarray,
+                   ramp_threshold: float = 0.002,
+                   steady_delta: float = 0.1) -> BathRateModel:
+    """
+    Learns heating and cooling rates and settle time from a PRT record
+
+    :param times: reading times in seconds
+    :param temps: PRT temperatures
+    :param ramp_threshold: C/s above which the bath is ramping
+    :param steady_delta: distance from the final temperature that counts as
+        settled
+    :return: the fitted model; defaults where the record has no example
+    """
+    model = BathRateModel()
+    if times.size < 3:
+        return model
+    slope = np.gradient(temps, times)
+    ramping = np.abs(slope) > ramp_threshold
+    # Contiguous ramp segments as [start, end) index pairs
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], ramping.astype(int),
+                                                   [0]])))
+    segments = edges.reshape(-1, 2)
+    rise = {True: [0.0, 0.0], False: [0.0, 0.0]}
+    settles = []
+    for n, (start, end) in enumerate(segments):
+        last = min(end, times.size - 1)
+        change = temps[last] - temps[start]
+        duration = times[last] - times[start]
+        if duration <= 0:
+            continue
+        rise[change > 0][0] += abs(change)
+        rise[change > 0][1] += duration
+        # Settled once within steady_delta of where the plateau ends
+        plateau_end = segments[n + 1][0] if n + 1 < len(segments) \
+            else times.size
+        plateau = temps[last:plateau_end]
+        if plateau.size > 1:
+            outside = np.flatnonzero(np.abs(plateau - plateau[-1]) >
+                                     steady_delta)
+            settled = last + (outside[-1] + 1 if outside.size else 0)
+            settles.append(times[min(settled, times.size - 1)] - times[last])
+    if rise[True][1]:
+        model.heat_rate = rise[True][0] / rise[True][1]
+    if rise[False][1]:
+        model.cool_rate = rise[False][0] / rise[False][1]
+    if settles:
+        model.settle = float(np.median(settles))
+    logger.info('Fitted {}'.format(model))
+    return model
+
+
+def plan_order(set_points: List[float], start_temp: float,
+               model: BathRateModel, exact_limit: int = 12) -> List[float]:
+    """
+    Orders set points to minimize total transition time
+
+    :param set_points: temperatures to visit
+    :param start_temp: current bath temperature
+    :param model: transition time model of the bath
+    :param exact_limit: largest number of points solved exactly; larger
+        sets use the better of an upward and a downward sweep
+    :return: set points in visiting order
+    """
+    points = [float(p) for p in set_points]
+    n = len(points)
+    if n <= 1:
+        return points
+    if n > exact_limit:
+        sweeps = [sorted(points), sorted(points, reverse=True)]
+        return min(sweeps, key=lambda order: total_time(order, start_temp,
+                                                        model))
+    # Held-Karp: best[subset][last] is the least time to visit subset
+    # ending at last
+    full = (1 << n) - 1
+    best = np.full((1 << n, n), np.inf)
+    parent = np.full((1 << n, n), -1, dtype=int)
+    for last in range(n):
+        best[1 << last, last] = model.transition_time(start_temp,
+                                                      points[last])
+    for size in range(2, n + 1):
+        for subset in combinations(range(n), size):
+            mask = sum(1 << k for k in subset)
+            for last in subset:
+                previous = mask & ~(1 << last)
+                costs = [best[previous, k] +
+                         model.transition_time(points[k], points[last])
+                         for k in subset if k != last]
+                choices = [k for k in subset if k != last]
+                pick = int(np.argmin(costs))
+                best[mask, last] = costs[pick]
+                parent[mask, last] = choices[pick]
+    last = int(np.argmin(best[full]))
+    order = []
+    mask = full
+    while last >= 0:
+        order.append(points[last])
+        mask, last = mask & ~(1 << last), parent[mask, last]
+    return order[::-1]
+
+
+def total_time(order: List[float], start_temp: float,
+               model: BathRateModel) -> float:
+    """Seconds to visit set points in the given order"""
+    temps = [start_temp] + list(order)
+    return sum(model.transition_time(a, b) for a, b in zip(temps, temps[1:]))
+
+
+def ramp_to(bath: TCBath, target: float, boost: float = 2.0,
+            margin: float = 0.5, poll: float = 10, timeout: float = 7200):
+    """
+    Drives the bath past the target while far from it, then switches to the
+    target as it gets close, so the bath ramps at full power for longer
+
+    :param bath: bath to drive
+    :param target: final set point
+    :param boost: how far past the target to aim while ramping
+    :param margin: distance from the target at which to switch
+    :param poll: seconds between bath temperature reads
+    :param timeout: seconds after which to switch regardless
+    """
+    current = bath.get_temp()
+    if boost <= 0 or current is None or abs(target - current) <= margin:
+        bath.set_temp(target)
+        return
+    direction = 1 if target > current else -1
+    bath.set_temp(target + direction * boost)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        time.sleep(poll)
+        current = bath.get_temp()
+        if current is not None and direction * (target - current) <= margin:
+            break
+    bath.set_temp(target)
@@ -0,0 +1,169 @@
+import logging
+import threading
+import time
+from typing import Dict, Tuple
+
+import numpy as np
+
+from tc_tools.instruments import PowerMeter
+from tc_tools.metrics import registry
+
+
+class PowerSampler:
+    """Samples power at a fixed rate and integrates energy on the host"""
+
+    logger = logging.getLogger('Power Sampler')
+
+    def __init__(self, power_meter: PowerMeter, interval: float = 5.0,
+                 capacity: int = 17280, reconcile_every: int = 120,
+                 tolerance: float = 0.02, details_every: int = 12):
+        """
+        Creates a sampler; call start() to begin sampling
+
+        :param power_meter: power meter to read
+        :param interval: seconds between power readings
+        :param capacity: readings kept in the ring buffer; a day at 5 s by
+            default
+        :param reconcile_every: compare against the meter's integrator
+            after this many readings; 0 to disable
+        :param tolerance: relative difference tolerated by reconcile()
+        :param details_every: read() also reads the meter's energy, volts
+            and amps every this many readings; once a minute at 5 s by
+            default
+        """
+        self.pm = power_meter
+        self.interval = interval
+        self.reconcile_every = reconcile_every
+        self.tolerance = tolerance
+        self.details_every = details_every
+        self.details = {'energy': np.nan, 'volts': np.nan, 'amps': np.nan}
+        self.times = np.empty(capacity)
+        self.watts = np.empty(capacity)
+        self.count = 0
+        self.energy = 0.0  # J, integrated since start()
+        self.meter_start = np.nan
+        self._stopped = threading.Event()
+        self.thread = None
+
+    def sample(self) -> float:
+        """Takes one power reading and adds it to the integral"""
+        watts = self.pm.read_watts()
+        now = time.time()
+        if self.count:
+            last = (self.count - 1) % self.times.size
+            self.energy += 0.5 * (watts + self.watts[last]) * \
+                (now - self.times[last])
+        index = self.count % self.times.size
+        self.times[index] = now
+        self.watts[index] = watts
+        self.count += 1
+        registry.set('power_watts', watts)
+        registry.set('host_energy_wh', self.energy / 3600)
+        if self.reconcile_every and self.count % self.reconcile_every == 0:
+            try:
+                self.reconcile()
+            except Exception as e:
+                self.logger.warning('Energy read error: {}'.format(e))
+        return watts
+
+    def read(self) -> Dict[str, float]:
+        """
+        Takes one power reading for a sampling group. The quantities that
+        change slowly are read only every details_every readings, so most
+        reads are a single bus transaction with the watts item selected.
+
+        :return: 'watts', plus the latest 'energy', 'volts' and 'amps'
+        """
+        watts = self.sample()
+        if self.details_every and \
+                (self.count - 1) % self.details_every == 0:
+            self.details = {'energy': self.pm.read_energy(),
+                            'volts': self.pm.read_volts(),
+                            'amps': self.pm.read_amps()}
+        return dict(self.details, watts=watts)
+
+    def buffer(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the buffered readings, oldest first
+
+        :return: (times, watts)
+        """
+        if self.count <= self.times.size:
+            return self.times[:self.count], self.watts[:self.count]
+        split = self.count % self.times.size
+        return (np.concatenate([self.times[split:], self.times[:split]]),
+                np.concatenate([self.watts[split:], self.watts[:split]]))
+
+    def cumulative_energy(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Trapezoidal cumulative energy over the buffered readings
+
+        :return: (times, Wh since the oldest buffered reading)
+        """
+        times, watts = self.buffer()
+        steps = 0.5 * (watts[1:] + watts[:-1]) * np.diff(times)
+        return times, np.concatenate([[0.0], np.cumsum(steps)]) / 3600
+
+    def window_energy(self, start: float, end: float = None) -> float:
+        """
+        Energy used between two times within the buffer
+
+        :param start: start time, as from time.time()
+        :param end: end time; the latest reading if not given
+        :return: energy in Wh
+        """
+        times, cumulative = self.cumulative_energy()
+        if not times.size:
+            return 0.0
+        end = times[-1] if end is None else end
+        return float(np.interp(end, times, cumulative) -
+                     np.interp(start, times, cumulative))
+
+    def reconcile(self) -> Tuple[float, float, float]:
+        """
+        Compares the host integral with the meter's integrator
+
+        :return: (host Wh, meter Wh, relative difference)
+        """
+        host = self.energy / 3600
+        meter = self.pm.read_energy() - self.meter_start
+        difference = abs(host - meter) / max(abs(host), 1e-9)
+        registry.set('meter_energy_wh', meter)
+        registry.set('energy_mismatch', difference)
+        if difference > self.tolerance and host > 1:
+            self.logger.warning(
+                'Meter integrator reads {:.1f} Wh but sampled power '
+                'integrates to {:.1f} Wh. Check that integration is '
+                'running'.format(meter, host))
+        return host, meter, difference
+
+    def _run(self):
+        next_time = time.time()
+        while not self._stopped.is_set():
+            try:
+                self.sample()
+            except Exception as e:
+                registry.increment('bus_retries', bus=self.pm.address)
+                self.logger.warning('Power read error: {}'.format(e))
+            next_time += self.interval
+            self._stopped.wait(max(next_time - time.time(), 0))
+
+    def reset(self):
+        """Records the meter's starting energy; call before the first
+        sample if sample() is driven from elsewhere"""
+        self.meter_start = self.pm.read_energy()
+
+    def start(self):
+        """Records the meter's starting energy and samples in the
+        background"""
+        self.reset()
+        self.thread = threading.Thread(target=self._run, name='power-sampler',
+                                       daemon=True)
+        self.thread.start()
+        self.logger.info('Sampling power every {} s'.format(self.interval))
+
+    def stop(self):
+        """Stops sampling"""
+        self._stopped.set()
+        if self.thread is not None:
+            self.thread.join()
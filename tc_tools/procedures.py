@@ -1,11 +1,32 @@
-from typing import Dict
+import csv
+import logging
+import math
+import os
+import threading
+import time
+from collections import namedtuple
+from typing import TYPE_CHECKING, Dict, List, Optional
 
-from tc_tools.utils import *
+from tc_tools.instruments import (PRT, DAQ, TCBath, PowerMeter, Solenoid,
+                                  BelimoValve, MTScale)
+from tc_tools.metrics import registry
+from tc_tools.planner import BathRateModel, plan_order, ramp_to, total_time
+from tc_tools.sampling import MultiRateSampler, ScanScheduler
+from tc_tools.tank import TankState
+from tc_tools.utils import (CalibrationWriter, DrawWriter, PRTLogWriter,
+                            steady_state_monitor)
+
+if TYPE_CHECKING:
+    from tc_tools.framebus import FrameReader
 
 
 def setpoint_calibration(prt: PRT, daq: DAQ, bath: TCBath, set_points: list,
                          output_file: os.path.abspath, headers: list,
-                         channels: list):
+                         channels: list, tc_types: List[str] = None,
+                         reference_channel: str = None,
+                         prt_log: os.path.abspath = None,
+                         bath_model: BathRateModel = None, boost: float = 0,
+                         configure_daq: bool = True, group: str = None):
     """
     Runs the calibration procedure
 
@@ -16,14 +37,36 @@ def setpoint_calibration(prt: PRT, daq: DAQ, bath: TCBath, set_points: list,
     :param output_file: path to output file
     :param headers: headers for the output file
     :param channels: channels to collect data from
+    :param tc_types: if given, scan raw voltages and convert on the host
+        with these thermocouple types (one, or one per channel)
+    :param reference_channel: cold junction channel for raw voltage scans
+    :param prt_log: path to record every PRT reading to, for fitting a
+        bath model for later runs
+    :param bath_model: if given, set points are visited in the order that
+        minimizes transition time under this model
+    :param boost: degrees past each set point to aim while ramping; see
+        planner.ramp_to
+    :param configure_daq: whether to set the DAQ channels; False when the
+        channels are already set, e.g. for a DAQ shared between baths
+    :param group: name of the bath group, for log messages
     """
     logging.info('Calibration procedure started')
-    logger = logging.getLogger('Calibration')
+    logger = logging.getLogger('Calibration' if group is None
+                               else 'Calibration ' + group)
 
-    writer = CalibrationWriter(output_file, headers)
+    writer = CalibrationWriter(output_file, ['PRT'] + headers)
+    log_writer = PRTLogWriter(prt_log) if prt_log else None
 
-    daq.set_channels(channels)
-    if max(daq.get_temp_uncalibrated()) - prt.get_temp() < 1:
+    if configure_daq:
+        if tc_types:
+            daq.set_raw_channels(channels, tc_types if len(tc_types) > 1
+                                 else tc_types[0], reference_channel)
+        else:
+            daq.set_channels(channels)
+    # Channels failing the DAQ's checks read as NaN
+    temps = [t for t in daq.get_temp_uncalibrated(channels=channels)
+             if math.isfinite(t)]
+    if max(temps) - prt.get_temp() < 1:
         logger.info('DAQ and PRT readings within 1°')
     else:
         logger.warning(
@@ -31,18 +74,130 @@ def setpoint_calibration(prt: PRT, daq: DAQ, bath: TCBath, set_points: list,
 
     bath.start()
 
+    set_points = [float(point) for point in set_points]
+    if bath_model is not None:
+        start_temp = bath.get_temp()
+        if start_temp is None:
+            start_temp = prt.get_temp()
+        planned = plan_order(set_points, start_temp, bath_model)
+        logger.info('Planned order: {} ({:.0f} min, {:.0f} min in config '
+                    'order)'.format(planned, total_time(
+                        planned, start_temp, bath_model) / 60, total_time(
+                        set_points, start_temp, bath_model) / 60))
+        set_points = planned
+
     for point in set_points:
-        bath.set_temp(point)
         logger.info('Proceeding to point: {}C'.format(point))
-        if steady_state_monitor(prt):
+        if boost:
+            ramp_to(bath, point, boost)
+        else:
+            bath.set_temp(point)
+        if steady_state_monitor(prt, prt_log=log_writer, group=group):
             logger.info('Steady state achieved')
-            writer.collect_data(prt, daq)
+            if not writer.collect_data(prt, daq, channels=channels):
+                logger.error('No readings taken at {}C'.format(point))
 
     bath.stop()
 
 
+CalibrationGroup = namedtuple('CalibrationGroup', [
+    'name', 'prt', 'bath', 'channels', 'headers', 'set_points',
+    'output_file', 'prt_log', 'bath_model'])
+CalibrationGroup.__doc__ = """One bath with its PRT and the DAQ channels of
+the thermocouples in it; prt_log and bath_model may be None"""
+
+
+def multi_bath_calibration(daq: DAQ, groups: List[CalibrationGroup],
+                           merged_file: os.path.abspath = None,
+                           tc_types: List[str] = None,
+                           reference_channel: str = None, boost: float = 0,
+                           window: float = 1.0) -> List[str]:
+    """
+    Runs the calibration procedure in several baths at once, sharing one
+    DAQ
+
+    :param daq: DAQ all the groups' thermocouples are connected to
+    :param groups: baths to calibrate in
+    :param merged_file: if given, the groups' outputs are merged into it
+    :param tc_types: as for setpoint_calibration, one type for all channels
+        or one per channel of all groups in order
+    :param reference_channel: cold junction channel for raw voltage scans
+    :param boost: as for setpoint_calibration
+    :param window: seconds a group's read waits for other groups to join
+        the same scan
+    :return: names of the groups that failed
+    """
+    logger = logging.getLogger('Calibration')
+    channels = [c for group in groups for c in group.channels]
+    if len(set(channels)) != len(channels):
+        raise ValueError('A channel is in more than one group')
+    if tc_types:
+        daq.set_raw_channels(channels, tc_types if len(tc_types) > 1
+                             else tc_types[0], reference_channel)
+    else:
+        daq.set_channels(channels)
+    scheduler = ScanScheduler(daq, window)
+    failed = []
+
+    def run(group: CalibrationGroup):
+        try:
+            setpoint_calibration(group.prt, scheduler, group.bath,
+                                 group.set_points, group.output_file,
+                                 group.headers, group.channels,
+                                 prt_log=group.prt_log,
+                                 bath_model=group.bath_model, boost=boost,
+                                 configure_daq=False, group=group.name)
+        except Exception as e:
+            failed.append(group.name)
+            logger.critical('{} failed: {}'.format(group.name, e))
+
+    threads = [threading.Thread(target=run, args=(group,),
+                                name='bath-{}'.format(group.name))
+               for group in groups]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if merged_file is not None:
+        merge_outputs([g.output_file for g in groups],
+                      [g.name for g in groups], merged_file)
+    return failed
+
+
+def merge_outputs(files: List[os.path.abspath], names: List[str],
+                  merged_file: os.path.abspath):
+    """
+    Merges calibration outputs into one file ordered by time, with a column
+    for the group and the union of the groups' columns
+
+    :param files: calibration output files
+    :param names: group name for each file
+    :param merged_file: path to write the merged data to
+    """
+    headers = []
+    rows = []
+    for name, path in zip(names, files):
+        if not os.path.isfile(path):
+            continue
+        with open(path, newline='') as f:
+            reader = csv.DictReader(f, dialect='excel')
+            for header in reader.fieldnames or []:
+                if header not in headers:
+                    headers.append(header)
+            rows += [dict(row, Group=name) for row in reader]
+    rows.sort(key=lambda row: row['Time'])
+    headers = ['Time', 'Group'] + [h for h in headers if h != 'Time']
+    with open(merged_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, headers, dialect='excel',
+                                quoting=csv.QUOTE_ALL)
+        writer.writeheader()
+        writer.writerows(rows)
+    logging.getLogger('Calibration').info(
+        'Merged {} rows into: {}'.format(len(rows), merged_file))
+
+
 def predraw(draws: int, draw_solenoid: Solenoid, power_meter: PowerMeter,
-            daq: DAQ, tank_tc: List[int]):
+            daq: DAQ, tank_tc: List[int], tank_state: TankState = None):
     """
     Performs a number of predraws
 
@@ -51,11 +206,18 @@ def predraw(draws: int, draw_solenoid: Solenoid, power_meter: PowerMeter,
     :param power_meter: power meter object
     :param daq: DAQ object
     :param tank_tc: channels of the tank thermocouples
+    :param tank_state: tank state kept current by the running data writer;
+        if not given, the tank thermocouples are read here
     """
     if draws == 0:
         return
 
-    daq.set_channels(tank_tc)
+    if tank_state is None:
+        daq.set_channels(tank_tc)
+        tank_state = TankState(tank_tc)
+        own_reads = True
+    else:
+        own_reads = False
     for n in range(draws):
         draw_solenoid.open()
         power = power_meter.read_watts()
@@ -66,13 +228,15 @@ def predraw(draws: int, draw_solenoid: Solenoid, power_meter: PowerMeter,
         while power > 100:
             time.sleep(3)
             power = power_meter.read_watts()
-        t_delta = 1.0
-        while t_delta > 0.1:
-            temps = np.array(daq.get_calibrated_temp())
-            max_temp = np.max(temps)
-            avg = np.average(temps)
-            t_delta = abs(max_temp - avg)
-            time.sleep(60)
+        t_delta = math.inf
+        # NaN, with no valid tank node, is not uniform either
+        while not t_delta <= 0.1:
+            if own_reads:
+                tank_state.update(daq.get_calibrated_temp(as_dict=True))
+                time.sleep(60)
+            else:
+                tank_state.wait_for_update(tank_state.updates, timeout=120)
+            t_delta = abs(tank_state.uniformity)
     time.sleep(3600)
 
 def purge_loop(draw_solenoid: Solenoid):
@@ -87,9 +251,28 @@ def purge_loop(draw_solenoid: Solenoid):
     time.sleep(40)
 
 
+def _next_draw_weight(sampler: MultiRateSampler, frames: 'FrameReader',
+                      timeout: float) -> Optional[float]:
+    # Weight from the next draw reading, or None if none came in time
+    if frames is None:
+        reads = sampler.groups['draw'].reads
+        if sampler.wait_for('draw', reads, timeout=timeout):
+            return sampler.latest['weight']
+        return None
+    deadline = time.time() + timeout
+    while frames.wait(max(deadline - time.time(), 0)):
+        draws = frames.frames('draw')
+        if draws:
+            return draws[-1].values['weight']
+    return None
+
+
 def draw(flow_rate: float, draw_amount: float, draw_solenoid: Solenoid,
          weigh_solenoid: Solenoid, scale: MTScale,
-         flow_valve: BelimoValve, draw_writer: DrawWriter):
+         flow_valve: BelimoValve, draw_writer: DrawWriter,
+         sampler: MultiRateSampler = None, set_flow: bool = False,
+         timeout: float = 30, max_errors: int = 3,
+         frames: 'FrameReader' = None):
     """
 
     :param flow_rate: rate (gallons per minute) to send to the valve
@@ -97,22 +280,71 @@ def draw(flow_rate: float, draw_amount: float, draw_solenoid: Solenoid,
     :param weigh_solenoid: solenoid controlling the weigh tank valve
     :param flow_valve: Belimo variable flow valve
     :param draw_writer: writer object for draw data
+    :param sampler: sampler with a 'draw' group that reads draw_writer;
+        if given, the group is activated for the draw instead of reading
+        here
+    :param set_flow: send flow_rate to the valve after resetting it,
+        rather than drawing with the valve at zero
+    :param timeout: seconds the sampler may go without a draw reading
+    :param max_errors: failed draw group reads in a row that stop the draw
+    :param frames: reader of a frame bus the sampler publishes to; if
+        given, weights come from its draw frames rather than the sampler
+    :raises IOError: if the sampler stops giving draw readings; the draw
+        solenoid is closed first
     """
     purge_loop(draw_solenoid)
     flow_valve.reset()
+    if set_flow:
+        flow_valve.set_flow(flow_rate)
     weigh_solenoid.close()
-    draw_writer.read_data(initial=True)
+    initial = draw_writer.read_data(initial=True)
+    if sampler is not None:
+        # Frame consumers see where each draw starts, as the file does
+        sampler.publish('draw', initial)
     draw_solenoid.open()
     weight = 0.0
+    target = 8.217 * draw_amount
     draw_writer.reset()
-    while weight < 8.217 * draw_amount:
-        draw_writer.read_data()
-        weight = scale.weigh()
-        time.sleep(2)
+    registry.set('draw_number', draw_writer.draw_num)
+    registry.set('draw_target_lb', target)
+    registry.set('draw_in_progress', True)
+    if sampler is not None:
+        sampler.activate('draw')
+        errors = registry.get('group_errors', group='draw')
+        waited = 0.0
+    try:
+        while weight < target:
+            if sampler is None:
+                weight = draw_writer.read_data()['weight']
+                time.sleep(2)
+            else:
+                reading = _next_draw_weight(sampler, frames, 5)
+                if reading is not None:
+                    weight = reading
+                    errors = registry.get('group_errors', group='draw')
+                    waited = 0.0
+                else:
+                    # The sampler only logs failed reads, so a dead scale
+                    # or DAQ would otherwise leave the draw running
+                    waited += 5
+                    failed = registry.get('group_errors', group='draw') - \
+                        errors
+                    if not sampler.thread.is_alive() or \
+                            failed >= max_errors or waited >= timeout:
+                        raise IOError('No draw readings for {:.0f} s ({:.0f} '
+                                      'failed reads)'.format(waited, failed))
+            registry.set('draw_weight_lb', weight)
+            registry.set('draw_progress', min(weight / target, 1.0))
+    finally:
+        draw_solenoid.close()
+        if sampler is not None:
+            sampler.activate('draw', False)
+    registry.set('draw_in_progress', False)
+    registry.increment('draws_completed')
 
 
 def valve_calibration(valve: BelimoValve, scale: MTScale,
                       draw_solenoid: Solenoid, weigh_solenoid: Solenoid,
-                      set_points: List[float]) -> Dict[float: float]:
+                      set_points: List[float]) -> Dict[float, float]:
     # TODO
     return {}
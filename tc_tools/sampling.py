@@ -0,0 +1,247 @@
+import heapq
+import logging
+import threading
+import time
+from collections import namedtuple
+from typing import Callable, Dict, List, Union
+
+from tc_tools.instruments import DAQ
+from tc_tools.metrics import registry
+from tc_tools.validity import valid_readings
+
+Frame = namedtuple('Frame', ['time', 'group', 'values'])
+Frame.__doc__ = """One group's readings: time.time() of the read, group name
+and {signal name: value}"""
+
+
+class SampleGroup:
+    """Signals read together at one cadence"""
+
+    def __init__(self, name: str, interval: float,
+                 read: Callable[[], Dict[str, float]], active: bool = True):
+        """
+        Creates a sampling group
+
+        :param name: group name, e.g. 'draw'
+        :param interval: seconds between reads
+        :param read: reads the group's signals and returns them by name
+        :param active: whether the group is read from the start
+        """
+        self.name = name
+        self.interval = interval
+        self.read = read
+        self.active = active
+        self.reads = 0
+
+
+class MultiRateSampler:
+    """Reads each group at its own cadence and merges the readings into
+    one stream of timestamped frames"""
+
+    logger = logging.getLogger('Sampler')
+
+    def __init__(self, groups: List[SampleGroup]):
+        """
+        Creates a sampler; call start() to begin sampling
+
+        :param groups: groups to read
+        """
+        self.groups = {group.name: group for group in groups}
+        self.latest = {}
+        self.latest_time = {}
+        self._subscribers = []
+        self._changed = threading.Condition()
+        self._publishing = threading.Lock()
+        self._stopped = threading.Event()
+        self._wake = threading.Event()
+        self._activated = set()
+        self.thread = None
+
+    def subscribe(self, callback: Callable[[Frame], None]):
+        """
+        Calls a function with every frame, from the sampling thread
+
+        :param callback: takes a Frame; should return quickly
+        """
+        self._subscribers.append(callback)
+
+    def activate(self, name: str, active: bool = True):
+        """
+        Starts or stops reading a group; an activated group is read
+        immediately
+
+        :param name: group name
+        :param active: whether to read the group
+        """
+        self.groups[name].active = active
+        if active:
+            self._activated.add(name)
+            self._wake.set()
+
+    def wait_for(self, name: str, reads: int, timeout: float = None) -> bool:
+        """
+        Blocks until a group has been read more than a given number of times
+
+        :param name: group name
+        :param reads: read count already seen
+        :param timeout: seconds to wait at most
+        :return: whether a newer read arrived
+        """
+        group = self.groups[name]
+        with self._changed:
+            return self._changed.wait_for(lambda: group.reads > reads,
+                                          timeout)
+
+    def publish(self, name: str, values: Dict[str, float],
+                started: float = None) -> Frame:
+        """
+        Publishes readings as a frame of a group; for reads made outside
+        the sampling thread, such as the row before a draw
+
+        :param name: group name
+        :param values: {signal name: value}
+        :param started: time.time() of the read; now if not given
+        :return: the frame
+        """
+        started = time.time() if started is None else started
+        frame = Frame(started, name, values)
+        with self._changed:
+            self.latest.update(values)
+            for signal in values:
+                self.latest_time[signal] = started
+            self.groups[name].reads += 1
+            self._changed.notify_all()
+        # Subscribers such as a FrameBus expect one writer at a time
+        with self._publishing:
+            for callback in self._subscribers:
+                callback(frame)
+        return frame
+
+    def sample(self, group: SampleGroup) -> Frame:
+        """Reads one group and publishes the frame"""
+        started = time.time()
+        values = group.read()
+        registry.set('group_read_seconds', time.time() - started,
+                     group=group.name)
+        return self.publish(group.name, values, started)
+
+    def _run(self):
+        # Earliest deadline first, one bus user at a time
+        now = time.time()
+        deadlines = [(now, n, group) for n, group
+                     in enumerate(self.groups.values())]
+        heapq.heapify(deadlines)
+        while not self._stopped.is_set():
+            if self._activated:
+                # Newly activated groups are read right away
+                now = time.time()
+                activated, self._activated = self._activated, set()
+                deadlines = [(now if g.name in activated else d, i, g)
+                             for d, i, g in deadlines]
+                heapq.heapify(deadlines)
+            due, n, group = deadlines[0]
+            if self._wake.wait(max(due - time.time(), 0)):
+                self._wake.clear()
+                continue
+            if self._stopped.is_set():
+                return
+            if group.active:
+                try:
+                    self.sample(group)
+                except Exception as e:
+                    registry.increment('group_errors', group=group.name)
+                    self.logger.warning('{} read error: {}'.format(group.name,
+                                                                   e))
+            # Skip intervals missed while the bus was busy
+            now = time.time()
+            due += group.interval * (int((now - due) // group.interval) + 1)
+            heapq.heapreplace(deadlines, (due, n, group))
+
+    def start(self):
+        """Starts sampling in a background thread"""
+        self.thread = threading.Thread(target=self._run, name='sampler',
+                                       daemon=True)
+        self.thread.start()
+        self.logger.info('Sampling groups: {}'.format(', '.join(
+            '{} every {} s'.format(g.name, g.interval)
+            for g in self.groups.values())))
+
+    def stop(self):
+        """Stops sampling"""
+        self._stopped.set()
+        self._wake.set()
+        if self.thread is not None:
+            self.thread.join()
+
+
+class ScanScheduler:
+    """Shares one DAQ between threads by merging reads requested close
+    together into a single scan of all their channels"""
+
+    logger = logging.getLogger('Scan Scheduler')
+
+    def __init__(self, daq: DAQ, window: float = 1.0):
+        """
+        Creates a scheduler for a DAQ with all users' channels already set
+
+        :param daq: DAQ to share
+        :param window: seconds the first request of a scan waits for others
+            to join it
+        """
+        self.daq = daq
+        self.address = daq.address
+        self.window = window
+        self._changed = threading.Condition()
+        self._pending = set()
+        self._batch = 0
+        self._leading = False
+        # {batch: (scan, error)} and {batch: requests yet to collect it}
+        self._results = {}
+        self._requests = {}
+
+    def get_temp_uncalibrated(self, as_dict: bool = False,
+                              channels: List[str] = None) -> Union[list,
+                                                                    dict]:
+        """
+        Reads channels without calibration as part of the next shared scan;
+        same as DAQ.get_temp_uncalibrated, with the checks applied to the
+        combined scan
+
+        :param as_dict: whether to return as a dict
+        :param channels: channels to read; all the DAQ's if not given
+        :return: temperature readings, ordered by channel
+        """
+        channels = self.daq.channels if channels is None else channels
+        with self._changed:
+            batch = self._batch
+            self._pending.update(channels)
+            self._requests[batch] = self._requests.get(batch, 0) + 1
+            leader = not self._leading
+            self._leading = True
+        if leader:
+            time.sleep(self.window)
+            with self._changed:
+                scan = sorted(self._pending, key=int)
+                self._pending = set()
+                self._leading = False
+                self._batch += 1
+            registry.set('scan_batch_channels', len(scan), bus=self.address)
+            try:
+                result = (self.daq.read_scan(scan), None)
+            except Exception as e:
+                result = (None, e)
+            with self._changed:
+                self._results[batch] = result
+                self._changed.notify_all()
+        with self._changed:
+            self._changed.wait_for(lambda: batch in self._results)
+            scan, error = self._results[batch]
+            self._requests[batch] -= 1
+            if not self._requests[batch]:
+                del self._results[batch], self._requests[batch]
+        if error is not None:
+            raise error
+        data = valid_readings(scan, channels)
+        if as_dict:
+            return dict(zip(channels, data))
+        return data
@@ -0,0 +1,12 @@
+"""Simulated tank, bath and instruments that stand in for the lab
+hardware, for tuning and regression-testing procedures"""
+from tc_tools.sim.backend import (SimResourceManager, SimResource,
+                                  SimDAQResource, SimPowerMeterResource,
+                                  SimBathResource, SimPRTResource,
+                                  bath_channels)
+from tc_tools.sim.clock import SimClock
+from tc_tools.sim.models import (StratifiedTank, FlowModel, FirstOrderBath,
+                                 WaterHeaterPlant)
+from tc_tools.sim.stands import (simulated_use_stand, calibration_stand,
+                                 run_simulated_use, write_schedule,
+                                 USE_CHANNELS)
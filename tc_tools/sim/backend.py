@@ -0,0 +1,223 @@
+import re
+from typing import Callable, Dict
+
+import numpy as np
+
+from tc_tools.sim.models import FirstOrderBath, WaterHeaterPlant
+from tc_tools.thermocouple import temp_to_emf
+
+
+def _channels(command: str) -> list:
+    match = re.search(r'\(@([\d,]+)\)', command)
+    return match.group(1).split(',') if match else []
+
+
+class SimResource:
+    """Answers SCPI like a pyvisa resource; subclasses model one
+    instrument"""
+
+    def __init__(self):
+        self.written = []
+        self.queries = 0
+
+    def clear(self):
+        pass
+
+    def close(self):
+        pass
+
+    def write(self, command: str):
+        self.written.append(command)
+        self.handle(command.strip())
+
+    def query(self, query: str) -> str:
+        self.queries += 1
+        return self.respond(query.strip())
+
+    def query_ascii_values(self, query: str) -> list:
+        return [float(v) for v in self.query(query).split(',')]
+
+    def handle(self, command: str):
+        """Acts on a command"""
+
+    def respond(self, query: str) -> str:
+        """Answers a query"""
+        raise IOError('Unsupported query: {}'.format(query))
+
+
+class SimDAQResource(SimResource):
+    """34970A scanning simulated signals"""
+
+    def __init__(self, temperatures: Dict[str, Callable[[], float]] = None,
+                 voltages: Dict[str, Callable[[], float]] = None,
+                 currents: Dict[str, Callable[[], float]] = None,
+                 switches: Dict[str, Callable[[bool], None]] = None,
+                 sources: Dict[str, Callable[[float], None]] = None,
+                 tc_type: str = 'T', terminal_temp: float = 23.0):
+        """
+        :param temperatures: {channel: reads the thermocouple's temperature}
+        :param voltages: {channel: reads the voltage of a sensor output}
+        :param currents: {channel: reads the current of a sensor output}
+        :param switches: {channel: called with True on ROUT:OPEN and False
+            on ROUT:CLOS}
+        :param sources: {channel: called with the volts of SOURCE:VOLT}
+        :param tc_type: thermocouple type, for channels scanned as raw
+            voltages
+        :param terminal_temp: temperature of the terminal block, read by a
+            reference channel
+        """
+        super(SimDAQResource, self).__init__()
+        self.temperatures = temperatures or {}
+        self.voltages = voltages or {}
+        self.currents = currents or {}
+        self.switches = switches or {}
+        self.sources = sources or {}
+        self.tc_type = tc_type
+        self.terminal_temp = terminal_temp
+        self.functions = {}
+        self.scan_list = []
+
+    def handle(self, command: str):
+        channels = _channels(command)
+        if command.startswith('CONF:'):
+            function = command[5:].split()[0].split(':')[0]
+            self.functions.update(dict.fromkeys(channels, function))
+            self.scan_list = channels
+        elif command.startswith('ROUT:SCAN'):
+            self.scan_list = channels
+        elif command.startswith('ROUT:OPEN') or \
+                command.startswith('ROUT:CLOS'):
+            for channel in channels:
+                if channel in self.switches:
+                    self.switches[channel](command.startswith('ROUT:OPEN'))
+        elif command.startswith('SOURCE:VOLT'):
+            volts = float(command.split()[1].rstrip(','))
+            for channel in channels:
+                if channel in self.sources:
+                    self.sources[channel](volts)
+
+    def read_channel(self, channel: str) -> float:
+        function = self.functions.get(channel, 'TEMP')
+        if function == 'TEMP':
+            if channel in self.temperatures:
+                return self.temperatures[channel]()
+            return self.terminal_temp
+        if function == 'VOLT':
+            if channel in self.voltages:
+                return self.voltages[channel]()
+            # Thermocouple read raw, referenced to the terminal block
+            emf = temp_to_emf(self.temperatures[channel](), self.tc_type) - \
+                temp_to_emf(self.terminal_temp, self.tc_type)
+            return float(emf[0]) * 1e-6
+        if function == 'CURR':
+            return self.currents[channel]()
+        raise IOError('Channel {} not configured'.format(channel))
+
+    def respond(self, query: str) -> str:
+        if query != 'READ?':
+            return super(SimDAQResource, self).respond(query)
+        scan = sorted(self.scan_list, key=int)
+        return ','.join('{:.6E}'.format(self.read_channel(c)) for c in scan)
+
+
+class SimPowerMeterResource(SimResource):
+    """Power meter measuring the plant's element"""
+
+    def __init__(self, plant: WaterHeaterPlant):
+        super(SimPowerMeterResource, self).__init__()
+        self.plant = plant
+        self.item = 'W'
+
+    def handle(self, command: str):
+        if command.startswith('MEAS:NORM:ITEM:') and \
+                command.endswith(':ELEMENT1'):
+            self.item = command.split(':')[3]
+        elif command == 'INTEG:RESET':
+            self.plant.energy = 0.0
+        elif command == 'INTEG:START':
+            self.plant.integrating = True
+        elif command == 'INTEG:STOP':
+            self.plant.integrating = False
+
+    def respond(self, query: str) -> str:
+        if query != 'MEAS:NORM:VAL?':
+            return super(SimPowerMeterResource, self).respond(query)
+        values = {'V': self.plant.line_voltage, 'W': self.plant.power,
+                  'A': self.plant.power / self.plant.line_voltage,
+                  'WH': self.plant.energy / 3600}
+        return '{:.6E}'.format(values[self.item])
+
+
+class SimBathResource(SimResource):
+    """Thermo AC25 controlling a first-order bath"""
+
+    def __init__(self, bath: FirstOrderBath):
+        super(SimBathResource, self).__init__()
+        self.bath = bath
+
+    def handle(self, command: str):
+        if command == 'W GO 1':
+            self.bath.running = True
+        elif command == 'W RR -1':
+            self.bath.running = False
+        elif command.startswith('W SP '):
+            self.bath.set_point = float(command[5:])
+
+    def respond(self, query: str) -> str:
+        if query != 'R T1':
+            return super(SimBathResource, self).respond(query)
+        return 'T1 {:.2f} C\r\n'.format(self.bath.temp)
+
+
+class SimPRTResource(SimResource):
+    """Hart PRT in a simulated bath"""
+
+    def __init__(self, bath: FirstOrderBath):
+        super(SimPRTResource, self).__init__()
+        self.bath = bath
+
+    def respond(self, query: str) -> str:
+        if query != 'READ?':
+            return super(SimPRTResource, self).respond(query)
+        return 'T1:  {:6.3f} C\r\n'.format(self.bath.read())
+
+
+class SimResourceManager:
+    """Resource manager handing out simulated instruments by address"""
+
+    def __init__(self, resources: Dict[str, SimResource]):
+        """
+        :param resources: {VISA address: simulated resource}
+        """
+        self.resources = resources
+
+    def open_resource(self, address: str) -> SimResource:
+        try:
+            return self.resources[address]
+        except KeyError:
+            raise IOError('No simulated instrument at {}'.format(address))
+
+    def list_resources(self) -> tuple:
+        return tuple(self.resources)
+
+    def close(self):
+        pass
+
+
+def bath_channels(bath: FirstOrderBath, channels: list,
+                  errors: list = None, seed: int = 1) -> Dict[str, Callable]:
+    """
+    Thermocouples in a bath, each off by a fixed error
+
+    :param bath: bath the thermocouples are in
+    :param channels: DAQ channels
+    :param errors: error of each thermocouple in C; random within 0.5 C if
+        not given
+    :param seed: random seed for the errors
+    :return: {channel: reads the thermocouple}, for SimDAQResource
+    """
+    if errors is None:
+        errors = np.random.default_rng(seed).uniform(-0.5, 0.5,
+                                                     len(channels))
+    return {str(c): (lambda e=e: bath.read() + e)
+            for c, e in zip(channels, errors)}
@@ -0,0 +1,117 @@
+import importlib
+import threading
+import time as _time
+from typing import Callable, List
+
+# Modules whose time.sleep and time.time drive the procedures
+PATCHED_MODULES = ['tc_tools.instruments', 'tc_tools.utils',
+                   'tc_tools.procedures', 'tc_tools.planner',
+                   'tc_tools.power', 'tc_tools.sampling', 'tc_tools.tank',
+                   'tc_tools.journal']
+
+
+class SimClock:
+    """Stand-in for the time module in which sleeping advances the plant
+    models instead of waiting"""
+
+    def __init__(self, start: float = None):
+        """
+        :param start: simulated time.time() at the start; now if not given
+        """
+        self.now = _time.time() if start is None else start
+        self._models = []
+        self._timers = []
+        self._lock = threading.RLock()
+        self._saved = {}
+
+    def add_model(self, advance: Callable[[float], None]):
+        """
+        Steps a model whenever simulated time passes
+
+        :param advance: takes the seconds passed
+        """
+        self._models.append(advance)
+
+    def every(self, interval: float, callback: Callable[[], None],
+              start: float = None) -> list:
+        """
+        Calls a function each time simulated time reaches the next multiple
+        of an interval, including during sleeps inside procedures
+
+        :param interval: simulated seconds between calls
+        :param callback: takes no arguments
+        :param start: simulated time of the first call; now if not given
+        :return: the timer, for cancel()
+        """
+        timer = [self.now if start is None else start, interval, callback]
+        with self._lock:
+            self._timers.append(timer)
+        return timer
+
+    def cancel(self, timer: list):
+        """Stops a timer from every()"""
+        with self._lock:
+            if timer in self._timers:
+                self._timers.remove(timer)
+
+    def _advance(self, seconds: float):
+        if seconds > 0:
+            for advance in self._models:
+                advance(seconds)
+            self.now += seconds
+
+    def time(self) -> float:
+        return self.now
+
+    def perf_counter(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        """Advances simulated time and every model, calling the timers
+        that fall due on the way"""
+        if seconds <= 0:
+            return
+        with self._lock:
+            end = self.now + seconds
+            while self._timers:
+                timer = min(self._timers, key=lambda t: t[0])
+                if timer[0] > end:
+                    break
+                self._advance(timer[0] - self.now)
+                # Rescheduled first, so sleeps inside the callback don't
+                # call it again
+                timer[0] += timer[1]
+                timer[2]()
+            self._advance(end - self.now)
+
+    def __getattr__(self, name):
+        # strftime, localtime etc. come from the real module
+        return getattr(_time, name)
+
+    def install(self, modules: List[str] = None):
+        """
+        Replaces the time module in the given tc_tools modules
+
+        :param modules: module names; PATCHED_MODULES if not given
+        """
+        for name in PATCHED_MODULES if modules is None else modules:
+            module = importlib.import_module(name)
+            if name not in self._saved:
+                self._saved[name] = module.time
+            module.time = self
+
+    def uninstall(self):
+        """Restores the real time module"""
+        for name, original in self._saved.items():
+            importlib.import_module(name).time = original
+        self._saved = {}
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, *args):
+        self.uninstall()
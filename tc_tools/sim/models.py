@@ -0,0 +1,226 @@
+from typing import List
+
+import numpy as np
+
+CP_WATER = 4184.0  # J/(kg K)
+KG_PER_GAL = 8.217 * 0.45359237
+LB_PER_KG = 1 / 0.45359237
+
+
+class StratifiedTank:
+    """Water heater tank as a stack of fully mixed nodes"""
+
+    def __init__(self, volume: float = 50, nodes: int = 6,
+                 heater_power: float = 4500, heater_node: int = 4,
+                 set_point: float = 51.7, deadband: float = 5.0,
+                 ua: float = 2.0, conductance: float = 10.0,
+                 initial_temp: float = 51.7, ambient: float = 19.7,
+                 inlet_temp: float = 14.4):
+        """
+        Creates a tank at a uniform temperature
+
+        :param volume: tank volume in gallons
+        :param nodes: number of nodes, top to bottom; one per tank
+            thermocouple
+        :param heater_power: element power in W
+        :param heater_node: node holding the element and its thermostat
+        :param set_point: thermostat set point in C
+        :param deadband: the element turns on this far below the set point
+        :param ua: standby loss coefficient of the whole tank in W/K
+        :param conductance: W/K between neighbouring nodes
+        :param initial_temp: starting temperature of every node
+        :param ambient: surrounding air temperature in C
+        :param inlet_temp: temperature of water entering the bottom
+        """
+        self.temps = np.full(nodes, float(initial_temp))
+        self.capacity = volume * KG_PER_GAL * CP_WATER / nodes  # J/K per node
+        self.node_volume = volume / nodes
+        self.heater_power = heater_power
+        self.heater_node = heater_node
+        self.set_point = set_point
+        self.deadband = deadband
+        self.ua = ua / nodes
+        self.conductance = conductance
+        self.ambient = ambient
+        self.inlet_temp = inlet_temp
+        self.heating = False
+        self.outlet_temp = initial_temp
+
+    def advance(self, dt: float, flow: float = 0.0) -> float:
+        """
+        Steps the tank forward
+
+        :param dt: seconds to step
+        :param flow: draw rate in gallons per minute
+        :return: energy used by the element in J
+        """
+        thermostat = self.temps[self.heater_node]
+        if thermostat < self.set_point - self.deadband:
+            self.heating = True
+        elif thermostat >= self.set_point:
+            self.heating = False
+        # Explicit conduction and losses; the step is split to stay stable
+        steps = max(1, int(np.ceil(dt * 4 * self.conductance /
+                                   self.capacity)))
+        h = dt / steps
+        heat = np.zeros_like(self.temps)
+        if self.heating:
+            heat[self.heater_node] = self.heater_power
+        for _ in range(steps):
+            gradient = np.diff(self.temps) * self.conductance
+            transfer = heat - self.ua * (self.temps - self.ambient)
+            transfer[:-1] += gradient
+            transfer[1:] -= gradient
+            self.temps += transfer * h / self.capacity
+        if flow > 0:
+            self._draw(flow * dt / 60)
+        # Hot water under cold rises; sorting mixes without changing energy
+        self.temps = np.sort(self.temps)[::-1]
+        return heat.sum() * dt
+
+    def _draw(self, gallons: float):
+        # Plug flow up the stack in sub-steps of at most one node volume
+        steps = max(1, int(np.ceil(gallons / self.node_volume)))
+        fraction = gallons / self.node_volume / steps
+        delivered = 0.0
+        for _ in range(steps):
+            below = np.append(self.temps[1:], self.inlet_temp)
+            delivered += self.temps[0]
+            self.temps = (1 - fraction) * self.temps + fraction * below
+        self.outlet_temp = delivered / steps
+
+    @property
+    def mean(self) -> float:
+        """Average tank temperature"""
+        return float(self.temps.mean())
+
+
+class FlowModel:
+    """Draw flow through the valve into the weigh tank on the scale"""
+
+    def __init__(self, valve_gain: float = 0.4, unregulated_flow: float = 3.0,
+                 drain_rate: float = 60.0):
+        """
+        :param valve_gain: gallons per minute per volt sent to the valve
+        :param unregulated_flow: gallons per minute while the valve is at
+            0 V, as when the procedure never sets a flow
+        :param drain_rate: lb/s the weigh tank drains with its solenoid
+            open
+        """
+        self.valve_gain = valve_gain
+        self.unregulated_flow = unregulated_flow
+        self.drain_rate = drain_rate
+        self.valve_volts = 0.0
+        self.draw_open = False
+        self.weigh_open = True
+        self.weight = 0.0  # lb in the weigh tank
+
+    @property
+    def flow(self) -> float:
+        """Current draw rate in gallons per minute"""
+        if not self.draw_open:
+            return 0.0
+        if self.valve_volts <= 0:
+            return self.unregulated_flow
+        return self.valve_volts * self.valve_gain
+
+    def advance(self, dt: float, flow: float):
+        """
+        Fills or drains the weigh tank
+
+        :param dt: seconds to step
+        :param flow: draw rate over the step in gallons per minute
+        """
+        if self.weigh_open:
+            self.weight = max(self.weight - self.drain_rate * dt, 0.0)
+        else:
+            self.weight += flow * dt / 60 * KG_PER_GAL * LB_PER_KG
+
+
+class FirstOrderBath:
+    """Calibration bath approaching its set point at a limited rate"""
+
+    def __init__(self, temp: float = 20.0, time_constant: float = 300.0,
+                 heat_rate: float = 1.0 / 60, cool_rate: float = 0.5 / 60,
+                 noise: float = 0.002, seed: int = 0):
+        """
+        :param temp: starting temperature in C
+        :param time_constant: seconds of the first-order approach
+        :param heat_rate: largest heating rate in C/s
+        :param cool_rate: largest cooling rate in C/s
+        :param noise: standard deviation of the temperature in C
+        :param seed: random seed for the noise
+        """
+        self.temp = float(temp)
+        self.set_point = float(temp)
+        self.time_constant = time_constant
+        self.heat_rate = heat_rate
+        self.cool_rate = cool_rate
+        self.noise = noise
+        self.running = False
+        self._random = np.random.default_rng(seed)
+
+    def advance(self, dt: float):
+        """Steps the bath forward by dt seconds"""
+        if not self.running:
+            return
+        change = (self.set_point - self.temp) * \
+            (1 - np.exp(-dt / self.time_constant))
+        self.temp += float(np.clip(change, -self.cool_rate * dt,
+                                   self.heat_rate * dt))
+
+    def read(self) -> float:
+        """Measured bath temperature"""
+        return self.temp + self.noise * self._random.standard_normal()
+
+
+class WaterHeaterPlant:
+    """Tank, draw plumbing and room for the simulated use test"""
+
+    def __init__(self, tank: StratifiedTank = None, flow: FlowModel = None,
+                 ambient: float = 19.7, rh: float = 50.0,
+                 line_voltage: float = 240.0, step: float = 10.0):
+        """
+        :param tank: tank model; a default 50 gal tank if not given
+        :param flow: flow model; defaults if not given
+        :param ambient: room temperature in C
+        :param rh: room relative humidity in percent
+        :param line_voltage: supply voltage in V
+        :param step: longest model step in seconds
+        """
+        self.tank = StratifiedTank(ambient=ambient) if tank is None else tank
+        self.flow = FlowModel() if flow is None else flow
+        self.ambient = ambient
+        self.rh = rh
+        self.line_voltage = line_voltage
+        self.step = step
+        self.energy = 0.0  # J since the meter's integration was reset
+        self.integrating = False
+
+    def advance(self, dt: float):
+        """Steps every part of the plant forward by dt seconds"""
+        while dt > 0:
+            h = min(dt, self.step)
+            flow = self.flow.flow
+            used = self.tank.advance(h, flow)
+            if self.integrating:
+                self.energy += used
+            self.flow.advance(h, flow)
+            dt -= h
+
+    @property
+    def power(self) -> float:
+        """Instantaneous element power in W"""
+        return self.tank.heater_power if self.tank.heating else 0.0
+
+    @property
+    def outlet_temp(self) -> float:
+        """Outlet temperature; the top of the tank while drawing, otherwise
+        the pipe cooling to room temperature"""
+        if self.flow.flow > 0:
+            return self.tank.outlet_temp
+        return self.ambient
+
+    def temperatures(self) -> List[float]:
+        """Tank node temperatures, top to bottom"""
+        return list(self.tank.temps)
@@ -0,0 +1,199 @@
+import csv
+import os
+import time
+from collections import namedtuple
+from typing import List
+
+from tc_tools.instruments import (PRT, DAQ, TCBath, PowerMeter, Solenoid,
+                                  BelimoValve, MTScale, HumiditySensor)
+from tc_tools.sim.backend import (SimResourceManager, SimDAQResource,
+                                  SimPowerMeterResource, SimBathResource,
+                                  SimPRTResource, bath_channels)
+from tc_tools.sim.clock import SimClock
+from tc_tools.sim.models import FirstOrderBath, WaterHeaterPlant
+
+UseStand = namedtuple('UseStand', [
+    'daq', 'power_meter', 'draw_solenoid', 'weigh_solenoid', 'flow_valve',
+    'scale', 'rh_sensor', 'plant', 'clock', 'channels'])
+UseStand.__doc__ = """Simulated use test instruments over a simulated
+plant; channels names each signal's DAQ channel"""
+
+CalibrationStand = namedtuple('CalibrationStand', [
+    'daq', 'prt', 'bath', 'model', 'clock'])
+CalibrationStand.__doc__ = """Calibration instruments over a simulated
+bath"""
+
+USE_CHANNELS = {'tank': ['101', '102', '103', '104', '105', '106'],
+                'inlet': '107', 'outlet': '108', 'ambient': '109',
+                'scale': '110', 'rh': '111', 'draw solenoid': '201',
+                'weigh solenoid': '202', 'valve': '204'}
+
+
+def simulated_use_stand(plant: WaterHeaterPlant = None, channels: dict = None,
+                        clock: SimClock = None,
+                        volt_const: float = 2.5) -> UseStand:
+    """
+    Builds the simulated use test instruments over a simulated plant
+
+    :param plant: plant to measure; a default tank if not given
+    :param channels: DAQ channel of each signal; USE_CHANNELS if not given
+    :param clock: clock that steps the plant; a new one if not given. Call
+        clock.install() so procedures sleep in simulated time.
+    :param volt_const: valve volts per gallon per minute, matching the
+        plant's valve gain
+    :return: the instruments, plant and clock
+    """
+    plant = WaterHeaterPlant() if plant is None else plant
+    channels = dict(USE_CHANNELS, **(channels or {}))
+    clock = SimClock() if clock is None else clock
+    clock.add_model(plant.advance)
+    tank = plant.tank
+    flow = plant.flow
+    flow.valve_gain = 1 / volt_const
+    daq = SimDAQResource()
+    manager = SimResourceManager({'SIM::DAQ': daq,
+                                  'SIM::POWER': SimPowerMeterResource(plant)})
+    daq_instrument = DAQ('SIM::DAQ', manager)
+    scale = MTScale(daq_instrument, int(channels['scale']))
+    rh_sensor = HumiditySensor(daq_instrument, int(channels['rh']))
+
+    daq.temperatures = {c: (lambda n=n: tank.temps[n])
+                        for n, c in enumerate(channels['tank'])}
+    daq.temperatures.update({channels['inlet']: lambda: tank.inlet_temp,
+                             channels['outlet']: lambda: plant.outlet_temp,
+                             channels['ambient']: lambda: plant.ambient})
+    # Sensor outputs are the inverse of the instruments' conversions
+    daq.voltages = {channels['scale']:
+                    lambda: (flow.weight - scale.offset) / scale.gain}
+    daq.currents = {channels['rh']:
+                    lambda: (plant.rh - rh_sensor.offset) / rh_sensor.gain}
+    daq.switches = {channels['draw solenoid']:
+                    lambda opened: setattr(flow, 'draw_open', opened),
+                    channels['weigh solenoid']:
+                    lambda opened: setattr(flow, 'weigh_open', opened)}
+    daq.sources = {channels['valve']:
+                   lambda volts: setattr(flow, 'valve_volts', volts)}
+    return UseStand(
+        daq_instrument, PowerMeter('SIM::POWER', manager),
+        Solenoid(daq_instrument, int(channels['draw solenoid'])),
+        Solenoid(daq_instrument, int(channels['weigh solenoid'])),
+        BelimoValve(daq_instrument, int(channels['valve']), volt_const),
+        scale, rh_sensor, plant, clock, channels)
+
+
+def calibration_stand(channels: List[str], errors: List[float] = None,
+                      bath: FirstOrderBath = None,
+                      clock: SimClock = None) -> CalibrationStand:
+    """
+    Builds the calibration instruments over a simulated bath
+
+    :param channels: DAQ channels of the thermocouples in the bath
+    :param errors: error of each thermocouple in C; random if not given
+    :param bath: bath model; a default bath if not given
+    :param clock: clock that steps the bath; a new one if not given
+    :return: the instruments, bath model and clock
+    """
+    bath = FirstOrderBath() if bath is None else bath
+    clock = SimClock() if clock is None else clock
+    clock.add_model(bath.advance)
+    manager = SimResourceManager({
+        'SIM::DAQ': SimDAQResource(bath_channels(bath, channels, errors)),
+        'SIM::PRT': SimPRTResource(bath),
+        'SIM::BATH': SimBathResource(bath)})
+    return CalibrationStand(DAQ('SIM::DAQ', manager),
+                            PRT('SIM::PRT', manager),
+                            TCBath('SIM::BATH', manager), bath, clock)
+
+
+def write_schedule(path: os.path.abspath, draws: List[tuple]):
+    """
+    Writes a draw schedule in the format read by parse_schedule
+
+    :param path: schedule file path
+    :param draws: (minutes into the test, gallons, gallons per minute)
+    """
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f, dialect='excel')
+        for minutes, volume, rate in draws:
+            writer.writerow(['{}:{:02d}'.format(int(minutes) // 60,
+                                                int(minutes) % 60),
+                             volume, rate])
+
+
+def run_simulated_use(stand: UseStand, schedule_file: os.path.abspath,
+                      output_file: os.path.abspath,
+                      draw_file: os.path.abspath, duration: float = 86400,
+                      headers: List[str] = None) -> float:
+    """
+    Runs the simulated use test against a simulated stand in one thread,
+    with the same writers and draw procedure as DOEtest.py
+
+    :param stand: stand from simulated_use_stand
+    :param schedule_file: draw schedule
+    :param output_file: minutely data file
+    :param draw_file: draw data file
+    :param duration: simulated seconds to run
+    :param headers: minutely file headers; DOEtest.py's if not given
+    :return: wall-clock seconds taken
+    """
+    # Imported here so the sim modules load without the procedure modules
+    import tc_tools.procedures as p
+    from tc_tools.tank import TankState
+    from tc_tools.utils import DrawWriter, SimulatedUseWriter, parse_schedule
+
+    wall_start = time.perf_counter()
+    channels = stand.channels
+    with stand.clock:
+        daq = stand.daq
+        daq.set_channels(channels['tank'] + [channels['inlet'],
+                                             channels['outlet'],
+                                             channels['ambient']])
+        if headers is None:
+            headers = ['Elapsed', 'Draw Status', 'Inst. Tank Avg'] + \
+                ['Tank {}'.format(n + 1)
+                 for n in range(len(channels['tank']))] + \
+                ['Inlet', 'Outlet', 'Ambient', 'RH', 'Power', 'Energy',
+                 'Volts', 'Amps']
+        draw_writer = DrawWriter(['Elapsed', 'Inlet Temperature',
+                                  'Outlet Temperature', 'Scale Weight'],
+                                 draw_file, channels['inlet'],
+                                 channels['outlet'], daq, stand.scale)
+        tank_state = TankState(channels['tank'], inlet_channel=channels[
+            'inlet'])
+        min_writer = SimulatedUseWriter(headers, output_file, daq,
+                                        stand.rh_sensor, stand.power_meter,
+                                        tank_state)
+        stand.power_meter.reset_integration()
+        stand.power_meter.start_integration()
+        schedule = parse_schedule(schedule_file)
+        clock = stand.clock
+        start = clock.time()
+        min_writer.clock_reset(start)
+        # Minutely reads come from the clock, so they go on through draws
+        # as DOEtest.py's loop does beside its draw thread
+        minutely = clock.every(60, min_writer.read_data, start)
+        draw_num = 0
+        while clock.time() - start < duration:
+            elapsed = clock.time() - start
+            if draw_num < len(schedule.time) and \
+                    elapsed >= schedule.time[draw_num]:
+                draw_writer.set_draw_num(draw_num)
+                min_writer.set_drawing(True)
+                p.draw(schedule.rate[draw_num], schedule.volume[draw_num],
+                       stand.draw_solenoid, stand.weigh_solenoid,
+                       stand.scale, stand.flow_valve, draw_writer,
+                       set_flow=True)
+                # The procedure leaves the weigh tank full; drain it so the
+                # next draw starts from an empty tank
+                stand.weigh_solenoid.open()
+                min_writer.set_drawing(False)
+                draw_num += 1
+            else:
+                step = duration - elapsed
+                if draw_num < len(schedule.time):
+                    step = min(step, schedule.time[draw_num] - elapsed)
+                clock.sleep(step)
+        clock.cancel(minutely)
+        min_writer.flush()
+        draw_writer.flush()
+    return time.perf_counter() - wall_start
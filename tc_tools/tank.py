@@ -0,0 +1,132 @@
+import threading
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from tc_tools.metrics import registry
+
+CP_WATER = 4184.0  # J/(kg K)
+KG_PER_GAL = 8.217 * 0.45359237
+
+
+class TankState:
+    """Derived tank quantities, updated from each thermocouple scan"""
+
+    def __init__(self, tank_channels: List[str], volume: float = None,
+                 fractions: List[float] = None, inlet_channel: str = None,
+                 inlet_temp: float = 14.4):
+        """
+        Creates a tracker for the given tank thermocouples
+
+        :param tank_channels: tank thermocouple channels, top to bottom
+        :param volume: tank volume in gallons, for stored energy
+        :param fractions: share of the tank volume each thermocouple
+            represents; equal shares if not given
+        :param inlet_channel: channel of the inlet thermocouple, the
+            reference for stored energy
+        :param inlet_temp: reference used until the inlet has been read
+        """
+        self.channels = [str(c) for c in tank_channels]
+        if fractions is None:
+            fractions = [1.0] * len(self.channels)
+        if len(fractions) != len(self.channels):
+            raise ValueError('Need one volume fraction per tank channel')
+        self.weights = np.array(fractions, dtype=float)
+        self.weights /= self.weights.sum()
+        self.capacity = np.nan if volume is None else \
+            volume * KG_PER_GAL * CP_WATER
+        self.inlet_channel = None if inlet_channel is None \
+            else str(inlet_channel)
+        self.inlet = inlet_temp
+        self.temps = np.full(len(self.channels), np.nan)
+        # Weights renormalised over the nodes with a valid reading
+        self.valid_weights = self.weights.copy()
+        self.mean = np.nan
+        self.maximum = np.nan
+        # Stored energy relative to the inlet temperature in J, and the
+        # volume-weighted standard deviation of the valid node temperatures
+        self.energy = np.nan
+        self.stratification = np.nan
+        # Rates of change per second of the mean, energy and stratification
+        self.rate = np.nan
+        self.energy_rate = np.nan
+        self.stratification_rate = np.nan
+        self.updated = None
+        self.updates = 0
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def update(self, temps: Dict[str, float], timestamp: float = None):
+        """
+        Updates the state from one scan
+
+        :param temps: readings keyed by channel, as from
+            DAQ.get_calibrated_temp(as_dict=True)
+        :param timestamp: time of the scan; now if not given
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        node_temps = np.array([temps[c] for c in self.channels], dtype=float)
+        # Nodes the DAQ marked invalid read as NaN and are left out
+        valid = np.isfinite(node_temps)
+        weights = np.where(valid, self.weights, 0.0)
+        if valid.any():
+            weights /= weights.sum()
+            mean = float(weights @ np.where(valid, node_temps, 0.0))
+            maximum = float(node_temps[valid].max())
+            deviation = np.where(valid, node_temps - mean, 0.0)
+            stratification = float(np.sqrt(weights @ deviation ** 2))
+        else:
+            mean = maximum = stratification = np.nan
+        with self._lock:
+            inlet = temps.get(self.inlet_channel, np.nan)
+            if np.isfinite(inlet):
+                self.inlet = inlet
+            energy = self.capacity * (mean - self.inlet)
+            # A node dropping in or out shifts the mean without the tank
+            # changing, so rates are only taken over the same nodes
+            if self.updated is not None and timestamp > self.updated and \
+                    np.array_equal(weights > 0, self.valid_weights > 0):
+                elapsed = timestamp - self.updated
+                self.rate = (mean - self.mean) / elapsed
+                self.energy_rate = (energy - self.energy) / elapsed
+                self.stratification_rate = \
+                    (stratification - self.stratification) / elapsed
+            else:
+                self.rate = self.energy_rate = self.stratification_rate = \
+                    np.nan
+            self.temps = node_temps
+            self.valid_weights = weights
+            self.mean = mean
+            self.maximum = maximum
+            self.energy = energy
+            self.stratification = stratification
+            self.updated = timestamp
+            self.updates += 1
+            self._changed.notify_all()
+        registry.set('tank_mean', self.mean)
+        registry.set('tank_energy', self.energy)
+        registry.set('tank_stratification', self.stratification)
+        registry.set('tank_energy_rate', self.energy_rate)
+
+    @property
+    def uniformity(self) -> float:
+        """Difference between the hottest node and the mean"""
+        return self.maximum - self.mean
+
+    @property
+    def top_bottom(self) -> float:
+        """Difference between the top and bottom nodes"""
+        return float(self.temps[0] - self.temps[-1])
+
+    def wait_for_update(self, updates: int, timeout: float = None) -> bool:
+        """
+        Blocks until more than the given number of scans have been applied
+
+        :param updates: the update count already seen
+        :param timeout: seconds to wait at most
+        :return: whether a newer scan arrived
+        """
+        with self._changed:
+            return self._changed.wait_for(lambda: self.updates > updates,
+                                          timeout)
@@ -2,69 +2,107 @@ import argparse
 import logging
 import os
 import sys
+from typing import List
 
-from tc_tools.instruments import PRT, DAQ, TCBath
-from tc_tools.procedures import setpoint_calibration
-from tc_tools.config import tc_calibration_config
-
-parser = argparse.ArgumentParser()
-parser.add_argument('-cfg', '--config_file', dest='cfg', type=str,
-                    help='Name or path of configuration file.')
-in_args = parser.parse_args()
-cfg = tc_calibration_config(in_args.cfg)
-
-name, _ = os.path.splitext(cfg['Files']['output file'])
-logging.basicConfig(level=logging.INFO,
-                    format='%(asctime)s %(name)-12s %(levelname)-8s %('
-                           'message)s',
-                    datefmt='%m-%d %H:%M',
-                    filename=name + '.log',
-                    filemode='w')
-console = logging.StreamHandler()
-console.setLevel(logging.INFO)
-formatter = logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s')
-console.setFormatter(formatter)
-logging.getLogger('').addHandler(console)
-
-try:
-    out_path = os.path.abspath(cfg['Files']['output file'])
-except:
-    sys.exit('Invalid output file name or path')
-
-try:
-    prt = PRT(cfg['Instruments']['PRT address'])
-    logging.info('PRT initialized')
-except Exception as e:
-    logging.critical('PRT initialization error: ' + str(e))
-
-try:
-    daq = DAQ(cfg['Instruments']['DAQ address'])
-    logging.info('DAQ initialized')
-except Exception as e:
-    logging.critical('DAQ initialization error: ' + str(e))
-
-try:
-    bath = TCBath(cfg['Instruments']['bath address'])
-    logging.info('Bath initialized')
-except Exception as e:
-    logging.critical('Bath initialization error: ' + str(e))
-
-channels = list(cfg['Procedure']['channels'].split())
-set_points = list(cfg['Procedure']['set points'].split())
-
-if cfg['Files']['headers'] == 'channels':
-    headers = channels
-else:
-    headers = list(cfg['Files']['headers'].split())
-
-if len(channels) != len(headers):
-    sys.exit('Must have the same number of channels and headers. No spaces '
-             'in names of headers')
-
-try:
-    setpoint_calibration(prt, daq, bath, set_points,
-                         out_path, headers, channels)
-    logging.info('Calibration successful')
-except Exception as e:
-    logging.critical('Exception during execution: {}'.format(type(e).__name__))
+from tc_tools.config import (check_tc_calibration, tc_calibration_config,
+                             validity_settings)
 
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Adds the calibration's arguments to a parser"""
+    parser.add_argument('-cfg', '--config_file', dest='cfg', type=str,
+                        default='tc_calibration_config.ini',
+                        help='Name or path of configuration file.')
+    parser.add_argument('-dry', '--dry_run', action='store_true',
+                        dest='dry_run', help='Check the config without '
+                        'connecting to instruments')
+
+
+def run(in_args: argparse.Namespace):
+    """Runs the calibration described by the config file"""
+    if in_args.dry_run and not os.path.isfile(in_args.cfg):
+        sys.exit('No config file: {}'.format(in_args.cfg))
+    cfg = tc_calibration_config(in_args.cfg)
+    if in_args.dry_run:
+        problems = check_tc_calibration(cfg)
+        for problem in problems:
+            print(problem)
+        sys.exit(1 if problems else 0)
+
+    # Imported here so --help and --dry_run don't load pyvisa and NumPy
+    from tc_tools.instruments import PRT, DAQ, TCBath
+    from tc_tools.procedures import setpoint_calibration
+    from tc_tools.log import setup_logging
+    from tc_tools.planner import BathRateModel, fit_bath_model, read_prt_log
+
+    name, _ = os.path.splitext(cfg['Files']['output file'])
+    setup_logging(name + '.log')
+
+    try:
+        out_path = os.path.abspath(cfg['Files']['output file'])
+    except:
+        sys.exit('Invalid output file name or path')
+
+    try:
+        prt = PRT(cfg['Instruments']['PRT address'])
+        logging.info('PRT initialized')
+    except Exception as e:
+        logging.critical('PRT initialization error: ' + str(e))
+
+    try:
+        daq = DAQ(cfg['Instruments']['DAQ address'])
+        daq.set_validity(**validity_settings(cfg['Procedure']))
+        logging.info('DAQ initialized')
+    except Exception as e:
+        logging.critical('DAQ initialization error: ' + str(e))
+
+    try:
+        bath = TCBath(cfg['Instruments']['bath address'])
+        logging.info('Bath initialized')
+    except Exception as e:
+        logging.critical('Bath initialization error: ' + str(e))
+
+    channels = list(cfg['Procedure']['channels'].split())
+    set_points = list(cfg['Procedure']['set points'].split())
+    # Blank or missing: the DAQ converts thermocouple readings itself
+    tc_types = cfg['Procedure'].get('tc types', '').split()
+    reference_channel = cfg['Procedure'].get('reference channel', '') or None
+
+    prt_log = cfg['Files'].get('prt log', '')
+    prt_log = os.path.abspath(prt_log) if prt_log else None
+    bath_model = None
+    if cfg['Procedure'].getboolean('plan order', fallback=False):
+        # Rates are learned from the PRT log of earlier runs, if there is one
+        if prt_log and os.path.isfile(prt_log):
+            bath_model = fit_bath_model(*read_prt_log(prt_log))
+        else:
+            bath_model = BathRateModel()
+    boost = cfg['Procedure'].getfloat('boost', fallback=0)
+
+    if cfg['Files']['headers'] == 'channels':
+        headers = channels
+    else:
+        headers = list(cfg['Files']['headers'].split())
+
+    if len(channels) != len(headers):
+        sys.exit('Must have the same number of channels and headers. No '
+                 'spaces in names of headers')
+
+    try:
+        setpoint_calibration(prt, daq, bath, set_points,
+                             out_path, headers, channels, tc_types,
+                             reference_channel, prt_log, bath_model, boost)
+        logging.info('Calibration successful')
+    except Exception as e:
+        logging.critical('Exception during execution: {}'.format(
+            type(e).__name__))
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    run(parser.parse_args(argv))
+
+
+if __name__ == '__main__':
+    main()
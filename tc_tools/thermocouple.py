@@ -0,0 +1,167 @@
+from typing import List, Union
+
+import numpy as np
+
+# NIST ITS-90 thermocouple reference functions (NIST Monograph 175).
+# Reference functions: temperature (C) -> EMF (mV), as
+# (lowest temperature, highest temperature, coefficients from c0 up)
+REFERENCE = {
+    'T': [(-270, 0, [0.0, 3.8748106364E-02, 4.4194434347E-05,
+                     1.1844323105E-07, 2.0032973554E-08, 9.0138019559E-10,
+                     2.2651156593E-11, 3.6071154205E-13, 3.8493939883E-15,
+                     2.8213521925E-17, 1.4251594779E-19, 4.8768662286E-22,
+                     1.0795539270E-24, 1.3945027062E-27,
+                     7.9795153927E-31]),
+          (0, 400, [0.0, 3.8748106364E-02, 3.3292227880E-05,
+                    2.0618243404E-07, -2.1882256846E-09, 1.0996880928E-11,
+                    -3.0815758772E-14, 4.5479135290E-17,
+                    -2.7512901673E-20])],
+    'K': [(-270, 0, [0.0, 3.9450128025E-02, 2.3622373598E-05,
+                     -3.2858906784E-07, -4.9904828777E-09,
+                     -6.7509059173E-11, -5.7410327428E-13,
+                     -3.1088872894E-15, -1.0451609365E-17,
+                     -1.9889266878E-20, -1.6322697486E-23]),
+          (0, 1372, [-1.7600413686E-02, 3.8921204975E-02, 1.8558770032E-05,
+                     -9.9457592874E-08, 3.1840945719E-10,
+                     -5.6072844889E-13, 5.6075059059E-16,
+                     -3.2020720003E-19, 9.7151147152E-23,
+                     -1.2104721275E-26])],
+    'J': [(-210, 760, [0.0, 5.0381187815E-02, 3.0475836930E-05,
+                       -8.5681065720E-08, 1.3228195295E-10,
+                       -1.7052958337E-13, 2.0948090697E-16,
+                       -1.2538395336E-19, 1.5631725697E-23]),
+          (760, 1200, [2.9645625681E+02, -1.4976127786E+00,
+                       3.1787103924E-03, -3.1847686701E-06,
+                       1.5720819004E-09, -3.0691369056E-13])],
+    'E': [(-270, 0, [0.0, 5.8665508708E-02, 4.5410977124E-05,
+                     -7.7998048686E-07, -2.5800160843E-08,
+                     -5.9452583057E-10, -9.3214058667E-12,
+                     -1.0287605534E-13, -8.0370123621E-16,
+                     -4.3979497391E-18, -1.6414776355E-20,
+                     -3.9673619516E-23, -5.5827328721E-26,
+                     -3.4657842013E-29]),
+          (0, 1000, [0.0, 5.8665508710E-02, 4.5032275582E-05,
+                     2.8908407212E-08, -3.3056896652E-10, 6.5024403270E-13,
+                     -1.9197495504E-16, -1.2536600497E-18,
+                     2.1489217569E-21, -1.4388041782E-24,
+                     3.5960899481E-28])],
+}
+
+# Extra term of the type K function above 0 C: a0 * exp(a1 * (t - a2)**2)
+K_EXPONENTIAL = (1.185976E-01, -1.183432E-04, 1.269686E+02)
+
+# Inverse functions: EMF (uV) -> temperature (C), as
+# (lowest EMF, highest EMF, coefficients from d0 up)
+INVERSE = {
+    'T': [(-5603, 0, [0.0, 2.5949192E-02, -2.1316967E-07, 7.9018692E-10,
+                      4.2527777E-13, 1.3304473E-16, 2.0241446E-20,
+                      1.2668171E-24]),
+          (0, 20872, [0.0, 2.592800E-02, -7.602961E-07, 4.637791E-11,
+                      -2.165394E-15, 6.048144E-20, -7.293422E-25])],
+    'K': [(-5891, 0, [0.0, 2.5173462E-02, -1.1662878E-06, -1.0833638E-09,
+                      -8.9773540E-13, -3.7342377E-16, -8.6632643E-20,
+                      -1.0450598E-23, -5.1920577E-28]),
+          (0, 20644, [0.0, 2.508355E-02, 7.860106E-08, -2.503131E-10,
+                      8.315270E-14, -1.228034E-17, 9.804036E-22,
+                      -4.413030E-26, 1.057734E-30, -1.052755E-35]),
+          (20644, 54886, [-1.318058E+02, 4.830222E-02, -1.646031E-06,
+                          5.464731E-11, -9.650715E-16, 8.802193E-21,
+                          -3.110810E-26])],
+    'J': [(-8095, 0, [0.0, 1.9528268E-02, -1.2286185E-06, -1.0752178E-09,
+                      -5.9086933E-13, -1.7256713E-16, -2.8131513E-20,
+                      -2.3963370E-24, -8.3823321E-29]),
+          (0, 42919, [0.0, 1.978425E-02, -2.001204E-07, 1.036969E-11,
+                      -2.549687E-16, 3.585153E-21, -5.344285E-26,
+                      5.099890E-31]),
+          (42919, 69553, [-3.11358187E+03, 3.00543684E-01,
+                          -9.94773230E-06, 1.70276630E-10,
+                          -1.43033468E-15, 4.73886084E-21])],
+    'E': [(-8825, 0, [0.0, 1.6977288E-02, -4.3514970E-07, -1.5859697E-10,
+                      -9.2502871E-14, -2.6084314E-17, -4.1360199E-21,
+                      -3.4034030E-25, -1.1564890E-29]),
+          (0, 76373, [0.0, 1.7057035E-02, -2.3301759E-07, 6.5435585E-12,
+                      -7.3562749E-17, -1.7896001E-21, 8.4036165E-26,
+                      -1.3735879E-30, 1.0629823E-35, -3.2447087E-41])],
+}
+
+TC_TYPES = sorted(INVERSE)
+
+
+def _piecewise(x: np.ndarray, ranges: list) -> np.ndarray:
+    out = np.full(x.shape, np.nan)
+    for n, (low, high, coefficients) in enumerate(ranges):
+        # Ranges share their endpoints; the first one claims it
+        in_range = (x >= low) & (x <= high) if n == 0 else \
+            (x > low) & (x <= high)
+        if in_range.any():
+            out[in_range] = np.polynomial.polynomial.polyval(x[in_range],
+                                                             coefficients)
+    return out
+
+
+def _check_type(tc_type: str) -> str:
+    tc_type = tc_type.upper()
+    if tc_type not in INVERSE:
+        raise ValueError('Unsupported thermocouple type: {}. Use one of {}'
+                         .format(tc_type, TC_TYPES))
+    return tc_type
+
+
+def temp_to_emf(temps: Union[float, np.ndarray],
+                tc_type: str = 'T') -> np.ndarray:
+    """
+    Converts temperature to thermocouple EMF with the ITS-90 reference
+    function
+
+    :param temps: temperatures in C
+    :param tc_type: thermocouple type letter
+    :return: EMF in microvolts; NaN outside the function's range
+    """
+    tc_type = _check_type(tc_type)
+    t = np.atleast_1d(np.asarray(temps, dtype=float))
+    emf = _piecewise(t, REFERENCE[tc_type])
+    if tc_type == 'K':
+        a0, a1, a2 = K_EXPONENTIAL
+        above = t > 0
+        emf[above] += a0 * np.exp(a1 * (t[above] - a2) ** 2)
+    return emf * 1000
+
+
+def emf_to_temp(emf: Union[float, np.ndarray],
+                tc_type: str = 'T') -> np.ndarray:
+    """
+    Converts thermocouple EMF to temperature with the ITS-90 inverse
+    polynomials
+
+    :param emf: EMF in microvolts, referenced to 0 C
+    :param tc_type: thermocouple type letter
+    :return: temperatures in C; NaN outside the polynomials' range
+    """
+    tc_type = _check_type(tc_type)
+    return _piecewise(np.atleast_1d(np.asarray(emf, dtype=float)),
+                      INVERSE[tc_type])
+
+
+def volts_to_temp(volts: Union[List[float], np.ndarray],
+                  tc_types: Union[str, List[str]],
+                  cold_junction: float) -> np.ndarray:
+    """
+    Converts a scan of raw thermocouple voltages to temperatures, with cold
+    junction compensation
+
+    :param volts: measured voltage of each channel
+    :param tc_types: one type for every channel, or a type per channel
+    :param cold_junction: reference junction temperature in C
+    :return: temperature of each channel in C
+    """
+    emf = np.asarray(volts, dtype=float) * 1e6
+    if isinstance(tc_types, str):
+        tc_types = [tc_types] * emf.size
+    tc_types = np.array([_check_type(t) for t in tc_types])
+    temps = np.full(emf.shape, np.nan)
+    # One vectorized conversion per thermocouple type in the scan
+    for tc_type in np.unique(tc_types):
+        same_type = tc_types == tc_type
+        compensation = temp_to_emf(cold_junction, tc_type)[0]
+        temps[same_type] = emf_to_temp(emf[same_type] + compensation, tc_type)
+    return temps
@@ -1,19 +1,28 @@
 import csv
+import logging
 import os
 import re
-from collections import namedtuple
+import threading
+import time
+from collections import deque, namedtuple
 from datetime import datetime, timedelta
-from typing import List
+from typing import TYPE_CHECKING, Callable, Dict, List
 
-import numpy as np
+from tc_tools.instruments import (PRT, DAQ, PowerMeter, MTScale,
+                                  HumiditySensor, default_resource_manager)
+from tc_tools.metrics import registry
 
-from tc_tools.instruments import *
+if TYPE_CHECKING:
+    from tc_tools.tank import TankState
+
+# Power meter quantities in the minutely file, in column order
+POWER_QUANTITIES = ['watts', 'energy', 'volts', 'amps']
 
 
 def address_query():
     """Sends an *IDN? query to each port. Each instrument should return its
     name."""
-    resource_manager = visa.ResourceManager()
+    resource_manager = default_resource_manager()
     addresses = resource_manager.list_resources()
 
     for address in addresses:
@@ -44,6 +53,9 @@ class DataWriter:
         self.start = time.time()
         self.logger.info('Writing to: {}'.format(str(self.output_file_path)))
         self.file_already_exists = os.path.isfile(self.output_file_path)
+        # Rows are written from the sampling thread while the main loop
+        # flushes to disk
+        self._lock = threading.Lock()
         self._open_file()
         self.csv_writer = csv.writer(self.output_file, dialect='excel',
                                      quoting=csv.QUOTE_ALL)
@@ -51,8 +63,14 @@ class DataWriter:
             self.csv_writer.writerow(self.headers)
             self.logger.info('Writing CSV headers')
 
-    def clock_reset(self):
-        self.start = time.time()
+    def clock_reset(self, start: float = None):
+        """
+        Restarts the elapsed time clock
+
+        :param start: time.time() to measure from; now if not given, or an
+            earlier origin when resuming
+        """
+        self.start = time.time() if start is None else start
 
     def _open_file(self):
         if self.file_already_exists:
@@ -63,44 +81,101 @@ class DataWriter:
             self.logger.info('Creating new file')
 
     def _write(self, input_data):
-        self.csv_writer.writerow([datetime.now().strftime('%Y-%m-%d %H:%M:%S')]
-                                 + input_data)
+        # time.time() rather than datetime.now() so a simulated clock
+        # stamps the rows too
+        now = datetime.fromtimestamp(time.time())
+        with self._lock:
+            self.csv_writer.writerow([now.strftime('%Y-%m-%d %H:%M:%S')]
+                                     + input_data)
+        registry.increment('samples_written', writer=type(self).__name__)
+
+    def flush(self, sync: bool = False):
+        """
+        Flushes buffered rows to disk
+
+        :param sync: also wait for the operating system to write them
+        """
+        # A slow disk shows here first, as the time rows wait to be written
+        started = time.perf_counter()
+        with self._lock:
+            self.output_file.flush()
+            if sync:
+                os.fsync(self.output_file.fileno())
+        registry.set('writer_flush_seconds', time.perf_counter() - started,
+                     writer=type(self).__name__, sync=sync)
 
 
 class CalibrationWriter(DataWriter):
     """Writer for the calibration procedure"""
 
-    def collect_data(self, prt: PRT, daq: DAQ, reads:int=10, interval:int=30):
+    def collect_data(self, prt: PRT, daq: DAQ, reads:int=10, interval:int=30,
+                     channels: List[str] = None,
+                     max_errors: int = 10) -> int:
         """
-        Collects data from the given instrument objects
+        Collects data from the given instrument objects. Channels failing
+        the DAQ's validity checks are written as NaN rather than costing
+        the whole row.
 
         :param prt: the PRT thermometer to read from
-        :param daq: the DAQ to read from
+        :param daq: the DAQ to read from, or a ScanScheduler sharing one
         :param reads: how many readings to take
         :param interval: time interval between readings in seconds
+        :param channels: subset of the DAQ's channels to read; all if not
+            given
+        :param max_errors: consecutive failed reads after which to stop
+        :return: number of readings taken
         """
         successful_reads = 0
+        errors = 0
         self.logger.info('Collecting data: {} readings at {}s intervals'
                          .format(reads, interval))
         while successful_reads < reads:
             try:
-                data = [prt.get_temp()] + daq.get_temp_uncalibrated()
-                self._write(data)
-                successful_reads += 1
-                self.logger.info('Read #{} successful'.format(successful_reads))
-            except:
-                self.logger.warning('DAQ read error. Retrying')
+                data = [prt.get_temp()] + daq.get_temp_uncalibrated(
+                    channels=channels)
+            except Exception as e:
+                errors += 1
+                registry.increment('bus_retries', bus=daq.address)
+                if errors >= max_errors:
+                    self.logger.error('Stopping after {} read errors in a '
+                                      'row: {}'.format(errors, e))
+                    break
+                self.logger.warning('Read error. Retrying')
+                # Back off rather than retrying on a busy bus at once
+                time.sleep(min(2 ** errors, interval))
                 continue
+            errors = 0
+            self._write(data)
+            successful_reads += 1
+            self.logger.info('Read #{} successful'.format(successful_reads))
             time.sleep(interval)
         self.logger.info('Data collection complete.')
-        self.output_file.flush()
+        self.flush()
+        return successful_reads
+
+
+class PRTLogWriter(DataWriter):
+    """Writer for the PRT record kept while the bath changes set point"""
+
+    def __init__(self, output_file: os.path.abspath):
+        """
+        :param output_file: path to the output file
+        """
+        super(PRTLogWriter, self).__init__(output_file, ['PRT'])
+
+    def log(self, temp: float):
+        """Writes one PRT reading"""
+        self._write([temp])
+        self.flush()
 
 
 class SimulatedUseWriter(DataWriter):
     """Writer for the simulated use test"""
 
     def __init__(self, headers: List[str], output_file: os.path.abspath,
-                 daq: DAQ, rh: HumiditySensor, power_meter: PowerMeter):
+                 daq: DAQ, rh: HumiditySensor, power_meter: PowerMeter,
+                 tank_state: 'TankState' = None,
+                 power: Callable[[], Dict[str, float]] = None):
         """
         Writer for minutely data during the simulated use test
 
@@ -109,11 +184,24 @@ class SimulatedUseWriter(DataWriter):
         :param daq: DAQ to read from
         :param rh: humidity sensor object
         :param power_meter: power meter object
+        :param tank_state: updated from each scan and written as the
+            instantaneous tank average
+        :param power: returns the latest 'watts', 'energy', 'volts' and
+            'amps', e.g. from the sampler's power group; the power meter is
+            read here if not given
         """
+        # Elapsed, draw status and tank average, then the DAQ channels, RH
+        # and the power quantities
+        columns = 3 + len(daq.channels) + 1 + len(POWER_QUANTITIES)
+        if daq.channels and len(headers) != columns:
+            raise ValueError('{} headers given for {} columns: {}'.format(
+                len(headers), columns, ', '.join(headers)))
         super(SimulatedUseWriter, self).__init__(output_file, headers)
         self.daq = daq
         self.rh = rh
         self.pm = power_meter
+        self.tank_state = tank_state
+        self.power = power
         self.recording = True
         self.drawing = False
 
@@ -127,16 +215,47 @@ class SimulatedUseWriter(DataWriter):
             self.read_data()
             time.sleep(interval)
 
-    def read_data(self):
-        """Reads all relevant data"""
-        tc_data = self.daq.get_calibrated_temp()
-        power_data = [self.pm.read_watts(),
-                      self.pm.read_energy(), self.pm.read_volts(),
-                      self.pm.read_amps()]
-        rh_data = [self.rh.rh()]
-        all_data = [time.time() - self.start] + [self.drawing] + tc_data +\
-                   rh_data + power_data
+    def read_data(self) -> dict:
+        """
+        Reads and writes all relevant data
+
+        :return: the values written, keyed by channel or quantity
+        """
+        # The thermocouples and the RH sensor in a single scan
+        with self.daq.lock:
+            if not self.rh.configured:
+                self.rh.configure()
+            temps = self.daq.scan(self.daq.channels + [self.rh.channel])
+        humidity = self.rh.convert(temps.pop(str(self.rh.channel)))
+        registry.set('last_reading', humidity, channel=self.rh.channel)
+        tc_data = [temps[channel] for channel in self.daq.channels]
+        if self.tank_state is not None:
+            self.tank_state.update(temps)
+            tank_avg = [self.tank_state.mean]
+        else:
+            tank_avg = ['']
+        if self.power is None:
+            power = {'watts': self.pm.read_watts(),
+                     'energy': self.pm.read_energy(),
+                     'volts': self.pm.read_volts(),
+                     'amps': self.pm.read_amps()}
+        else:
+            power = self.power()
+        power_data = [power[name] for name in POWER_QUANTITIES]
+        rh_data = [humidity]
+        for name, value in power.items():
+            registry.set('last_power_reading', value, quantity=name)
+        all_data = [time.time() - self.start] + [self.drawing] + tank_avg + \
+            tc_data + rh_data + power_data
         self._write([str(n) for n in all_data])
+        self.flush()
+        values = dict(temps, rh=rh_data[0], elapsed=all_data[0],
+                      drawing=self.drawing, **power)
+        if self.tank_state is not None:
+            values['tank average'] = self.tank_state.mean
+            values['tank energy'] = self.tank_state.energy
+            values['stratification'] = self.tank_state.stratification
+        return values
 
     def set_drawing(self, drawing: bool):
         """Tells the writer if there's current a draw"""
@@ -166,18 +285,32 @@ class DrawWriter(DataWriter):
         super(DrawWriter, self).__init__(output_file, headers)
         self.daq = daq
         self.scale = scale
-        self.inlet = inlet_channel
-        self.outlet = outlet_channel
+        # DAQ readings are keyed by channel string
+        self.inlet = str(inlet_channel)
+        self.outlet = str(outlet_channel)
         self.start = time.time()
         self.draw_num = 1
 
-    def read_data(self, initial: bool = False):
-        """Reads relevant data"""
-        temps = self.daq.get_calibrated_temp(as_dict=True)
-        elapsed = 0 if initial else [self.start - time.time()]
-        temp_data = [temps[self.inlet] + temps[self.outlet]]
-        weight = [self.scale.weigh()]
-        self._write(elapsed + temp_data + weight)
+    def read_data(self, initial: bool = False) -> dict:
+        """
+        Reads and writes the inlet, outlet and weight in a single scan
+
+        :param initial: whether this is the row before the draw starts
+        :return: the values written, keyed 'elapsed', 'inlet', 'outlet'
+            and 'weight'
+        """
+        with self.daq.lock:
+            if not self.scale.configured:
+                self.scale.configure()
+            values = self.daq.scan([self.inlet, self.outlet,
+                                    self.scale.channel])
+        weight = self.scale.convert(values[str(self.scale.channel)])
+        elapsed = [0] if initial else [time.time() - self.start]
+        temp_data = [values[self.inlet], values[self.outlet]]
+        self._write(elapsed + temp_data + [weight])
+        self.flush()
+        return {'elapsed': elapsed[0], 'inlet': temp_data[0],
+                'outlet': temp_data[1], 'weight': weight}
 
     def set_draw_num(self, draw_num: int):
         self.draw_num = draw_num
@@ -186,26 +319,40 @@ class DrawWriter(DataWriter):
         """Resets the start time"""
         self.start = time.time()
 
-def steady_state_monitor(prt: PRT, steady_delta:float=0.1):
+def steady_state_monitor(prt: PRT, steady_delta:float=0.1,
+                         prt_log: 'PRTLogWriter' = None, group: str = None):
     """
     Uses the given PRT to monitor if the bath is steady-state
 
     :param prt: the PRT to monitor with
     :param steady_delta: maximum temperature difference over ten minutes
+    :param prt_log: if given, every reading is recorded to it
+    :param group: name of the bath group when several baths are monitored
+        at once; readings are then logged at debug level rather than
+        echoed over one console line
     """
-    temperature_array = np.empty((0, 0))
+    logger = None if group is None else \
+        logging.getLogger('Steady State ' + group)
+    # The last ten minutes of readings
+    temperatures = deque(maxlen=60)
     steady_state = False
     while not steady_state:
         try:
             recent_temp = prt.get_temp()
         except:
+            registry.increment('bus_retries', bus=prt.address)
             continue
-        print(recent_temp, end='\r')
-        temperature_array = np.append(temperature_array, recent_temp)
-        if temperature_array.size > 60:
-            temperature_array = np.delete(temperature_array, 0)
-        delta = np.amax(temperature_array) - np.amin(temperature_array)
-        steady_state = (delta <= steady_delta) and (temperature_array.size >= 60)
+        registry.set('last_reading', recent_temp, channel='PRT')
+        if prt_log is not None:
+            prt_log.log(recent_temp)
+        if logger is None:
+            print(recent_temp, end='\r')
+        else:
+            logger.debug('PRT {}'.format(recent_temp))
+        temperatures.append(recent_temp)
+        delta = max(temperatures) - min(temperatures)
+        steady_state = (delta <= steady_delta) and \
+            (len(temperatures) == temperatures.maxlen)
         time.sleep(10)
         if steady_state:
             return True
@@ -0,0 +1,158 @@
+import logging
+import time
+from collections import namedtuple
+from typing import List
+
+import numpy as np
+
+from tc_tools.metrics import registry
+
+Scan = namedtuple('Scan', ['channels', 'values', 'valid', 'time'])
+Scan.__doc__ = """One scan with a validity mask: channel list, readings as
+an array (NaN where a channel was not read), a boolean array marking the
+readings that passed every check, and time.time() of the scan"""
+
+
+class ChannelValidator:
+    """Vectorized per-channel checks of scans, with quarantine of channels
+    that keep failing"""
+
+    logger = logging.getLogger('Channel Check')
+
+    def __init__(self, low: float = 0.0, high: float = 100.0,
+                 max_rate: float = None, quarantine_after: int = 3,
+                 probe_interval: float = 600):
+        """
+        :param low: lowest valid reading
+        :param high: highest valid reading
+        :param max_rate: largest valid change per second from a channel's
+            last valid reading; unchecked if not given
+        :param quarantine_after: consecutive failures after which a channel
+            is quarantined; 0 to never quarantine
+        :param probe_interval: seconds between reads of a quarantined
+            channel to see if it recovered
+        """
+        self.low = low
+        self.high = high
+        self.max_rate = max_rate
+        self.quarantine_after = quarantine_after
+        self.probe_interval = probe_interval
+        self._slots = {}
+        self._last = np.empty(0)
+        self._last_time = np.empty(0)
+        self._failures = np.empty(0, dtype=int)
+        self.quarantined = {}  # {channel: time of the last probe}
+
+    def _index(self, channels: List[str]) -> np.ndarray:
+        for channel in channels:
+            if channel not in self._slots:
+                self._slots[channel] = len(self._slots)
+        grow = len(self._slots) - self._last.size
+        if grow:
+            self._last = np.append(self._last, np.full(grow, np.nan))
+            self._last_time = np.append(self._last_time,
+                                        np.full(grow, np.nan))
+            self._failures = np.append(self._failures,
+                                       np.zeros(grow, dtype=int))
+        return np.array([self._slots[c] for c in channels], dtype=int)
+
+    def to_read(self, channels: List[str], now: float = None) -> List[str]:
+        """
+        Drops quarantined channels from a scan, except those due a probe
+
+        :param channels: channels wanted
+        :param now: time of the scan; time.time() if not given
+        :return: channels to scan
+        """
+        if not self.quarantined:
+            return list(channels)
+        now = time.time() if now is None else now
+        return [c for c in channels if c not in self.quarantined or
+                now - self.quarantined[c] >= self.probe_interval]
+
+    def check(self, channels: List[str], values: np.ndarray,
+              now: float = None) -> np.ndarray:
+        """
+        Checks a scan and updates each channel's history
+
+        :param channels: channels in the scan
+        :param values: readings, NaN where a channel was not read
+        :param now: time of the scan; time.time() if not given
+        :return: whether each reading is valid
+        """
+        now = time.time() if now is None else now
+        index = self._index(channels)
+        read = np.isfinite(values)
+        valid = read & (values >= self.low) & (values <= self.high)
+        if self.max_rate is not None:
+            last = self._last[index]
+            elapsed = now - self._last_time[index]
+            # Channels without a valid history pass the rate check
+            with np.errstate(invalid='ignore', divide='ignore'):
+                rate = np.abs(values - last) / elapsed
+            valid &= ~(rate > self.max_rate)
+        self._last[index[valid]] = values[valid]
+        self._last_time[index[valid]] = now
+        self._failures[index[valid]] = 0
+        self._failures[index[read & ~valid]] += 1
+        self._update_quarantine(channels, index, read, valid, now)
+        return valid
+
+    def _update_quarantine(self, channels: List[str], index: np.ndarray,
+                           read: np.ndarray, valid: np.ndarray, now: float):
+        for n in np.flatnonzero(read):
+            channel = channels[n]
+            if channel in self.quarantined:
+                if valid[n]:
+                    del self.quarantined[channel]
+                    registry.set('channel_quarantined', False,
+                                 channel=channel)
+                    self.logger.info('Channel {} recovered'.format(channel))
+                else:
+                    self.quarantined[channel] = now
+            elif self.quarantine_after and \
+                    self._failures[index[n]] >= self.quarantine_after:
+                self.quarantined[channel] = now
+                registry.set('channel_quarantined', True, channel=channel)
+                registry.increment('channel_quarantines', channel=channel)
+                self.logger.warning(
+                    'Channel {} failed {} scans in a row and is dropped '
+                    'from the scan list'.format(channel,
+                                                self._failures[index[n]]))
+        invalid = np.count_nonzero(read & ~valid)
+        if invalid:
+            registry.increment('invalid_readings', invalid)
+
+    def release(self, channels: List[str] = None):
+        """
+        Returns quarantined channels to the scan and forgets their history
+
+        :param channels: channels to release; all if not given
+        """
+        channels = list(self.quarantined if channels is None else channels)
+        for channel in channels:
+            self.quarantined.pop(channel, None)
+            registry.set('channel_quarantined', False, channel=channel)
+        index = self._index(channels)
+        self._last[index] = np.nan
+        self._last_time[index] = np.nan
+        self._failures[index] = 0
+
+
+def valid_readings(scan: Scan, channels: List[str] = None) -> List[float]:
+    """
+    Picks channels out of a scan, with NaN for invalid readings
+
+    :param scan: checked scan
+    :param channels: channels to pick; all of the scan's if not given
+    :return: readings in the order of channels
+    :raises IOError: if none of the channels has a valid reading
+    """
+    if channels is None:
+        channels = scan.channels
+    position = {c: n for n, c in enumerate(scan.channels)}
+    index = np.array([position[c] for c in channels], dtype=int)
+    valid = scan.valid[index]
+    if not valid.any():
+        raise IOError('DAQ read error')
+    return np.where(valid, scan.values[index], np.nan).tolist()
@@ -0,0 +1,30 @@
+import logging
+from types import SimpleNamespace
+
+import pytest
+
+from tc_tools.sim import run_simulated_use, simulated_use_stand, write_schedule
+
+# (minutes, gallons, gpm): two draws in the first hour, then standby
+SCHEDULE = [(0, 15, 1.7), (30, 2, 1), (60, 9, 1.7), (100, 1, 1)]
+HOURS = 8
+
+
+@pytest.fixture(scope='session')
+def simulated_day(tmp_path_factory):
+    """A simulated use test run on the simulated stand, for the tests that
+    read its output files"""
+    directory = tmp_path_factory.mktemp('simulated_use')
+    schedule_file = str(directory / 'schedule.csv')
+    write_schedule(schedule_file, SCHEDULE)
+    stand = simulated_use_stand()
+    data_file = str(directory / 'data.csv')
+    draw_file = str(directory / 'draws.csv')
+    logging.disable(logging.WARNING)
+    try:
+        run_simulated_use(stand, schedule_file, data_file, draw_file,
+                          duration=HOURS * 3600)
+    finally:
+        logging.disable(logging.NOTSET)
+    return SimpleNamespace(stand=stand, data_file=data_file,
+                           draw_file=draw_file, schedule=SCHEDULE)
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from tc_tools.analysis import (DATA_COLUMNS, LiveRatings, RatingAnalyzer,
+                               analyze, read_chunks)
+from tc_tools.framebus import FrameBus, FrameReader
+from tc_tools.sampling import Frame
+from tc_tools.sim import USE_CHANNELS
+
+TANK_VOLUME = 50.0
+
+
+def test_ratings_of_simulated_day(simulated_day):
+    results = analyze(simulated_day.data_file, simulated_day.draw_file,
+                      TANK_VOLUME, chunk_rows=100)
+    assert all(np.isfinite(value) for value in results)
+    assert results.draws == len(simulated_day.schedule)
+    scheduled = sum(volume for _, volume, _ in simulated_day.schedule)
+    assert results.delivered_volume == pytest.approx(scheduled, rel=0.02)
+    # The 15 and 2 gallon draws start in the first hour
+    assert results.first_hour_rating == pytest.approx(17, rel=0.02)
+    # The plant loses 2 W/K to its surroundings
+    assert results.standby_ua == pytest.approx(
+        simulated_day.stand.plant.tank.ua * len(USE_CHANNELS['tank']),
+        rel=0.01)
+    assert 0.5 < results.recovery_efficiency <= 1
+    assert 0.5 < results.uef < 1
+    assert results.energy_integrated == pytest.approx(
+        results.energy_consumed, rel=0.02)
+
+
+def test_chunk_size_does_not_change_ratings(simulated_day):
+    whole = analyze(simulated_day.data_file, simulated_day.draw_file,
+                    TANK_VOLUME, chunk_rows=100000)
+    chunked = analyze(simulated_day.data_file, simulated_day.draw_file,
+                      TANK_VOLUME, chunk_rows=7)
+    assert chunked == pytest.approx(whole)
+
+
+def test_no_data():
+    with pytest.raises(ValueError):
+        RatingAnalyzer(TANK_VOLUME).results()
+
+
+def _publish(bus, path, group, signals):
+    # Writes a file's rows as frames, as the sampler would have published
+    for chunk in read_chunks(path):
+        for n, time in enumerate(chunk['Time']):
+            bus.publish(Frame(time, group, {
+                signal: chunk[header][n]
+                for header, signal in signals.items()}))
+
+
+def test_live_ratings_match_files(simulated_day):
+    tank = USE_CHANNELS['tank']
+    ambient = USE_CHANNELS['ambient']
+    data_signals = {'Elapsed': 'elapsed', 'Draw Status': 'drawing',
+                    'Power': 'watts', 'Energy': 'energy',
+                    'Ambient': ambient}
+    data_signals.update(zip(DATA_COLUMNS['tank'], tank))
+    draw_signals = {'Elapsed': 'elapsed', 'Inlet Temperature': 'inlet',
+                    'Outlet Temperature': 'outlet', 'Scale Weight': 'weight'}
+    signals = list(data_signals.values()) + ['inlet', 'outlet', 'weight']
+    with FrameBus(signals, ['minutely', 'draw'], slots=2 ** 14) as bus:
+        live = LiveRatings(FrameReader(bus), TANK_VOLUME, tank, ambient)
+        _publish(bus, simulated_day.draw_file, 'draw', draw_signals)
+        _publish(bus, simulated_day.data_file, 'minutely', data_signals)
+        live.update()
+    assert live.results == pytest.approx(analyze(
+        simulated_day.data_file, simulated_day.draw_file, TANK_VOLUME))
+
+
+def test_live_ratings_load(simulated_day):
+    with FrameBus(['elapsed'], ['minutely', 'draw'], slots=4) as bus:
+        live = LiveRatings(FrameReader(bus), TANK_VOLUME,
+                           USE_CHANNELS['tank'], USE_CHANNELS['ambient'])
+        live.load(simulated_day.data_file, simulated_day.draw_file)
+        live.update()
+    assert live.results == pytest.approx(analyze(
+        simulated_day.data_file, simulated_day.draw_file, TANK_VOLUME))
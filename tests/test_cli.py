@@ -0,0 +1,132 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from tc_tools import DOEtest
+from tc_tools.cli import main
+from tc_tools.config import (check_multi_bath, check_tc_calibration,
+                             multi_bath_config, tc_calibration_config)
+from tc_tools.sim import simulated_use_stand, write_schedule
+from tc_tools.utils import SimulatedUseWriter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def exit_code(argv):
+    with pytest.raises(SystemExit) as exited:
+        main(argv)
+    return exited.value.code
+
+
+def test_default_configs_pass(tmp_path):
+    assert check_tc_calibration(tc_calibration_config(
+        str(tmp_path / 'tc.ini'))) == []
+    assert check_multi_bath(multi_bath_config(
+        str(tmp_path / 'multi.ini'))) == []
+
+
+def test_calibration_config_problems(tmp_path):
+    cfg = tc_calibration_config(str(tmp_path / 'tc.ini'))
+    cfg['Procedure']['channels'] = '101 1O2'
+    cfg['Procedure']['set points'] = '5 hot'
+    cfg['Procedure']['max rate'] = 'fast'
+    cfg['Files']['headers'] = 'A B C'
+    problems = check_tc_calibration(cfg)
+    assert '[Procedure] channels must be numbers: 1O2' in problems
+    assert '[Procedure] set points must be numbers: hot' in problems
+    assert '[Procedure] max rate must be a number' in problems
+    assert '[Procedure] must have the same number of channels and ' \
+           'headers' in problems
+    del cfg['Instruments']
+    assert check_tc_calibration(cfg) == ['Missing section [Instruments]']
+
+
+def test_multi_bath_config_problems(tmp_path):
+    cfg = multi_bath_config(str(tmp_path / 'multi.ini'))
+    baths = [s for s in cfg.sections() if s.startswith('Bath')]
+    second = dict(cfg[baths[0]])
+    cfg['Bath Z'] = second
+    problems = check_multi_bath(cfg)
+    assert any(p.startswith('Channels in more than one bath') for p in
+               problems)
+    assert 'Baths must have different output files' in problems
+
+
+def test_calibrate_dry_run(tmp_path, capsys):
+    path = str(tmp_path / 'tc.ini')
+    tc_calibration_config(path)
+    assert exit_code(['calibrate', '-cfg', path, '-dry']) == 0
+    multi = str(tmp_path / 'multi.ini')
+    cfg = multi_bath_config(multi)
+    cfg['Procedure']['set points'] = ''
+    with open(multi, 'w') as f:
+        cfg.write(f)
+    # [Bath ...] sections make it a multi-bath calibration
+    assert exit_code(['calibrate', '-cfg', multi, '-dry']) == 1
+    assert 'has no set points' in capsys.readouterr().out
+    assert exit_code(['calibrate', '-cfg', str(tmp_path / 'none.ini'),
+                      '-dry']) == 'No config file: {}'.format(
+        tmp_path / 'none.ini')
+
+
+def doe_test_args(tmp_path, *extra):
+    schedule = str(tmp_path / 'schedule.csv')
+    write_schedule(schedule, [(0, 15, 1.7)])
+    return ['doe-test', '-dry', '-sh', schedule,
+            '-o', str(tmp_path / 'data.csv'),
+            '-dr', str(tmp_path / 'draws.csv'),
+            '-tc', '101', '102', '103', '104', '105', '106', '-ic', '107',
+            '-oc', '108', '-ac', '109', '-sc', '110', '-rhc', '111',
+            '-ds', '201', '-ws', '202', '-vc', '204'] + list(extra)
+
+
+def test_doe_test_dry_run(tmp_path, capsys):
+    assert exit_code(doe_test_args(tmp_path)) == 0
+    assert exit_code(doe_test_args(tmp_path, '-r')) == 1
+    assert 'No journal to resume' in capsys.readouterr().out
+
+
+def test_doe_test_headers_checked(tmp_path, capsys):
+    headers = DOEtest.data_headers[:-2]
+    assert exit_code(doe_test_args(tmp_path, '-ohd', *headers)) == 1
+    assert '15 output headers given for 17 columns' in \
+        capsys.readouterr().out
+
+
+def test_writer_checks_headers(tmp_path):
+    stand = simulated_use_stand()
+    channels = stand.channels
+    with stand.clock:
+        stand.daq.set_channels(channels['tank'] + [
+            channels['inlet'], channels['outlet'], channels['ambient']])
+        path = str(tmp_path / 'data.csv')
+        with pytest.raises(ValueError):
+            SimulatedUseWriter(DOEtest.data_headers[:-2], path, stand.daq,
+                               stand.rh_sensor, stand.power_meter)
+        assert not os.path.exists(path)
+        writer = SimulatedUseWriter(DOEtest.data_headers, path, stand.daq,
+                                    stand.rh_sensor, stand.power_meter)
+        values = writer.read_data()
+        writer.output_file.close()
+    with open(path) as f:
+        header, row = f.read().splitlines()
+    assert len(header.split(',')) == len(row.split(','))
+    assert values['volts'] == pytest.approx(stand.plant.line_voltage)
+
+
+def test_unknown_arguments_rejected(capsys):
+    assert exit_code(['fit', 'prt_log.csv', '--bogus']) == 2
+    assert 'unrecognized arguments: --bogus' in capsys.readouterr().err
+
+
+def test_subcommands_imported_when_run():
+    code = ('import sys\n'
+            'from tc_tools.cli import build_parser\n'
+            'build_parser().parse_known_args(["doe-test", "-h"])\n'
+            'print(sorted(m for m in sys.modules if m.startswith('
+            '("tc_tools.", "numpy", "pyvisa"))))\n')
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "['tc_tools.cli']"
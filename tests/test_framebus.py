@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from tc_tools.framebus import FrameBus, FrameReader
+from tc_tools.sampling import Frame
+
+SIGNALS = ['inlet', 'outlet', 'weight', 'watts']
+GROUPS = ['draw', 'power']
+
+
+@pytest.fixture
+def bus():
+    with FrameBus(SIGNALS, GROUPS, slots=8) as bus:
+        yield bus
+
+
+def test_round_trip(bus):
+    reader = FrameReader(bus)
+    assert bus.head == -1 and reader.frames() == []
+    sent = [Frame(1.0, 'draw', {'inlet': 14.4, 'outlet': 51.7,
+                                'weight': 0.5}),
+            Frame(2.0, 'power', {'watts': 4500.0, 'unknown': 1.0}),
+            Frame(3.0, 'draw', {'inlet': 14.5, 'outlet': 51.6,
+                                'weight': 1.5})]
+    for n, frame in enumerate(sent):
+        assert bus.publish(frame) == n
+    received = reader.frames()
+    assert received[0] == sent[0]
+    assert received[1] == Frame(2.0, 'power', {'watts': 4500.0})
+    assert received[2] == sent[2]
+    assert reader.frames() == []
+    assert reader.dropped == 0
+
+
+def test_group_filter_and_latest(bus):
+    reader = FrameReader(bus)
+    bus.publish(Frame(1.0, 'draw', {'weight': 0.5}))
+    bus.publish(Frame(2.0, 'power', {'watts': 4500.0}))
+    assert [f.time for f in reader.frames('power')] == [2.0]
+    assert reader.latest('draw') == Frame(1.0, 'draw', {'weight': 0.5})
+
+
+def test_attached_reader(bus):
+    bus.publish(Frame(1.0, 'power', {'watts': 10.0}))
+    other = FrameBus.attach(bus.name)
+    try:
+        assert other.signals == SIGNALS and other.groups == GROUPS
+        reader = FrameReader(other, since=-1)
+        assert reader.frames() == [Frame(1.0, 'power', {'watts': 10.0})]
+    finally:
+        other.close()
+
+
+def test_overrun_counts_dropped_frames(bus):
+    reader = FrameReader(bus)
+    for n in range(20):
+        bus.publish(Frame(float(n), 'power', {'watts': float(n)}))
+    frames = reader.frames()
+    # The slot after the head is treated as being rewritten
+    assert [f.time for f in frames] == [float(n) for n in range(13, 20)]
+    assert reader.dropped == 13
+
+
+def test_columns(bus):
+    reader = FrameReader(bus)
+    for n in range(3):
+        bus.publish(Frame(float(n), 'draw', {'weight': n * 0.5}))
+    bus.publish(Frame(5.0, 'power', {'watts': 4500.0}))
+    blocks = reader.columns()
+    assert set(blocks) == {'draw', 'power'}
+    assert blocks['draw']['time'].tolist() == [0.0, 1.0, 2.0]
+    assert blocks['draw']['weight'].tolist() == [0.0, 0.5, 1.0]
+    assert np.isnan(blocks['draw']['watts']).all()
+    assert blocks['power']['watts'].tolist() == [4500.0]
+    assert reader.columns() == {}
@@ -0,0 +1,61 @@
+import pytest
+
+from tc_tools.journal import Journal, replay
+
+
+def write(path, *events):
+    journal = Journal(str(path))
+    for event, fields in events:
+        journal.record(event, **fields)
+    journal.close()
+
+
+def test_replay_interrupted_draw(tmp_path):
+    path = tmp_path / 'test.journal'
+    write(path, ('integration', {'meter_start': 1.5}),
+          ('start', {'start': 1000.0}),
+          ('heartbeat', {'elapsed': 60.0, 'energy': 100.0}),
+          ('draw_start', {'draw': 0, 'elapsed': 60.0}),
+          ('draw_end', {'draw': 0}),
+          ('heartbeat', {'elapsed': 120.0, 'energy': 250.0}),
+          ('draw_start', {'draw': 1, 'elapsed': 120.0}))
+    state = replay(str(path))
+    assert state.start == 1000.0
+    assert state.elapsed == 120.0
+    assert state.next_draw == 2
+    assert state.interrupted_draw == 1
+    assert state.meter_start == 1.5
+    assert state.host_energy == 250.0
+    assert not state.finished
+
+
+def test_replay_after_resume_and_finish(tmp_path):
+    path = tmp_path / 'test.journal'
+    write(path, ('start', {'start': 1000.0}),
+          ('heartbeat', {'elapsed': 60.0}))
+    write(path, ('resume', {'origin': 1100.0, 'elapsed': 60.0, 'draw': 0}),
+          ('start', {'start': 2000.0}),
+          ('finish', {'elapsed': 180.0}))
+    state = replay(str(path))
+    # The first start is the test's start
+    assert state.start == 1000.0
+    assert state.interrupted_draw is None
+    assert state.finished
+
+
+def test_replay_skips_partial_line(tmp_path):
+    path = tmp_path / 'test.journal'
+    write(path, ('start', {'start': 1000.0}),
+          ('heartbeat', {'elapsed': 60.0}))
+    with open(path, 'a') as f:
+        f.write('{"event": "heartbeat", "elap')
+    # Reopening keeps the partial line from swallowing the next event
+    write(path, ('heartbeat', {'elapsed': 180.0}))
+    assert replay(str(path)).elapsed == 180.0
+
+
+def test_replay_without_start(tmp_path):
+    path = tmp_path / 'test.journal'
+    write(path, ('heartbeat', {'elapsed': 60.0}))
+    with pytest.raises(ValueError):
+        replay(str(path))
@@ -0,0 +1,99 @@
+import json
+import logging
+from types import SimpleNamespace
+
+import pytest
+
+import tc_tools.log
+from tc_tools.instruments import PowerMeter
+from tc_tools.log import (JsonFormatter, RateLimitFilter, TextFormatter,
+                          setup_logging)
+from tc_tools.sim import (SimClock, SimPowerMeterResource, SimResourceManager,
+                          WaterHeaterPlant)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=0.0)
+    monkeypatch.setattr(tc_tools.log, 'time',
+                        SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def record(msg, name='DAQ', level=logging.WARNING, **extra):
+    entry = logging.LogRecord(name, level, __file__, 1, msg, None, None)
+    entry.__dict__.update(extra)
+    return entry
+
+
+def test_burst_then_suppressed(clock):
+    rate_limit = RateLimitFilter(burst=2, period=60)
+    assert [rate_limit.filter(record('Bad readings')) for _ in range(4)] == \
+        [True, True, False, False]
+    clock.now = 61
+    passed = record('Bad readings')
+    assert rate_limit.filter(passed)
+    assert passed.suppressed == 2
+    assert TextFormatter('%(message)s').format(passed) == \
+        'Bad readings (2 similar messages suppressed)'
+
+
+def test_keyed_by_logger_level_and_key(clock):
+    rate_limit = RateLimitFilter(burst=1, period=60)
+    assert rate_limit.filter(record('Bad readings on 101', key='bad'))
+    # Same key, different text
+    assert not rate_limit.filter(record('Bad readings on 102', key='bad'))
+    assert rate_limit.filter(record('Bad readings on 102', name='Bath'))
+    assert rate_limit.filter(record('Bad readings on 102', level=logging.INFO))
+
+
+def test_shared_instance_counts_each_record_once(clock):
+    rate_limit = RateLimitFilter(burst=2, period=60)
+    decisions = []
+    for _ in range(3):
+        entry = record('Bad readings')
+        # As when the file and console handlers share the filter
+        decisions.append([rate_limit.filter(entry), rate_limit.filter(entry)])
+    assert decisions == [[True, True], [True, True], [False, False]]
+
+
+def test_json_fields():
+    entry = record('Set flow', level=logging.INFO, instrument='SIM::DAQ',
+                   command='SOURCE:VOLT 5', latency=0.1, suppressed=3)
+    fields = json.loads(JsonFormatter().format(entry))
+    assert fields['message'] == 'Set flow'
+    assert fields['level'] == 'INFO'
+    assert fields['logger'] == 'DAQ'
+    assert fields['instrument'] == 'SIM::DAQ'
+    assert fields['command'] == 'SOURCE:VOLT 5'
+    assert fields['latency'] == 0.1
+    assert fields['suppressed'] == 3
+    assert 'channel' not in fields
+
+
+def test_instrument_info_logs_are_structured(tmp_path):
+    root = logging.getLogger('')
+    handlers, level = list(root.handlers), root.level
+    path = str(tmp_path / 'test.log')
+    address = 'SIM::LOG_POWER'
+    manager = SimResourceManager({address: SimPowerMeterResource(
+        WaterHeaterPlant())})
+    listener = setup_logging(path, structured=True)
+    try:
+        with SimClock():
+            PowerMeter(address, manager).reset_integration()
+    finally:
+        listener.stop()
+        # Stopping again, as at exit, does nothing
+        listener.stop()
+        for handler in root.handlers:
+            if handler not in handlers:
+                root.removeHandler(handler)
+                handler.close()
+        root.setLevel(level)
+    with open(path) as f:
+        entries = [json.loads(line) for line in f]
+    reset = [e for e in entries if 'command' in e]
+    assert reset and reset[0]['instrument'] == address
+    assert reset[0]['command'] == 'INTEG:RESET'
+    assert reset[0]['latency'] >= 0
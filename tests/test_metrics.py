@@ -0,0 +1,104 @@
+import urllib.request
+
+import pytest
+
+from tc_tools.instruments import DAQ
+from tc_tools.metrics import Metrics, MetricsFile, MetricsServer, registry
+from tc_tools.sim import SimClock, SimDAQResource, SimResourceManager
+from tc_tools.utils import PRTLogWriter
+
+
+def test_counters_and_gauges_by_label():
+    metrics = Metrics()
+    metrics.increment('bus_transactions', bus='GPIB0::9')
+    metrics.increment('bus_transactions', 2, bus='GPIB0::9')
+    metrics.increment('bus_transactions', bus='GPIB0::5')
+    metrics.set('last_reading', 25.5, channel='101')
+    metrics.set('drawing', True)
+    assert metrics.get('bus_transactions', bus='GPIB0::9') == 3
+    assert metrics.get('bus_transactions', bus='GPIB0::5') == 1
+    assert metrics.get('bus_transactions') == 0.0
+    assert metrics.get('last_reading', channel='101') == 25.5
+    assert metrics.get('drawing') == 1.0
+    assert metrics.get('missing', default=-1) == -1
+
+
+def test_label_order_does_not_matter():
+    metrics = Metrics()
+    metrics.increment('group_errors', group='draw', bus='GPIB0::9')
+    assert metrics.get('group_errors', bus='GPIB0::9', group='draw') == 1
+
+
+def test_jitter():
+    metrics = Metrics()
+    for seconds in (0.01, -0.03, 0.02):
+        metrics.observe_jitter(seconds)
+    assert metrics.get('scheduler_wakeups') == 3
+    assert metrics.get('scheduler_jitter_seconds_sum') == pytest.approx(0.06)
+    assert metrics.get('scheduler_jitter_seconds') == 0.02
+    assert metrics.get('scheduler_jitter_max_seconds') == 0.03
+
+
+def test_render():
+    metrics = Metrics(prefix='test')
+    metrics.increment('bus_errors', bus='GPIB0::9')
+    metrics.set('power_watts', 4500.0)
+    lines = metrics.render().splitlines()
+    assert 'test_bus_errors{bus="GPIB0::9"} 1' in lines
+    assert 'test_power_watts 4500' in lines
+    assert any(line.startswith('test_uptime_seconds ') for line in lines)
+    metrics.reset()
+    assert metrics.get('power_watts') == 0.0
+
+
+def test_metrics_file(tmp_path):
+    metrics = Metrics()
+    metrics.set('power_watts', 4500.0)
+    path = str(tmp_path / 'metrics.txt')
+    MetricsFile(path, metrics).write()
+    with open(path) as f:
+        assert 'tc_tools_power_watts 4500\n' in f.read()
+    assert not (tmp_path / 'metrics.txt.tmp').exists()
+
+
+def test_metrics_server():
+    metrics = Metrics()
+    metrics.set('power_watts', 4500.0)
+    server = MetricsServer(metrics, port=0)
+    server.start()
+    try:
+        host, port = server.server.server_address[:2]
+        with urllib.request.urlopen('http://{}:{}/'.format(host, port),
+                                    timeout=5) as response:
+            body = response.read().decode()
+    finally:
+        server.stop()
+    assert 'tc_tools_power_watts 4500' in body
+
+
+def test_instruments_count_transactions():
+    address = 'SIM::METRICS_DAQ'
+    manager = SimResourceManager({address: SimDAQResource(
+        {'101': lambda: 20.0, '102': lambda: 30.0})})
+    with SimClock():
+        daq = DAQ(address, manager)
+        daq.set_channels(['101', '102'])
+        daq.set_calibration('101', 1.0, 0.0)
+        daq.set_calibration('102', 1.0, 0.5)
+        before = registry.get('bus_transactions', bus=address)
+        assert daq.get_calibrated_temp() == [20.0, 30.5]
+    assert registry.get('bus_transactions', bus=address) == before + 1
+    assert registry.get('last_reading', channel='102') == 30.5
+
+
+def test_writers_count_rows(tmp_path):
+    path = str(tmp_path / 'prt.csv')
+    writer = PRTLogWriter(path)
+    before = registry.get('samples_written', writer='PRTLogWriter')
+    writer.log(25.0)
+    writer.flush(sync=True)
+    writer.output_file.close()
+    assert registry.get('samples_written',
+                        writer='PRTLogWriter') == before + 1
+    assert registry.get('writer_flush_seconds', writer='PRTLogWriter',
+                        sync=True) >= 0
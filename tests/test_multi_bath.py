@@ -0,0 +1,126 @@
+import csv
+import logging
+import threading
+
+import pytest
+
+from tc_tools.instruments import DAQ
+from tc_tools.metrics import registry
+from tc_tools.procedures import merge_outputs
+from tc_tools.sampling import ScanScheduler
+from tc_tools.sim import (SimClock, SimDAQResource, SimResourceManager,
+                          calibration_stand)
+from tc_tools.utils import steady_state_monitor
+
+# Three baths' thermocouples on one DAQ
+GROUPS = {'Bath 1': ['101', '102'], 'Bath 2': ['103', '104'],
+          'Bath 3': ['105', '106']}
+
+
+def temperature(channel):
+    return 20.0 + int(channel) % 100
+
+
+@pytest.fixture
+def resource():
+    return SimDAQResource({c: (lambda c=c: temperature(c))
+                           for group in GROUPS.values() for c in group})
+
+
+@pytest.fixture
+def daq(resource):
+    address = 'SIM::SHARED_DAQ'
+    clock = SimClock()
+    # Instrument sleeps take no time; the scheduler's window is real
+    clock.install(['tc_tools.instruments'])
+    daq = DAQ(address, SimResourceManager({address: resource}))
+    daq.set_channels([c for group in GROUPS.values() for c in group])
+    yield daq
+    clock.uninstall()
+
+
+def read_together(scheduler, groups):
+    results, errors = {}, {}
+    start = threading.Barrier(len(groups))
+
+    def read(name, channels):
+        start.wait()
+        try:
+            results[name] = scheduler.get_temp_uncalibrated(
+                as_dict=True, channels=channels)
+        except Exception as e:
+            errors[name] = e
+    threads = [threading.Thread(target=read, args=item)
+               for item in groups.items()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results, errors
+
+
+def test_requests_share_one_scan(daq, resource):
+    scheduler = ScanScheduler(daq, window=0.2)
+    queries = resource.queries
+    results, errors = read_together(scheduler, GROUPS)
+    assert not errors
+    assert resource.queries - queries == 1
+    assert registry.get('scan_batch_channels', bus=daq.address) == 6
+    for name, channels in GROUPS.items():
+        assert results[name] == {c: temperature(c) for c in channels}
+
+
+def test_later_requests_get_a_new_scan(daq, resource):
+    scheduler = ScanScheduler(daq, window=0.01)
+    queries = resource.queries
+    assert scheduler.get_temp_uncalibrated(channels=['101']) == [21.0]
+    assert scheduler.get_temp_uncalibrated(channels=['104']) == [24.0]
+    assert resource.queries - queries == 2
+    assert not scheduler._results and not scheduler._requests
+
+
+def test_scan_error_reaches_every_request(daq, resource):
+    def broken():
+        raise IOError('No response')
+    resource.temperatures['103'] = broken
+    scheduler = ScanScheduler(daq, window=0.2)
+    results, errors = read_together(scheduler, GROUPS)
+    assert not results
+    assert set(errors) == set(GROUPS)
+    assert all(isinstance(e, IOError) for e in errors.values())
+
+
+def write_csv(path, headers, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f, dialect='excel')
+        writer.writerow(headers)
+        writer.writerows(rows)
+
+
+def test_merge_outputs(tmp_path):
+    first = str(tmp_path / 'bath1.csv')
+    second = str(tmp_path / 'bath2.csv')
+    merged = str(tmp_path / 'merged.csv')
+    write_csv(first, ['Time', 'PRT', 'TC 1'],
+              [['2024-01-01 00:00:00', '20.0', '20.1'],
+               ['2024-01-01 00:02:00', '40.0', '40.1']])
+    write_csv(second, ['Time', 'PRT', 'TC 2'],
+              [['2024-01-01 00:01:00', '30.0', '30.2']])
+    merge_outputs([first, second, str(tmp_path / 'missing.csv')],
+                  ['Bath 1', 'Bath 2', 'Bath 3'], merged)
+    with open(merged, newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert list(rows[0]) == ['Time', 'Group', 'PRT', 'TC 1', 'TC 2']
+    assert [row['Group'] for row in rows] == ['Bath 1', 'Bath 2', 'Bath 1']
+    assert rows[1]['TC 2'] == '30.2' and rows[1]['TC 1'] == ''
+
+
+def test_steady_state_logged_by_group(caplog, capsys):
+    stand = calibration_stand(['101'])
+    caplog.set_level(logging.DEBUG, logger='Steady State Bath 2')
+    with stand.clock:
+        assert steady_state_monitor(stand.prt, group='Bath 2')
+    assert capsys.readouterr().out == ''
+    readings = [r for r in caplog.records if r.name == 'Steady State Bath 2']
+    assert len(readings) >= 60
+    assert readings[-1].getMessage().startswith('PRT ')
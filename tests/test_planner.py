@@ -0,0 +1,38 @@
+from itertools import permutations
+
+import pytest
+
+from tc_tools.planner import BathRateModel, plan_order, total_time
+
+
+def test_heating_sweep_from_below():
+    model = BathRateModel()
+    assert plan_order([60, 20, 40], 10, model) == [20.0, 40.0, 60.0]
+
+
+def test_cooling_sweep_from_above():
+    model = BathRateModel()
+    assert plan_order([20, 60, 40], 80, model) == [60.0, 40.0, 20.0]
+
+
+def test_exact_order_is_optimal():
+    # Slow cooling makes the best order less obvious than a sweep
+    model = BathRateModel(heat_rate=1 / 60, cool_rate=0.1 / 60, settle=300)
+    points = [35, 5, 50, 20, 80, 65]
+    order = plan_order(points, 30, model)
+    assert sorted(order) == sorted(float(p) for p in points)
+    best = min(total_time(p, 30, model) for p in permutations(points))
+    assert total_time(order, 30, model) == pytest.approx(best)
+
+
+def test_large_sets_sweep():
+    model = BathRateModel()
+    points = list(range(0, 100, 5))
+    assert plan_order(points, -10, model, exact_limit=4) == \
+        [float(p) for p in points]
+
+
+@pytest.mark.parametrize('points', [[], [42]])
+def test_trivial_sets(points):
+    assert plan_order(points, 20, BathRateModel()) == \
+        [float(p) for p in points]
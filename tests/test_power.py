@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from tc_tools.metrics import registry
+from tc_tools.power import PowerSampler
+from tc_tools.sim import simulated_use_stand
+
+
+@pytest.fixture
+def stand():
+    stand = simulated_use_stand()
+    with stand.clock:
+        yield stand
+
+
+def transactions(stand):
+    return registry.get('bus_transactions', bus=stand.power_meter.address)
+
+
+def test_trapezoidal_energy(stand):
+    sampler = PowerSampler(stand.power_meter, reconcile_every=0)
+    watts = []
+    for _ in range(20):
+        watts.append(sampler.sample())
+        stand.clock.sleep(5)
+    times, sampled = sampler.buffer()
+    assert list(sampled) == watts
+    expected = np.sum(0.5 * (sampled[1:] + sampled[:-1]) * np.diff(times))
+    assert sampler.energy == pytest.approx(expected)
+    assert sampler.window_energy(times[0]) == \
+        pytest.approx(expected / 3600)
+    assert sampler.cumulative_energy()[1][-1] == \
+        pytest.approx(expected / 3600)
+
+
+def test_ring_buffer_keeps_latest(stand):
+    sampler = PowerSampler(stand.power_meter, capacity=4, reconcile_every=0)
+    for _ in range(6):
+        sampler.sample()
+        stand.clock.sleep(5)
+    times, _ = sampler.buffer()
+    assert times.size == 4
+    assert np.all(np.diff(times) > 0)
+    assert times[-1] == sampler.times[(sampler.count - 1) % 4]
+
+
+def test_details_once_a_minute(stand):
+    sampler = PowerSampler(stand.power_meter, reconcile_every=0)
+    sampler.reset()
+    first = sampler.read()
+    assert set(first) == {'watts', 'energy', 'volts', 'amps'}
+    assert first['volts'] == pytest.approx(stand.plant.line_voltage)
+    for _ in range(11):
+        assert sampler.read()['energy'] == first['energy']
+    # A minute at 5 s: one reselect back to watts after the details, and
+    # the details with their three reselects
+    before = transactions(stand)
+    for _ in range(12):
+        sampler.read()
+    assert transactions(stand) - before == 27
+
+
+def test_reconcile_against_meter(stand):
+    meter = stand.power_meter
+    meter.reset_integration()
+    meter.start_integration()
+    sampler = PowerSampler(meter, reconcile_every=60)
+    sampler.reset()
+    # Cold enough that the element stays on throughout
+    stand.plant.tank.temps[:] = 30.0
+    for _ in range(120):
+        sampler.sample()
+        stand.clock.sleep(sampler.interval)
+    host, metered, difference = sampler.reconcile()
+    assert host > 1
+    assert difference < sampler.tolerance
+    assert registry.get('energy_mismatch') == difference
+
+
+def test_reconcile_warns_without_integration(stand, caplog):
+    sampler = PowerSampler(stand.power_meter)
+    sampler.reset()
+    # Cold enough that the element stays on throughout
+    stand.plant.tank.temps[:] = 30.0
+    for _ in range(120):
+        sampler.sample()
+        stand.clock.sleep(sampler.interval)
+    assert 'Check that integration is running' in caplog.text
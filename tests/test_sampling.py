@@ -0,0 +1,160 @@
+import threading
+
+import pytest
+
+from tc_tools.metrics import registry
+from tc_tools.procedures import draw
+from tc_tools.sampling import MultiRateSampler, SampleGroup
+from tc_tools.sim import simulated_use_stand
+from tc_tools.sim.clock import PATCHED_MODULES
+from tc_tools.utils import DrawWriter
+
+
+class Counter:
+    """A group read that counts its calls"""
+
+    def __init__(self, signal: str, error: Exception = None):
+        self.signal = signal
+        self.error = error
+        self.calls = 0
+
+    def __call__(self) -> dict:
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return {self.signal: float(self.calls)}
+
+
+@pytest.fixture
+def running():
+    samplers = []
+
+    def start(groups):
+        sampler = MultiRateSampler(groups)
+        sampler.start()
+        samplers.append(sampler)
+        return sampler
+    yield start
+    for sampler in samplers:
+        sampler.stop()
+
+
+def test_publish_updates_latest_and_subscribers():
+    sampler = MultiRateSampler([SampleGroup('draw', 1.0, Counter('weight'))])
+    frames = []
+    sampler.subscribe(frames.append)
+    assert not sampler.wait_for('draw', 0, timeout=0)
+    frame = sampler.publish('draw', {'weight': 1.5, 'inlet': 14.4},
+                            started=100.0)
+    assert frames == [frame]
+    assert frame.time == 100.0 and frame.group == 'draw'
+    assert sampler.latest == {'weight': 1.5, 'inlet': 14.4}
+    assert sampler.latest_time['weight'] == 100.0
+    assert sampler.groups['draw'].reads == 1
+    assert sampler.wait_for('draw', 0, timeout=0)
+    assert not sampler.wait_for('draw', 1, timeout=0.01)
+
+
+def test_groups_read_at_their_rates(running):
+    fast, slow = Counter('weight'), Counter('tank')
+    sampler = running([SampleGroup('draw', 0.01, fast),
+                       SampleGroup('minutely', 0.1, slow)])
+    assert sampler.wait_for('minutely', 2, timeout=5)
+    sampler.stop()
+    assert fast.calls > 3 * slow.calls
+    assert sampler.latest['tank'] == slow.calls
+
+
+def test_activated_group_read_right_away(running):
+    draw = Counter('weight')
+    sampler = running([SampleGroup('draw', 60, draw, active=False),
+                       SampleGroup('minutely', 60, Counter('tank'))])
+    assert sampler.wait_for('minutely', 0, timeout=5)
+    assert draw.calls == 0
+    sampler.activate('draw')
+    assert sampler.wait_for('draw', 0, timeout=5)
+    sampler.activate('draw', False)
+    assert draw.calls == 1
+
+
+def test_read_errors_counted(running):
+    before = registry.get('group_errors', group='failing')
+    failing = Counter('weight', IOError('No response'))
+    sampler = running([SampleGroup('failing', 0.01, failing),
+                       SampleGroup('minutely', 0.01, Counter('tank'))])
+    # The other group goes on being read
+    assert sampler.wait_for('minutely', 5, timeout=5)
+    sampler.stop()
+    assert sampler.groups['failing'].reads == 0
+    assert registry.get('group_errors', group='failing') - before == \
+        failing.calls > 0
+    assert not sampler.thread.is_alive()
+
+
+def test_reads_simulated_stand():
+    stand = simulated_use_stand()
+    channels = stand.channels
+    inlet, outlet = channels['inlet'], channels['outlet']
+    # Instrument sleeps take no time; the sampler keeps real time
+    stand.clock.install(['tc_tools.instruments'])
+    try:
+        stand.daq.set_channels([inlet, outlet])
+        frames = []
+        received = threading.Event()
+
+        def subscriber(frame):
+            frames.append(frame)
+            received.set()
+        sampler = MultiRateSampler([SampleGroup(
+            'draw', 60, lambda: stand.daq.scan([inlet, outlet]))])
+        sampler.subscribe(subscriber)
+        sampler.start()
+        assert received.wait(5)
+        sampler.stop()
+    finally:
+        stand.clock.uninstall()
+    assert frames[0].group == 'draw'
+    assert frames[0].values[inlet] == pytest.approx(
+        stand.plant.tank.inlet_temp, abs=0.05)
+
+
+@pytest.fixture
+def stand():
+    stand = simulated_use_stand()
+    # Procedures and instruments sleep in simulated time; the sampler
+    # waits in real time
+    stand.clock.install([name for name in PATCHED_MODULES
+                         if name != 'tc_tools.sampling'])
+    yield stand
+    stand.clock.uninstall()
+
+
+def draw_writer(stand, tmp_path):
+    channels = stand.channels
+    stand.daq.set_channels([channels['inlet'], channels['outlet']])
+    return DrawWriter(['Elapsed', 'Inlet Temperature', 'Outlet Temperature',
+                       'Scale Weight'], str(tmp_path / 'draws.csv'),
+                      channels['inlet'], channels['outlet'], stand.daq,
+                      stand.scale)
+
+
+def test_draw_from_sampler(stand, tmp_path, running):
+    writer = draw_writer(stand, tmp_path)
+    sampler = running([SampleGroup('draw', 0.001, writer.read_data,
+                                   active=False)])
+    draw(1.7, 1, stand.draw_solenoid, stand.weigh_solenoid, stand.scale,
+         stand.flow_valve, writer, sampler, set_flow=True)
+    assert sampler.latest['weight'] >= 8.217
+    assert not sampler.groups['draw'].active
+    assert not stand.plant.flow.draw_open
+
+
+def test_draw_stops_when_reads_fail(stand, tmp_path, running):
+    writer = draw_writer(stand, tmp_path)
+    failing = Counter('weight', IOError('No response'))
+    sampler = running([SampleGroup('draw', 0.01, failing, active=False)])
+    with pytest.raises(IOError):
+        draw(1.7, 1, stand.draw_solenoid, stand.weigh_solenoid, stand.scale,
+             stand.flow_valve, writer, sampler, set_flow=True)
+    # The draw solenoid is closed before the error is raised
+    assert not stand.plant.flow.draw_open
@@ -0,0 +1,125 @@
+import csv
+import time
+
+import pytest
+
+import tc_tools.utils
+from tc_tools.instruments import DAQ
+from tc_tools.sim import (FirstOrderBath, SimClock, SimDAQResource,
+                          SimResourceManager, StratifiedTank, calibration_stand,
+                          simulated_use_stand)
+from tc_tools.utils import steady_state_monitor
+
+
+def test_tank_standby_loss():
+    tank = StratifiedTank(deadband=100)
+    stored = tank.capacity * tank.temps.sum()
+    tank.advance(600)
+    assert not tank.heating
+    lost = stored - tank.capacity * tank.temps.sum()
+    # 2 W/K over the whole tank
+    assert lost == pytest.approx(2.0 * (51.7 - 19.7) * 600, rel=0.01)
+
+
+def test_tank_heats_after_a_draw():
+    tank = StratifiedTank()
+    tank.advance(60, flow=10)
+    assert tank.temps[-1] < tank.temps[0]
+    assert tank.outlet_temp == pytest.approx(51.7, abs=0.5)
+    assert tank.advance(10) == tank.heater_power * 10
+    for _ in range(360):
+        tank.advance(10)
+    assert not tank.heating
+    assert tank.temps[tank.heater_node] >= tank.set_point - 0.5
+
+
+def test_bath_rate_limited():
+    bath = FirstOrderBath(temp=20.0, noise=0.0)
+    bath.set_point = 80.0
+    bath.advance(60)
+    assert bath.temp == 20.0
+    bath.running = True
+    bath.advance(60)
+    assert bath.temp == pytest.approx(21.0)
+    for _ in range(200):
+        bath.advance(60)
+    assert bath.temp == pytest.approx(80.0, abs=0.01)
+
+
+def test_clock_advances_models_and_timers():
+    clock = SimClock(start=1000.0)
+    steps, calls = [], []
+    clock.add_model(steps.append)
+    clock.every(60, lambda: calls.append(clock.time()))
+    clock.sleep(150)
+    assert clock.time() == 1150.0
+    assert calls == [1000.0, 1060.0, 1120.0]
+    assert sum(steps) == pytest.approx(150.0)
+
+
+def test_clock_patches_modules():
+    real = tc_tools.utils.time
+    with SimClock(start=0.0) as clock:
+        assert tc_tools.utils.time is clock
+        tc_tools.utils.time.sleep(3600)
+        assert clock.time() == 3600.0
+        # Everything else comes from the real module
+        assert tc_tools.utils.time.strftime('%Y') == time.strftime('%Y')
+    assert tc_tools.utils.time is real
+
+
+def test_daq_scans_simulated_signals():
+    resource = SimDAQResource({'101': lambda: 25.0})
+    with SimClock():
+        daq = DAQ('SIM::SIM_TEST_DAQ', SimResourceManager(
+            {'SIM::SIM_TEST_DAQ': resource}))
+        daq.set_channels(['101'])
+        assert daq.get_temp_uncalibrated() == [25.0]
+    with pytest.raises(IOError):
+        resource.query('SYST:ERR?')
+
+
+def test_use_stand_instruments_drive_plant():
+    stand = simulated_use_stand()
+    with stand.clock:
+        stand.weigh_solenoid.close()
+        stand.flow_valve.set_flow(2.0)
+        stand.draw_solenoid.open()
+        assert stand.plant.flow.flow == pytest.approx(2.0)
+        stand.clock.sleep(60)
+        stand.draw_solenoid.close()
+        # Two gallons in the weigh tank
+        assert stand.scale.weigh() == pytest.approx(2 * 8.217, rel=0.02)
+        assert stand.power_meter.read_volts() == \
+            pytest.approx(stand.plant.line_voltage)
+
+
+def test_calibration_stand_reaches_steady_state():
+    stand = calibration_stand(['101', '102'], errors=[0.2, -0.1])
+    with stand.clock:
+        stand.bath.start()
+        stand.bath.set_temp(40.0)
+        start = stand.clock.time()
+        assert steady_state_monitor(stand.prt)
+        elapsed = stand.clock.time() - start
+        stand.daq.set_channels(['101', '102'])
+        readings = stand.daq.get_temp_uncalibrated()
+    assert stand.prt.get_temp() == pytest.approx(40.0, abs=0.1)
+    # Limited to 1 C/min, then ten steady minutes
+    assert elapsed > 30 * 60
+    assert readings == pytest.approx([40.2, 39.9], abs=0.1)
+
+
+def test_simulated_use_files(simulated_day):
+    with open(simulated_day.data_file, newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 8 * 60 + 1
+    assert float(rows[-1]['Elapsed']) == pytest.approx(8 * 3600, abs=5)
+    drawing = [row['Draw Status'] == 'True' for row in rows]
+    # Minutely rows go on through the draws
+    assert 10 < sum(drawing) < 60
+    assert drawing[0]
+    with open(simulated_day.draw_file, newline='') as f:
+        draws = list(csv.DictReader(f))
+    weights = [float(row['Scale Weight']) for row in draws]
+    assert max(weights) == pytest.approx(15 * 8.217, rel=0.02)
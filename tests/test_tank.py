@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from tc_tools.sim import simulated_use_stand
+from tc_tools.tank import CP_WATER, KG_PER_GAL, TankState
+
+CHANNELS = ['101', '102', '103']
+
+
+def temps(top, middle, bottom, inlet=15.0):
+    return {'101': top, '102': middle, '103': bottom, '107': inlet}
+
+
+def test_weighted_mean_and_energy():
+    state = TankState(CHANNELS, volume=50, fractions=[1, 2, 1],
+                      inlet_channel='107')
+    state.update(temps(60.0, 50.0, 40.0), timestamp=0.0)
+    assert state.mean == pytest.approx(50.0)
+    assert state.maximum == 60.0
+    assert state.uniformity == pytest.approx(10.0)
+    assert state.top_bottom == pytest.approx(20.0)
+    assert state.energy == pytest.approx(50 * KG_PER_GAL * CP_WATER * 35.0)
+    assert state.stratification == pytest.approx(np.sqrt(50.0))
+
+
+def test_invalid_nodes_left_out():
+    state = TankState(CHANNELS)
+    state.update(temps(60.0, np.nan, 40.0))
+    assert state.mean == pytest.approx(50.0)
+    assert list(state.valid_weights) == [0.5, 0.0, 0.5]
+    state.update(temps(np.nan, np.nan, np.nan))
+    assert np.isnan(state.mean) and np.isnan(state.stratification)
+
+
+def test_rates():
+    state = TankState(CHANNELS, volume=50, inlet_channel='107')
+    state.update(temps(60.0, 50.0, 40.0), timestamp=0.0)
+    assert np.isnan(state.rate) and np.isnan(state.energy_rate)
+    state.update(temps(61.0, 51.0, 41.0), timestamp=60.0)
+    assert state.rate == pytest.approx(1 / 60)
+    assert state.energy_rate == pytest.approx(
+        50 * KG_PER_GAL * CP_WATER / 60)
+    assert state.stratification_rate == pytest.approx(0.0)
+    # A node dropping out is not a change in the tank
+    state.update(temps(61.0, np.nan, 41.0), timestamp=120.0)
+    assert np.isnan(state.rate) and np.isnan(state.energy_rate)
+    assert np.isnan(state.stratification_rate)
+
+
+def test_fractions_must_match_channels():
+    with pytest.raises(ValueError):
+        TankState(CHANNELS, fractions=[1, 1])
+
+
+def test_wait_for_update():
+    state = TankState(CHANNELS)
+    assert not state.wait_for_update(0, timeout=0.01)
+    state.update(temps(60.0, 50.0, 40.0))
+    assert state.wait_for_update(0, timeout=0.01)
+
+
+def test_tracks_simulated_tank():
+    stand = simulated_use_stand()
+    channels = stand.channels
+    state = TankState(channels['tank'], inlet_channel=channels['inlet'])
+    with stand.clock:
+        stand.daq.set_channels(channels['tank'] + [channels['inlet']])
+        state.update(stand.daq.get_calibrated_temp(as_dict=True))
+    # The thermocouples read the plant's nodes to within their resolution
+    assert state.mean == pytest.approx(stand.plant.tank.temps.mean(),
+                                       abs=0.05)
+    assert state.inlet == pytest.approx(stand.plant.tank.inlet_temp,
+                                        abs=0.05)
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from tc_tools.thermocouple import emf_to_temp, temp_to_emf, volts_to_temp
+
+
+@pytest.mark.parametrize('tc_type, temp, emf', [
+    # NIST Monograph 175 table values, in microvolts
+    ('T', 100, 4279), ('T', -100, -3379), ('T', 300, 14862),
+    ('K', 100, 4096), ('K', 500, 20644), ('K', -100, -3554),
+    ('J', 100, 5269), ('J', 500, 27393)])
+def test_reference_tables(tc_type, temp, emf):
+    assert temp_to_emf(temp, tc_type)[0] == pytest.approx(emf, abs=1)
+
+
+@pytest.mark.parametrize('tc_type, temps', [
+    # Inside the inverse ranges, whose ends are rounded to the microvolt
+    ('T', np.linspace(-200, 400, 61)), ('K', np.linspace(-190, 1300, 150)),
+    ('J', np.linspace(-200, 1190, 140))])
+def test_inverse_round_trip(tc_type, temps):
+    # The inverse polynomials are good to within 0.06 C of the reference
+    emf = temp_to_emf(temps, tc_type)
+    assert np.allclose(emf_to_temp(emf, tc_type), temps, atol=0.06)
+
+
+def test_zero_emf_at_zero():
+    assert temp_to_emf(0.0, 'T')[0] == 0
+    assert emf_to_temp(0.0, 'T')[0] == pytest.approx(0, abs=1e-3)
+
+
+def test_out_of_range_is_nan():
+    assert np.isnan(temp_to_emf(500, 'T')[0])
+    assert np.isnan(emf_to_temp(1e6, 'T')[0])
+
+
+def test_unsupported_type():
+    with pytest.raises(ValueError):
+        temp_to_emf(20, 'X')
+
+
+def test_volts_to_temp_cold_junction():
+    cold_junction = 23.5
+    temps = np.array([10.0, 51.7, 100.0])
+    types = ['T', 'K', 'J']
+    volts = [(temp_to_emf(t, k)[0] - temp_to_emf(cold_junction, k)[0]) / 1e6
+             for t, k in zip(temps, types)]
+    assert np.allclose(volts_to_temp(volts, types, cold_junction), temps,
+                       atol=0.06)
+    assert np.allclose(volts_to_temp(volts[:1] * 2, 'T', cold_junction),
+                       [10.0, 10.0], atol=0.06)
@@ -0,0 +1,61 @@
+import numpy as np
+
+from tc_tools.validity import ChannelValidator, Scan, valid_readings
+
+CHANNELS = ['101', '102', '103']
+
+
+def test_range_check():
+    validator = ChannelValidator(low=0, high=100)
+    valid = validator.check(CHANNELS, np.array([20.0, 150.0, np.nan]), 0)
+    assert valid.tolist() == [True, False, False]
+
+
+def test_rate_check():
+    validator = ChannelValidator(max_rate=1.0)
+    validator.check(CHANNELS, np.array([20.0, 20.0, 20.0]), 0)
+    valid = validator.check(CHANNELS, np.array([25.0, 35.0, 20.0]), 10)
+    assert valid.tolist() == [True, False, True]
+
+
+def test_quarantine_and_probe():
+    validator = ChannelValidator(quarantine_after=3, probe_interval=600)
+    bad = np.array([20.0, -50.0, 20.0])
+    for now in range(3):
+        assert validator.to_read(CHANNELS, now) == CHANNELS
+        validator.check(CHANNELS, bad, now)
+    assert list(validator.quarantined) == ['102']
+    assert validator.to_read(CHANNELS, 10) == ['101', '103']
+
+    # A failed probe keeps the channel out until the next probe
+    assert validator.to_read(CHANNELS, 602) == CHANNELS
+    validator.check(CHANNELS, bad, 602)
+    assert validator.to_read(CHANNELS, 700) == ['101', '103']
+
+    # Channels not read do not count as failures or recoveries
+    validator.check(['101', '103'], np.array([20.0, 20.0]), 700)
+    assert '102' in validator.quarantined
+
+    validator.check(CHANNELS, np.array([20.0, 21.0, 20.0]), 1202)
+    assert not validator.quarantined
+    assert validator.to_read(CHANNELS, 1203) == CHANNELS
+
+
+def test_release():
+    validator = ChannelValidator(quarantine_after=1)
+    validator.check(CHANNELS, np.array([20.0, -50.0, 20.0]), 0)
+    validator.release()
+    assert validator.to_read(CHANNELS, 1) == CHANNELS
+
+
+def test_valid_readings():
+    scan = Scan(CHANNELS, np.array([20.0, -50.0, 21.0]),
+                np.array([True, False, True]), 0)
+    readings = valid_readings(scan, ['103', '102'])
+    assert readings[0] == 21.0 and np.isnan(readings[1])
+    try:
+        valid_readings(scan, ['102'])
+    except IOError:
+        pass
+    else:
+        raise AssertionError('No valid readings should raise')